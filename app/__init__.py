@@ -1,4 +1,3 @@
-import logging
 import os
 
 from dotenv import load_dotenv
@@ -6,57 +5,107 @@ from flask import Flask
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from flask_pymongo import PyMongo
 from flask_session import Session
 from flask_socketio import SocketIO
 
+from app.db import Mongo
+from app.hashing import PasswordHasher
+from app.log import configure_logging
+from app.metrics import init_app as init_metrics
+from app.query_profiler import QueryProfiler
+from app.query_profiler import init_app as init_query_profiler
+from app.serialization import CodecJSONProvider, create_codec
 from config.config import Config
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Initialize the Flask application
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Set up extensions
-bcrypt = Bcrypt(app)
-CORS(app, supports_credentials=True)
-mongo = PyMongo(app)
-jwt = JWTManager(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
-
-app.config["SESSION_TYPE"] = "mongodb"
-app.config["SESSION_MONGODB"] = mongo.cx
-app.config["SESSION_MONGODB_DB"] = "chat_app"
-app.config["SESSION_MONGODB_COLLECT"] = "sessions"
-app.config["SESSION_PERMANENT"] = False
-
-# Set up logging
-app.logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-app.logger.addHandler(handler)
-
-from app.auth import auth_bp
-from app.chat import chat_bp
-from app.chatbot import chatbot_bp
-from app.img_processing import image_bp
-from app.location import location_bp
-from app.notifications import notification_bp
-from app.relations import family_bp
-from app.reminder import reminder_bp
-
-app.register_blueprint(auth_bp, url_prefix="/v1/auth")
-app.register_blueprint(reminder_bp, url_prefix="/v1/reminders")
-app.register_blueprint(family_bp, url_prefix="/v1/family")
-app.register_blueprint(notification_bp, url_prefix="/v1/notifications")
-app.register_blueprint(location_bp, url_prefix="/v1/location")
-app.register_blueprint(chat_bp, url_prefix="/v1/chatroom")
-app.register_blueprint(chatbot_bp, url_prefix="/v1/assistant")
-app.register_blueprint(image_bp, url_prefix="/v1/vision")
-
-# Ensure the upload folder exists
-if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-    os.makedirs(app.config["UPLOAD_FOLDER"])
+# Extensions are bound to the app in create_app(). Mongo connects lazily in
+# each process, so the app can be built before gunicorn forks its workers
+bcrypt = Bcrypt()
+password_hasher = PasswordHasher(bcrypt)
+jwt = JWTManager()
+mongo = Mongo()
+socketio = SocketIO()
+query_profiler = QueryProfiler()
+
+
+def create_app(config=Config):
+    """Function to build the Flask application.
+
+    Builds everything that is safe to share between forked workers: the
+    app, its blueprints, the vision models and the face galleries. Database
+    and network clients are created per process on first use, or from the
+    gunicorn ``post_fork`` hook.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # Set up logging; module loggers under "app" share the queue handler
+    configure_logging(app)
+
+    # Set up extensions
+    bcrypt.init_app(app)
+    password_hasher.init_app(app)
+    CORS(app, supports_credentials=True)
+    query_profiler.slow_ms = app.config["SLOW_QUERY_MS"]
+    mongo.init_app(app, event_listeners=[query_profiler])
+    # One codec for responses and socket packets; it encodes ObjectIds and
+    # datetimes, so documents can be returned without converting them
+    json_codec = create_codec(app.config["JSON_BACKEND"])
+    app.json = CodecJSONProvider(app, json_codec)
+    jwt.init_app(app)
+    # A message queue lets every worker emit to clients connected to the others
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"],
+        channel=app.config["SOCKETIO_CHANNEL"],
+        json=json_codec,
+    )
+    # Per-route latency, status and in-flight metrics, served at /metrics
+    init_metrics(app)
+    # Query counts, DB time and N+1 warnings for every request
+    init_query_profiler(app, query_profiler)
+
+    app.config["SESSION_TYPE"] = "mongodb"
+    app.config["SESSION_MONGODB_DB"] = "chat_app"
+    app.config["SESSION_MONGODB_COLLECT"] = "sessions"
+    app.config["SESSION_PERMANENT"] = False
+
+    @mongo.on_connect
+    def use_session_client():
+        app.config["SESSION_MONGODB"] = mongo.cx
+
+    from app import chat, ids, location, notifications
+    from app.auth import auth_bp
+    from app.chat import chat_bp
+    from app.chatbot import chatbot_bp
+    from app.img_processing import image_bp
+    from app.location import location_bp
+    from app.notifications import notification_bp
+    from app.relations import family_bp
+    from app.reminder import reminder_bp
+    from app.users import users
+
+    # Module singletons take their settings from this app, not from Config
+    ids.init_app(app)
+    users.init_app(app)
+    chat.init_app(app)
+    location.init_app(app)
+    notifications.init_app(app)
+
+    app.register_blueprint(auth_bp, url_prefix="/v1/auth")
+    app.register_blueprint(reminder_bp, url_prefix="/v1/reminders")
+    app.register_blueprint(family_bp, url_prefix="/v1/family")
+    app.register_blueprint(notification_bp, url_prefix="/v1/notifications")
+    app.register_blueprint(location_bp, url_prefix="/v1/location")
+    app.register_blueprint(chat_bp, url_prefix="/v1/chatroom")
+    app.register_blueprint(chatbot_bp, url_prefix="/v1/assistant")
+    app.register_blueprint(image_bp, url_prefix="/v1/vision")
+
+    # Ensure the upload folder exists
+    if not os.path.exists(app.config["UPLOAD_FOLDER"]):
+        os.makedirs(app.config["UPLOAD_FOLDER"])
+
+    return app
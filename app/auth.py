@@ -1,27 +1,89 @@
-import uuid
+import logging
+import os
 from datetime import timedelta
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint
+from flask import current_app as App
+from flask import jsonify, request
 from flask_jwt_extended import (create_access_token, get_jwt_identity,
                                 jwt_required)
 from pymongo.errors import PyMongoError
 from werkzeug.exceptions import BadRequest
 
-from app import bcrypt, mongo
-from config.config import Config
+from app import mongo, password_hasher
+from app.auth_backends import AuthError, AuthUnavailable, create_auth_client
+from app.hashing import HashingBusy
+from app.ids import new_user_id
+from app.metrics import observe_outbound, registry
+from app.query_profiler import query_budget
+from app.users import users
 
+logger = logging.getLogger(__name__)
 auth_bp = Blueprint("auth", __name__)
 # Access the MongoDB users collection
 user_collection = mongo.db.users
 families_collection = mongo.db.families
-authenticate = Config.init_firebase()
 
+# Firebase answers for these when the email or password is wrong
+INVALID_CREDENTIALS = {
+    "INVALID_LOGIN_CREDENTIALS",
+    "INVALID_PASSWORD",
+    "EMAIL_NOT_FOUND",
+}
 
-def generate_custom_id():
-    """Generate a unique user ID with a 'USID' prefix."""
-    prefix = "USID"
-    unique_id = uuid.uuid4().hex[:4]  # Generate a unique ID
-    return f"{prefix}{unique_id.upper()}"  # Return the ID with prefix
+auth_logins = registry.counter(
+    "lumi_auth_logins_total",
+    "Sign-in attempts by where the password was checked and the outcome.",
+    ("method", "outcome"),
+)
+
+
+@mongo.on_connect
+def create_user_indexes():
+    """Function to create the user indexes once this process is connected"""
+    user_collection.create_index("userId", unique=True)
+    # Sign-in looks users up by email
+    user_collection.create_index("email")
+
+
+# pid -> identity provider client, created on first use in each worker
+_auth_clients = {}
+
+
+def get_auth_client():
+    """Function to return this process's identity provider client"""
+    client = _auth_clients.get(os.getpid())
+    if client is None:
+        client = _auth_clients[os.getpid()] = create_auth_client(
+            App.config,
+            on_request=lambda operation, seconds, outcome: observe_outbound(
+                "firebase", operation, seconds, outcome
+            ),
+        )
+    return client
+
+
+def login_response(user):
+    """Function to issue the JWT for a signed-in user"""
+    access_token = create_access_token(
+        identity=str(user["userId"]), expires_delta=timedelta(weeks=1)
+    )
+    return jsonify(
+        {
+            "status": "success",
+            "message": "Login Successful",
+            "token": access_token,
+        }
+    )
+
+
+def busy_response():
+    """Function to turn a refused password hash into a retryable 503"""
+    response = jsonify(
+        {"status": "error", "message": "Server busy, please try again shortly."}
+    )
+    response.headers["Retry-After"] = "1"
+    return response, 503
 
 
 def validate_password(password):
@@ -59,19 +121,23 @@ def sign_up_user():
         if existing_user:
             return jsonify({"status": "error", "message": "User already exists"}), 400
 
+        # Hashed first, so a busy server refuses before Firebase has an account
         try:
-            firebase_user = authenticate.create_user_with_email_and_password(
-                email, password
-            )
+            password_hash = password_hasher.generate(password)
+        except HashingBusy:
+            return busy_response()
+
+        try:
+            firebase_user = get_auth_client().sign_up(email, password)
             firebase_uid = firebase_user["localId"]
 
-            custom_id = generate_custom_id()
+            custom_id = new_user_id()
 
             new_user = {
                 "name": name,
                 "email": email,
                 "mobile": mobile,
-                "password": bcrypt.generate_password_hash(password).decode("utf-8"),
+                "password": password_hash,
                 "role": role,
                 "userId": custom_id,
                 "firebase_uid": firebase_uid,
@@ -87,6 +153,16 @@ def sign_up_user():
                 201,
             )
 
+        except AuthUnavailable:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Authentication service unavailable, please try again.",
+                    }
+                ),
+                503,
+            )
         except Exception as e:
             return jsonify({"status": "error", "message": str(e)}), 400
 
@@ -111,38 +187,29 @@ def sign_in_user():
         email = data.get("email")
         password = data.get("password")
 
+        # The bcrypt hash stored at sign-up answers most logins without a
+        # round trip to Firebase. It is skipped after a password reset, when
+        # only Firebase knows the new password
+        user = user_collection.find_one({"email": email}) if email else None
         try:
-            firebase_user = authenticate.sign_in_with_email_and_password(
-                email, password
-            )
-            firebase_uid = firebase_user["localId"]
+            if (
+                user
+                and password
+                and user.get("password")
+                and not user.get("password_stale")
+                and password_hasher.check(user["password"], password)
+            ):
+                auth_logins.inc("local", "ok")
+                return login_response(user)
+        except HashingBusy:
+            auth_logins.inc("local", "busy")
+            return busy_response()
 
-            user = user_collection.find_one({"firebase_uid": firebase_uid})
-            if not user:
-                return (
-                    jsonify(
-                        {"status": "error", "message": "User not found in database"}
-                    ),
-                    404,
-                )
-
-            access_token = create_access_token(
-                identity=str(user["userId"]), expires_delta=timedelta(weeks=1)
-            )
-            return jsonify(
-                {
-                    "status": "success",
-                    "message": "Login Successful",
-                    "token": access_token,
-                }
-            )
-
-        except Exception as e:
-            # Handle the error by checking for INVALID_LOGIN_CREDENTIALS specifically
-            error_message = str(e)
-
-            # Check if the error message contains "INVALID_LOGIN_CREDENTIALS"
-            if "INVALID_LOGIN_CREDENTIALS" in error_message:
+        try:
+            firebase_user = get_auth_client().sign_in(email, password)
+        except AuthError as e:
+            auth_logins.inc("firebase", "rejected")
+            if e.code in INVALID_CREDENTIALS:
                 return (
                     jsonify(
                         {"status": "error", "message": "Invalid email or password"}
@@ -160,6 +227,43 @@ def sign_in_user():
                 ),
                 401,
             )
+        except AuthUnavailable as e:
+            auth_logins.inc("firebase", "unavailable")
+            logger.warning("Firebase sign-in unavailable: %s", e)
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Authentication service unavailable, please try again.",
+                    }
+                ),
+                503,
+            )
+
+        firebase_uid = firebase_user["localId"]
+        if not user or user.get("firebase_uid") != firebase_uid:
+            user = user_collection.find_one({"firebase_uid": firebase_uid})
+        if not user:
+            return (
+                jsonify({"status": "error", "message": "User not found in database"}),
+                404,
+            )
+
+        # Firebase accepted a password the local hash did not match, e.g.
+        # after a reset, so the next login can be checked locally again
+        try:
+            user_collection.update_one(
+                {"_id": user["_id"]},
+                {
+                    "$set": {"password": password_hasher.generate(password)},
+                    "$unset": {"password_stale": ""},
+                },
+            )
+        except HashingBusy:
+            # Left stale; a later Firebase login refreshes it
+            pass
+        auth_logins.inc("firebase", "ok")
+        return login_response(user)
     except Exception as e:
         return (
             jsonify(
@@ -174,6 +278,7 @@ def sign_in_user():
 
 
 @auth_bp.route("/get-userdata", methods=["POST"])
+@query_budget(4)
 @jwt_required()  # Protect this route with JWT
 def get_user_data():
     """Retrieve user data based on user ID."""
@@ -183,29 +288,24 @@ def get_user_data():
         if not user_id:
             return None
 
-        user = user_collection.find_one({"userId": user_id})
+        user = users.get(user_id)
         if not user:
             return None
         family = families_collection.find_one({"family_id": user["family_id"]})
-        members_details = []
-        patient_details = []
-        if family and "members" in family:
-            members_ids = family["members"]
-            members_details = list(
-                user_collection.find(
-                    {"userId": {"$in": members_ids}},
-                    {"_id": 0, "userId": 1, "name": 1},
-                )
-            )
-
-        if family and "patient" in family:
-            patient_id = family["patient"]
-            patient_details = list(
-                user_collection.find(
-                    {"userId": patient_id},
-                    {"_id": 0, "userId": 1, "name": 1},
-                )
-            )
+        members_ids = (family or {}).get("members", [])
+        patient_ids = [family["patient"]] if family and "patient" in family else []
+        # Members and patient are usually cached; the rest load in one query
+        found = users.get_many(members_ids + patient_ids)
+        members_details = [
+            {"userId": member_id, "name": found[member_id].get("name")}
+            for member_id in members_ids
+            if member_id in found
+        ]
+        patient_details = [
+            {"userId": patient_id, "name": found[patient_id].get("name")}
+            for patient_id in patient_ids
+            if patient_id in found
+        ]
 
         user_data = {
             "userId": user["userId"],
@@ -234,7 +334,11 @@ def reset_password():
             return jsonify({"status": "error", "message": "Email is required"}), 400
 
         try:
-            authenticate.send_password_reset_email(email)
+            get_auth_client().send_password_reset(email)
+            # The new password is only known to Firebase once the link is used
+            user_collection.update_one(
+                {"email": email}, {"$set": {"password_stale": True}}
+            )
             return (
                 jsonify(
                     {
@@ -265,7 +369,6 @@ def update_personal_info():
     """Function to update personal info"""
     try:
         data = request.json
-        print(data)
         user_id = data.get("userId")
 
         if not user_id:
@@ -284,6 +387,7 @@ def update_personal_info():
             )
 
         result = user_collection.update_one({"userId": user_id}, {"$set": update_data})
+        users.invalidate(user_id)
 
         if result.matched_count == 0:
             return jsonify({"status": "error", "message": "User not found"}), 404
@@ -303,16 +407,16 @@ def update_personal_info():
             200,
         )
     except BadRequest as e:
-        print(f"Bad request error: {str(e)}")
+        logger.warning("Bad request error: %s", e)
         return jsonify({"status": "error", "message": "Invalid request data"}), 400
     except PyMongoError as e:
-        print(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         return jsonify({"status": "error", "message": "Databse error occurred"}), 500
     except KeyError as e:
-        print(f"Key errir: {str(e)}")
+        logger.warning("Key error: %s", e)
         return jsonify({"status": "error", "message": "Required data missing"}), 400
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         return (
             jsonify({"status": "error", "message": "An unexpected error occurred"}),
             500,
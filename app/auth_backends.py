@@ -0,0 +1,143 @@
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FIREBASE_AUTH_URL = "https://identitytoolkit.googleapis.com/v1/accounts:{}"
+
+
+class AuthError(Exception):
+    """Raised when the identity provider rejects a request.
+
+    ``code`` is the provider's error code, such as
+    ``INVALID_LOGIN_CREDENTIALS`` or ``EMAIL_EXISTS``.
+    """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class AuthUnavailable(Exception):
+    """Raised when the identity provider cannot be reached in time."""
+
+
+class FirebaseAuthClient:
+    """Firebase Authentication REST client.
+
+    Pyrebase posts through a fresh connection per call and without a
+    timeout; this client keeps one pooled ``requests.Session`` and fails
+    with ``AuthUnavailable`` once ``timeout`` runs out. Every call is
+    reported to ``on_request(operation, seconds, outcome)``.
+    """
+
+    def __init__(self, api_key, timeout=5.0, pool_size=10, on_request=None):
+        self.api_key = api_key
+        # (connect, read) so a dead host fails fast
+        self.timeout = (min(timeout, 3.05), timeout)
+        self.on_request = on_request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+
+    def sign_up(self, email, password):
+        """Function to create an account; returns the response with ``localId``"""
+        return self._post(
+            "signUp",
+            {"email": email, "password": password, "returnSecureToken": True},
+            "sign_up",
+        )
+
+    def sign_in(self, email, password):
+        """Function to check a password; returns the response with ``localId``"""
+        return self._post(
+            "signInWithPassword",
+            {"email": email, "password": password, "returnSecureToken": True},
+            "sign_in",
+        )
+
+    def send_password_reset(self, email):
+        """Function to send a password reset email"""
+        return self._post(
+            "sendOobCode",
+            {"requestType": "PASSWORD_RESET", "email": email},
+            "reset_password",
+        )
+
+    def _post(self, method, payload, operation):
+        started = time.perf_counter()
+        try:
+            response = self.session.post(
+                FIREBASE_AUTH_URL.format(method),
+                params={"key": self.api_key},
+                json=payload,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            self._report(operation, started, type(e).__name__)
+            raise AuthUnavailable(str(e)) from e
+
+        self._report(operation, started, str(response.status_code))
+        if response.status_code >= 500:
+            raise AuthUnavailable(f"Firebase responded with {response.status_code}")
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        if not response.ok:
+            error = (body.get("error") or {}).get("message") or "UNKNOWN_ERROR"
+            # Messages look like "WEAK_PASSWORD : Password should be ..."
+            raise AuthError(error.split(" : ")[0])
+        return body
+
+    def _report(self, operation, started, outcome):
+        if self.on_request:
+            self.on_request(operation, time.perf_counter() - started, outcome)
+
+
+class StubAuthClient:
+    """In-memory identity provider for tests and local development.
+
+    Accounts live only as long as the process, so it must not be used in
+    production.
+    """
+
+    def __init__(self):
+        # email -> (localId, password)
+        self.accounts = {}
+        self.reset_requests = []
+
+    def sign_up(self, email, password):
+        if email in self.accounts:
+            raise AuthError("EMAIL_EXISTS")
+        local_id = uuid.uuid4().hex
+        self.accounts[email] = (local_id, password)
+        return {"localId": local_id, "email": email}
+
+    def sign_in(self, email, password):
+        account = self.accounts.get(email)
+        if account is None or account[1] != password:
+            raise AuthError("INVALID_LOGIN_CREDENTIALS")
+        return {"localId": account[0], "email": email}
+
+    def send_password_reset(self, email):
+        if email not in self.accounts:
+            raise AuthError("EMAIL_NOT_FOUND")
+        self.reset_requests.append(email)
+        return {"email": email}
+
+
+def create_auth_client(config, on_request=None):
+    """Function to build the identity provider named by ``AUTH_BACKEND``"""
+    backend = config["AUTH_BACKEND"]
+    if backend == "stub":
+        return StubAuthClient()
+    if backend == "firebase":
+        return FirebaseAuthClient(
+            config["FIREBASE_API_KEY"],
+            timeout=config["FIREBASE_TIMEOUT"],
+            pool_size=config["FIREBASE_POOL_SIZE"],
+            on_request=on_request,
+        )
+    raise ValueError(f"Unknown AUTH_BACKEND {backend!r}")
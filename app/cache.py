@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ``ttl`` seconds after being set.
+
+    Meant for read-through lookups of data that rarely changes: read with
+    ``get_many``, load the missing keys from the database and store them
+    with ``set_many``. Writers call ``invalidate``. Each process keeps its
+    own cache, so the TTL bounds how long another worker's change can go
+    unnoticed.
+
+    A load that started before an invalidation must not store the value it
+    read, so ``set_many`` takes the ``epoch()`` seen before loading and
+    drops the values if anything was invalidated in between.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._epoch = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def epoch(self):
+        """Function to read the invalidation counter before loading values"""
+        return self._epoch
+
+    def get(self, key, default=None):
+        """Function to read one live entry"""
+        found, _ = self.get_many([key])
+        return found.get(key, default)
+
+    def get_many(self, keys):
+        """Function to read live entries; returns ``(found, missing_keys)``"""
+        now = self.clock()
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key, _MISSING)
+                if entry is not _MISSING and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    if entry is not _MISSING:
+                        del self._entries[key]
+                    missing.append(key)
+            self._hits += len(found)
+            self._misses += len(missing)
+        return found, missing
+
+    def set(self, key, value, epoch=None):
+        """Function to store one entry"""
+        self.set_many({key: value}, epoch)
+
+    def set_many(self, values, epoch=None):
+        """Function to store entries unless an invalidation happened since ``epoch``"""
+        expires = self.clock() + self.ttl
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return
+            for key, value in values.items():
+                self._entries[key] = (value, expires)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Function to drop entries after the underlying data changed"""
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Function to drop every entry"""
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Function to report the cache size and hit rate"""
+        total = self._hits + self._misses
+        return {
+            "size": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hitRate": round(self._hits / total, 3) if total else None,
+        }
@@ -1,30 +1,201 @@
-import random
+import atexit
+import hashlib
+import logging
 from datetime import datetime
-from string import ascii_uppercase
 
+import click
 import pytz
-from flask import Blueprint, jsonify, request, session
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint
+from flask import current_app as App
+from flask import jsonify, request, session
 from flask_socketio import close_room, join_room, leave_room, send
-from pymongo.errors import PyMongoError
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from werkzeug.exceptions import BadRequest
 
 from app import mongo, socketio
-
+from app.chat_writer import MessageWriter
+from app.ids import room_codes
+from app.metrics import track_event
+from app.presence import create_presence_store
+from app.room_registry import RoomRegistry
+from app.users import users
+
+logger = logging.getLogger(__name__)
 chat_bp = Blueprint("chat", __name__)
 rooms_collection = mongo.db.rooms
-messages_collection = mongo.db.messages
-user_collection = mongo.db.users
+# One document per message, paginated newest first by ``_id``
+messages_collection = mongo.db.chat_messages
+# Pre-pagination storage: a single ``{"roomId", "messages": [...]}`` per room
+legacy_messages_collection = mongo.db.messages
 families_collection = mongo.db.families
 
-user_sessions = {}
+
+@mongo.on_connect
+def create_chat_indexes():
+    """Function to create the chat indexes once this process is connected"""
+    rooms_collection.create_index("room", unique=True)
+    messages_collection.create_index([("roomId", ASCENDING), ("_id", DESCENDING)])
+    # roomId is an equality prefix, so a search only walks that room's text keys
+    messages_collection.create_index(
+        [("roomId", ASCENDING), ("message", TEXT)], name="room_message_text"
+    )
+
+
+# The singletons below are configured from the app by init_app()
+
+# Messages are broadcast first and persisted in batches off the event handler
+message_writer = MessageWriter(messages_collection)
+atexit.register(message_writer.close)
+
+# Socket sessions and room presence, shared between workers when configured
+presence = create_presence_store()
+
+# Rooms and live membership are served from memory and snapshotted to Mongo
+room_registry = RoomRegistry(rooms_collection, presence)
+atexit.register(room_registry.snapshot)
+
+
+def init_app(app):
+    """Function to configure the chat singletons from the app config"""
+    global presence
+    message_writer.init_app(app)
+    presence = create_presence_store(app.config["PRESENCE_STORE_URL"])
+    room_registry.presence = presence
+    room_registry.init_app(app)
 
 
-def generate_unique_code(length):
-    """Function ot generate a unique code for room creation"""
-    while True:
-        code = "".join(random.choice(ascii_uppercase) for _ in range(length))
-        if not rooms_collection.find_one({"roomId": code}):
+def create_room_code(family_id, attempts=3):
+    """Function to create a room under a fresh code and return the code"""
+    for attempt in range(attempts):
+        code = room_codes.next()
+        try:
+            room_registry.create_room(code, family_id)
             return code
+        except DuplicateKeyError:
+            # New codes never repeat; only one left by the old random
+            # generator can be taken already
+            if attempt == attempts - 1:
+                raise
+
+
+def legacy_message_id(room, index, message, fallback_seconds):
+    """Function to derive a stable ObjectId for a legacy message.
+
+    The timestamp comes from the message's IST ``createdAt``, so migrated
+    messages keep their place on the ``(roomId, _id)`` cursor. The room and
+    the position in the legacy array make the ID unique and the same on
+    every retry.
+    """
+    try:
+        created = datetime.strptime(message["createdAt"], "%Y-%m-%d %H:%M:%S")
+        seconds = int(pytz.timezone("Asia/Kolkata").localize(created).timestamp())
+    except (KeyError, TypeError, ValueError):
+        seconds = fallback_seconds
+    room_hash = hashlib.blake2b(room.encode("utf-8"), digest_size=4).digest()
+    return ObjectId(seconds.to_bytes(4, "big") + room_hash + index.to_bytes(4, "big"))
+
+
+def migrate_legacy_messages(room):
+    """Function to move a room's legacy message array into per-message documents"""
+    legacy = legacy_messages_collection.find_one({"roomId": room})
+    if not legacy:
+        return
+    # Messages without a usable createdAt sort at the legacy document's age
+    if isinstance(legacy["_id"], ObjectId):
+        fallback_seconds = int(legacy["_id"].generation_time.timestamp())
+    else:
+        fallback_seconds = int(datetime.now(pytz.utc).timestamp())
+    messages = [
+        {
+            **message,
+            "_id": legacy_message_id(room, index, message, fallback_seconds),
+            "roomId": room,
+        }
+        for index, message in enumerate(legacy.get("messages") or [])
+    ]
+    if messages:
+        try:
+            messages_collection.insert_many(messages, ordered=False)
+        except BulkWriteError as e:
+            # Deterministic IDs make a retry or a concurrent join idempotent:
+            # duplicates are messages that are already migrated
+            details = e.details
+            if details.get("writeConcernErrors") or any(
+                error["code"] != 11000 for error in details.get("writeErrors", [])
+            ):
+                raise
+    # Only dropped once every message is stored, so a failed insert loses nothing
+    legacy_messages_collection.delete_one({"_id": legacy["_id"]})
+
+
+def serialize_message(message):
+    """Function to convert a stored message into its API representation"""
+    return {
+        "id": str(message["_id"]),
+        "name": message.get("name"),
+        "message": message.get("message"),
+        "createdAt": message.get("createdAt"),
+        "user": message.get("user"),
+    }
+
+
+def get_history_page_size(limit):
+    """Function to clamp a requested history page size to the configured bounds"""
+    if not isinstance(limit, int) or limit < 1:
+        return App.config["CHAT_HISTORY_PAGE_SIZE"]
+    return min(limit, App.config["CHAT_HISTORY_MAX_PAGE_SIZE"])
+
+
+def fetch_history(room, before=None, limit=None):
+    """Function to fetch one page of room history, newest page first.
+
+    ``before`` is the ``nextCursor`` of the previous page. Messages within the
+    page are returned oldest first so clients can prepend them directly.
+    """
+    limit = get_history_page_size(limit)
+    query = {"roomId": room}
+    if before:
+        query["_id"] = {"$lt": ObjectId(before)}
+
+    # Fetch one extra document to know whether an older page exists
+    docs = list(
+        messages_collection.find(query).sort("_id", DESCENDING).limit(limit + 1)
+    )
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    docs.reverse()
+
+    return {
+        "messages": [serialize_message(doc) for doc in docs],
+        "nextCursor": str(docs[0]["_id"]) if has_more else None,
+        "hasMore": has_more,
+    }
+
+
+def search_history(room, text, before=None, limit=None):
+    """Function to search a room's messages, newest matches first.
+
+    ``before`` is the ``nextCursor`` of the previous page of results.
+    """
+    limit = get_history_page_size(limit)
+    query = {"roomId": room, "$text": {"$search": text}}
+    if before:
+        query["_id"] = {"$lt": ObjectId(before)}
+
+    docs = list(
+        messages_collection.find(query).sort("_id", DESCENDING).limit(limit + 1)
+    )
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    return {
+        "messages": [serialize_message(doc) for doc in docs],
+        "nextCursor": str(docs[-1]["_id"]) if has_more else None,
+        "hasMore": has_more,
+    }
 
 
 # Create Room API
@@ -43,7 +214,7 @@ def create_room():
             )
 
         # Check if room for this family already exists
-        existing_room = rooms_collection.find_one({"family": family_id})
+        existing_room = room_registry.get_family_room(family_id)
         if existing_room:
             return (
                 jsonify(
@@ -56,10 +227,7 @@ def create_room():
                 400,
             )
 
-        room_code = generate_unique_code(8)
-        rooms_collection.insert_one(
-            {"room": room_code, "members": 0, "family": family_id}
-        )
+        room_code = create_room_code(family_id)
         return jsonify(
             {
                 "message": f"Room created for family {family_id}",
@@ -68,13 +236,13 @@ def create_room():
             }
         )
     except BadRequest as e:
-        print(f"Bad request error: {str(e)}")
+        logger.warning("Bad request error: %s", e)
         return jsonify({"status": "error", "message": "Invalid request data"}), 400
     except PyMongoError as e:
-        print(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         return jsonify({"status": "error", "message": "Database error occurred"}), 500
     except KeyError as e:
-        print(f"Key error: {str(e)}")
+        logger.warning("Key error: %s", e)
         return (
             jsonify(
                 {"status": "error", "message": "Missing required data in the database"}
@@ -82,7 +250,7 @@ def create_room():
             500,
         )
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         return (
             jsonify({"status": "error", "message": "An unexpected error occurred"}),
             500,
@@ -113,11 +281,11 @@ def join_room_api():
                 404,
             )
 
-        room_data = rooms_collection.find_one({"room": room})
+        room_data = room_registry.get_room(room)
         if not room_data:
             return jsonify({"status": "error", "message": "Room not found"}), 404
 
-        user = user_collection.find_one({"userId": user_id})
+        user = users.get(user_id)
 
         if room_data["family"] != user["family_id"]:
             return (
@@ -130,8 +298,8 @@ def join_room_api():
                 401,
             )
 
-        messages_data = messages_collection.find_one({"roomId": room})
-        messsages = messages_data["messages"] if messages_data else []
+        migrate_legacy_messages(room)
+        history = fetch_history(room, limit=data.get("limit"))
 
         session["name"] = name
         session["room"] = room
@@ -141,34 +309,138 @@ def join_room_api():
                 "status": "success",
                 "message": f"{name} joined room {room}",
                 "room": room,
-                "messages": messsages,
+                "messages": history["messages"],
+                "nextCursor": history["nextCursor"],
+                "hasMore": history["hasMore"],
             }
         )
     except BadRequest as e:
-        print(f"Bad request error: {str(e)}")
+        logger.warning("Bad request error: %s", e)
         return jsonify({"status": "error", "message": "Invalid request data"}), 400
     except PyMongoError as e:
-        print(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         return jsonify({"status": "error", "message": "Database error occurred"}), 500
     except KeyError as e:
-        print(f"Key error: {str(e)}")
+        logger.warning("Key error: %s", e)
         return jsonify({"status": "error", "message": "Required data not found"}), 404
     except TypeError as e:
-        print(f"Type error: {str(e)}")
+        logger.warning("Type error: %s", e)
         return (
             jsonify({"status": "error", "message": "Invalid data type in request"}),
             400,
         )
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
+        return (
+            jsonify({"status": "error", "message": "An unexpected error occurred"}),
+            500,
+        )
+
+
+# Chat History API
+@chat_bp.route("/history", methods=["GET"])
+def get_room_history():
+    """Function to page through older messages of the joined room"""
+    try:
+        room = request.args.get("room")
+        before = request.args.get("before")
+        limit = request.args.get("limit", type=int)
+
+        if not room:
+            return jsonify({"status": "error", "message": "Room ID is required"}), 400
+
+        if session.get("room") != room:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Join the room before reading its history",
+                    }
+                ),
+                401,
+            )
+
+        history = fetch_history(room, before=before, limit=limit)
+        return jsonify({"status": "success", "room": room, **history})
+    except InvalidId as e:
+        logger.warning("Invalid cursor: %s", e)
+        return jsonify({"status": "error", "message": "Invalid history cursor"}), 400
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        return (
+            jsonify({"status": "error", "message": "An unexpected error occurred"}),
+            500,
+        )
+
+
+# Chat Search API
+@chat_bp.route("/search", methods=["GET"])
+def search_room_messages():
+    """Function to search the message history of the joined room"""
+    try:
+        room = request.args.get("room")
+        text = request.args.get("q", "").strip()
+        before = request.args.get("before")
+        limit = request.args.get("limit", type=int)
+
+        if not room or not text:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Room ID and search text are required",
+                    }
+                ),
+                400,
+            )
+
+        if session.get("room") != room:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Join the room before searching its history",
+                    }
+                ),
+                401,
+            )
+
+        results = search_history(room, text, before=before, limit=limit)
+        return jsonify({"status": "success", "room": room, "query": text, **results})
+    except InvalidId as e:
+        logger.warning("Invalid cursor: %s", e)
+        return jsonify({"status": "error", "message": "Invalid search cursor"}), 400
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
         return (
             jsonify({"status": "error", "message": "An unexpected error occurred"}),
             500,
         )
 
 
+# Message writer health API
+@chat_bp.route("/writer-stats", methods=["GET"])
+def get_writer_stats():
+    """Function to report the chat write-behind queue depth and lag"""
+    return jsonify({"status": "success", "writer": message_writer.stats()})
+
+
+@chat_bp.cli.command("replay-dead-letters")
+def replay_dead_letters():
+    """Write chat messages spilled to CHAT_DEAD_LETTER_PATH back to MongoDB."""
+    count = message_writer.replay_dead_letters()
+    click.echo(f"Replayed {count} chat messages")
+
+
 # SocketIO connection event
 @socketio.on("connect")
+@track_event("connect")
 def connect():
     """Function to connect to a socket room"""
     sid = request.sid
@@ -187,47 +459,46 @@ def connect():
             )
             return
 
-        room_data = rooms_collection.find_one({"room": room})
+        room_data = room_registry.get_room(room)
         if not room_data:
             send({"status": "error", "message": "Room not found"}, to=sid)
             return
 
-        user_sessions[sid] = {"room": room, "name": name, "user": user}
+        presence.save_session(sid, {"room": room, "name": name, "user": user})
         join_room(room)
-        rooms_collection.update_one(
-            {"room": room}, {"$inc": {"members": 1}}, upsert=True
-        )
+        room_registry.connect(sid, room, user)
     except PyMongoError as e:
-        print(f"Database error during connection: {str(e)}")
+        logger.error("Database error during connection: %s", e)
         send({"status": "error", "message": "Database error occurred"}, to=sid)
     except BadRequest as e:
-        print(f"Bad request error: {str(e)}")
+        logger.warning("Bad request error: %s", e)
         send(
             {"status": "error", "message": "Bad request. Invalid data or session"},
             to=sid,
         )
     except Exception as e:
-        print(f"Unexpected error during connectionL {str(e)}")
+        logger.exception("Unexpected error during connection: %s", e)
         send({"status": "error", "message": "An unexpected error occurred"}, to=sid)
 
 
 # Handle incoming messages
 @socketio.on("message")
+@track_event("message")
 def handle_message(data):
     """Function to send message in the socket room"""
     sid = request.sid
     try:
-        room = user_sessions.get(sid, {}).get("room")
-        name = user_sessions.get(sid, {}).get("name")
-        user = user_sessions.get(sid, {}).get("user")
+        user_session = presence.get_session(sid) or {}
+        room = user_session.get("room")
+        name = user_session.get("name")
+        user = user_session.get("user")
         message_content = data.get("message")
 
         if not room or not name or not message_content:
             send({"status": "error", "message": "Invalid data"}, to=sid)
             return
 
-        room_data = rooms_collection.find_one({"room": room})
-        if not room_data:
+        if not room_registry.has_code(room):
             send({"status": "error", "message": "Room not found"}, to=sid)
             return
 
@@ -240,46 +511,46 @@ def handle_message(data):
             "createdAt": ist_time.strftime("%Y-%m-%d %H:%M:%S"),
             "user": user,
         }
-        send(content, to=room)
-        messages_collection.update_one(
-            {"roomId": room}, {"$push": {"messages": content}}, upsert=True
-        )
+        message_id = ObjectId()
+        send({**content, "id": str(message_id)}, to=room)
+        message_writer.enqueue({"_id": message_id, "roomId": room, **content})
     except KeyError as e:
-        print(f"Key error: {str(e)}")
+        logger.warning("Key error: %s", e)
         send(
             {"status": "error", "message": "Missing required user session data"}, to=sid
         )
     except PyMongoError as e:
-        print(f"Database error: {str(e)}")
+        logger.error("Database error: %s", e)
         send({"status": "error", "message": "Database error occurred"}, to=sid)
     except ValueError as e:
-        print(f"Value error: {str(e)}")
+        logger.warning("Value error: %s", e)
         send({"status": "error", "message": "Invalid data provided"}, to=sid)
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        logger.exception("Unexpected error: %s", e)
         send({"status": "error", "message": "An unexpected error occurred"}, to=sid)
 
 
 # Socket disconnection event
 @socketio.on("disconnect")
+@track_event("disconnect")
 def disconnect():
     """Function to disconnect from the socket room"""
     try:
         sid = request.sid
-        room = user_sessions.get(sid, {}).get("room")
+        user_session = presence.pop_session(sid) or {}
+        room = user_session.get("room")
 
         if room:
             leave_room(room)
-            try:
-                rooms_collection.update_one({"room": room}, {"$inc": {"members": -1}})
-                updated_room = rooms_collection.find_one({"room": room})
-
-                if updated_room and updated_room["members"] <= 0:
-                    close_room(room)
-                    print(f"Room deleted: {room}")
-                    rooms_collection.delete_one({"room": room})
-            except PyMongoError as db_error:
-                print(f"Database error during room update or deletion: {str(db_error)}")
-            del user_sessions[sid]
+            members = room_registry.disconnect(sid, room, user_session.get("user"))
+
+            # None: the store is down and the registry retries the leave
+            if members is not None and members <= 0:
+                close_room(room)
+                logger.info("Room deleted: %s", room)
+                room_registry.delete_room(room)
+    except presence.errors as e:
+        # The session key expires on its own once the store is back
+        logger.error("Presence store error during disconnect: %s", e)
     except (KeyError, TypeError, AttributeError) as e:
-        print(f"Error during disconnect: {str(e)}")
+        logger.error("Error during disconnect: %s", e)
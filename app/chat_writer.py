@@ -0,0 +1,236 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+from bson import json_util
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Duplicate key errors on retry mean an earlier attempt already stored the message
+DUPLICATE_KEY_ERROR = 11000
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Write-behind queue that persists chat messages with batched bulk writes.
+
+    Messages are enqueued after they have been broadcast, and a background
+    thread writes them once ``batch_size`` messages are pending or
+    ``flush_interval`` seconds have passed since the oldest one arrived.
+    Documents must carry their own ``_id`` so retried batches stay idempotent.
+
+    The messages were already seen by the room, so a failed batch is retried
+    with backoff capped at ``max_backoff`` for as long as new messages still
+    fit in the queue. Once the queue is full, or the writer is stopping
+    after ``max_retries``, the batch is appended to ``dead_letter_path`` as
+    extended JSON lines, to be written back with ``replay_dead_letters``.
+    """
+
+    def __init__(
+        self,
+        collection,
+        batch_size=100,
+        flush_interval=0.5,
+        max_queue=10000,
+        max_retries=3,
+        max_backoff=5.0,
+        dead_letter_path=None,
+    ):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.dead_letter_path = dead_letter_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._in_flight_since = None
+        self._written = 0
+        self._failed = 0
+        self._spilled = 0
+        self._batches = 0
+        self._last_batch_size = 0
+        self._last_flush_seconds = 0.0
+
+    def init_app(self, app):
+        """Function to size the writer from the app config"""
+        self.batch_size = app.config["CHAT_WRITE_BATCH_SIZE"]
+        self.flush_interval = app.config["CHAT_WRITE_FLUSH_INTERVAL"]
+        self.max_backoff = app.config["CHAT_WRITE_MAX_BACKOFF"]
+        self.dead_letter_path = app.config["CHAT_DEAD_LETTER_PATH"]
+        self._queue.maxsize = app.config["CHAT_WRITE_QUEUE_SIZE"]
+
+    def enqueue(self, document):
+        """Function to queue a message document for persistence.
+
+        Blocks when the queue is full so a stalled database applies
+        backpressure instead of growing memory without bound.
+        """
+        self._ensure_started()
+        self._queue.put((time.monotonic(), document))
+
+    def flush(self):
+        """Function to block until every queued message has been written"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """Function to flush pending messages and stop the writer thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def stats(self):
+        """Function to report queue depth, lag and write counters"""
+        now = time.monotonic()
+        oldest = self._in_flight_since
+        with self._queue.mutex:
+            if self._queue.queue:
+                queued_at = self._queue.queue[0][0]
+                oldest = queued_at if oldest is None else min(oldest, queued_at)
+            pending = len(self._queue.queue)
+
+        return {
+            "pending": pending,
+            "lagSeconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "written": self._written,
+            "failed": self._failed,
+            "spilled": self._spilled,
+            "batches": self._batches,
+            "lastBatchSize": self._last_batch_size,
+            "lastFlushSeconds": round(self._last_flush_seconds, 4),
+        }
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="chat-message-writer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._drain()
+            if not batch:
+                continue
+            self._in_flight_since = batch[0][0]
+            try:
+                self._write([document for _, document in batch])
+            finally:
+                self._in_flight_since = None
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _drain(self):
+        """Function to collect one batch, bounded by size and by flush interval"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = batch[0][0] + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and not self._stopping.is_set():
+                break
+            try:
+                batch.append(self._queue.get(timeout=max(remaining, 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def replay_dead_letters(self):
+        """Function to write spilled messages back; returns how many were stored"""
+        if not self.dead_letter_path or not os.path.exists(self.dead_letter_path):
+            return 0
+        # Renamed first so batches spilled meanwhile go to a fresh file
+        replaying = f"{self.dead_letter_path}.{os.getpid()}.replay"
+        os.replace(self.dead_letter_path, replaying)
+        with open(replaying, encoding="utf-8") as f:
+            documents = [json_util.loads(line) for line in f if line.strip()]
+        if documents and not self._write(documents, spill=False):
+            os.replace(replaying, self.dead_letter_path)
+            raise PyMongoError(f"Could not replay {len(documents)} chat messages")
+        os.remove(replaying)
+        return len(documents)
+
+    def _write(self, documents, spill=True):
+        started = time.perf_counter()
+        requests = [InsertOne(document) for document in documents]
+        written = False
+
+        attempt = 0
+        while True:
+            try:
+                self.collection.bulk_write(requests, ordered=False)
+                written = True
+                break
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if all(error.get("code") == DUPLICATE_KEY_ERROR for error in errors):
+                    written = True
+                    break
+                logger.warning("Chat message bulk write error: %s", e)
+            except PyMongoError as e:
+                logger.warning("Chat message database error: %s", e)
+
+            attempt += 1
+            # Waiting blocks enqueue() only once the queue is full; past that
+            # point, or on shutdown, the batch is spilled instead
+            out_of_time = self._stopping.is_set() or not spill
+            if self._queue.full() or (out_of_time and attempt > self.max_retries):
+                break
+            time.sleep(min(0.1 * 2 ** min(attempt - 1, 16), self.max_backoff))
+
+        if written:
+            self._written += len(documents)
+        elif spill:
+            self._spill(documents, attempt)
+
+        self._batches += 1
+        self._last_batch_size = len(documents)
+        self._last_flush_seconds = time.perf_counter() - started
+        return written
+
+    def _spill(self, documents, attempts):
+        """Function to keep a batch that could not be written on local disk"""
+        self._failed += len(documents)
+        if self.dead_letter_path:
+            try:
+                lines = "".join(json_util.dumps(doc) + "\n" for doc in documents)
+                # One unbuffered append, so workers sharing the file do not
+                # interleave their lines
+                with open(self.dead_letter_path, "ab", buffering=0) as f:
+                    f.write(lines.encode("utf-8"))
+            except OSError as e:
+                logger.error("Could not write chat dead letters: %s", e)
+            else:
+                self._spilled += len(documents)
+                logger.error(
+                    "Spilled %d chat messages to %s after %d attempts",
+                    len(documents),
+                    self.dead_letter_path,
+                    attempts,
+                )
+                return
+        logger.error(
+            "Dropped %d chat messages after %d attempts: %s",
+            len(documents),
+            attempts,
+            [str(document.get("_id")) for document in documents],
+        )
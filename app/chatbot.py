@@ -1,8 +1,12 @@
+import logging
 import os
 
 from flask import Blueprint, jsonify, request
 from google import genai
 
+from app.metrics import timed
+
+logger = logging.getLogger(__name__)
 chatbot_bp = Blueprint("chatbot", __name__)
 
 
@@ -38,9 +42,11 @@ def chatbot():
 
         user_prompt = {"role": "user", "parts": [{"text": user_message}]}
 
-        response = client.models.generate_content(
-            model=os.getenv("GEMINI_MODEL"), contents=[context_message, user_prompt]
-        )
+        with timed("gemini", "generate_content"):
+            response = client.models.generate_content(
+                model=os.getenv("GEMINI_MODEL"),
+                contents=[context_message, user_prompt],
+            )
 
         reply = (
             response.text
@@ -51,8 +57,8 @@ def chatbot():
         return jsonify({"status": "success", "reply": reply}), 200
 
     except ValueError as e:
-        print(f"Value Error: {str(e)}")
+        logger.warning("Value error: %s", e)
         return jsonify({"status": "error", "message": "An error occurred"}), 400
     except KeyError as e:
-        print(f"Key Error: {str(e)}")
+        logger.warning("Key error: %s", e)
         return jsonify({"status": "error", "message": "Missing expected key"}), 400
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+
+import pymongo
+from flask_pymongo.helpers import BSONObjectIdConverter
+from pymongo import uri_parser
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class LazyCollection:
+    """Stands in for a collection until this process has a client.
+
+    Blueprint modules keep module-level collection globals; every attribute
+    access is forwarded to the collection of the current process's client.
+    """
+
+    def __init__(self, mongo, name):
+        self._mongo = mongo
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._mongo.collection(self._name), attr)
+
+    def __getitem__(self, name):
+        return self._mongo.collection(self._name)[name]
+
+    def __repr__(self):
+        return f"LazyCollection({self._name!r})"
+
+
+class LazyDatabase:
+    """Database handle whose collections are resolved on first use."""
+
+    def __init__(self, mongo):
+        self._mongo = mongo
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        # Database methods such as command() need the real database
+        if hasattr(Database, name):
+            return getattr(self._mongo.database(), name)
+        return LazyCollection(self._mongo, name)
+
+    def __getitem__(self, name):
+        return LazyCollection(self._mongo, name)
+
+
+class Mongo:
+    """Flask-PyMongo replacement that creates its client after a fork.
+
+    ``MongoClient`` is not fork-safe, so nothing is connected while the app
+    is built. Each process creates its own client the first time a
+    collection is used (or when ``connect()`` is called from a post-fork
+    hook), then runs the ``on_connect`` callbacks, which is where modules
+    create their indexes.
+    """
+
+    def __init__(self):
+        self.db = LazyDatabase(self)
+        self._uri = None
+        self._database_name = None
+        self._kwargs = {}
+        self._client = None
+        self._database = None
+        self._collections = {}
+        self._hooks = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, uri=None, **kwargs):
+        """Function to read the connection settings without connecting"""
+        self._uri = uri or app.config.get("MONGO_URI")
+        if not self._uri:
+            raise ValueError(
+                "You must specify a URI or set the MONGO_URI Flask config variable"
+            )
+        self._database_name = uri_parser.parse_uri(self._uri)["database"]
+        self._kwargs = kwargs
+        # What Flask-PyMongo's init_app sets up besides the client; the JSON
+        # provider, which also encodes ObjectIds, is set up in create_app()
+        app.url_map.converters["ObjectId"] = BSONObjectIdConverter
+
+    @property
+    def cx(self):
+        return self.connect()
+
+    def connect(self):
+        """Function to return this process's client, creating it if needed"""
+        if self._client is not None and self._pid == os.getpid():
+            return self._client
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                return self._client
+            if self._uri is None:
+                raise RuntimeError("Mongo.init_app() has not been called")
+            self._client = pymongo.MongoClient(self._uri, **self._kwargs)
+            self._database = (
+                self._client[self._database_name] if self._database_name else None
+            )
+            self._collections = {}
+            self._pid = os.getpid()
+            hooks = list(self._hooks)
+        self._run_hooks(hooks)
+        return self._client
+
+    def database(self):
+        """Function to return this process's default database"""
+        self.connect()
+        if self._database is None:
+            raise RuntimeError("MONGO_URI does not name a database")
+        return self._database
+
+    def collection(self, name):
+        """Function to return a collection of this process's default database"""
+        if self._pid != os.getpid():
+            self.connect()
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self.database()[name]
+        return collection
+
+    def on_connect(self, hook):
+        """Function to register a callback that runs once per process's client.
+
+        Used as a decorator for index creation. A hook registered after this
+        process has connected runs straight away.
+        """
+        self._hooks.append(hook)
+        if self._client is not None and self._pid == os.getpid():
+            self._run_hooks([hook])
+        return hook
+
+    def _run_hooks(self, hooks):
+        for hook in hooks:
+            try:
+                hook()
+            except PyMongoError:
+                logger.exception("MongoDB setup step %s failed", hook.__name__)
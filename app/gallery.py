@@ -0,0 +1,77 @@
+import glob
+import os
+import pickle
+import re
+import tempfile
+import threading
+
+import numpy as np
+
+FILE_PATTERN = "family_{}_encodefile.p"
+FILE_RE = re.compile(r"^family_(.+)_encodefile\.p$")
+
+
+class FaceGallery:
+    """Known face encodings per family, kept in memory.
+
+    Each family's ``[encodings, user_ids]`` pickle in ``directory`` is read
+    once, so loading every gallery before the server forks lets workers
+    share it. A file rewritten by another worker is picked up through its
+    modification time. Encodings are held as one array per family, which is
+    what ``face_recognition.face_distance`` compares against.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        # family_id -> (mtime, encodings array, user ids)
+        self._families = {}
+
+    def path(self, family_id):
+        return os.path.join(self.directory, FILE_PATTERN.format(family_id))
+
+    def load_all(self):
+        """Function to read every family's encodings; returns the family count"""
+        for path in glob.glob(os.path.join(self.directory, FILE_PATTERN.format("*"))):
+            match = FILE_RE.match(os.path.basename(path))
+            if match:
+                self.get(match.group(1))
+        return len(self._families)
+
+    def get(self, family_id):
+        """Function to return ``(encodings, user_ids)`` for a family"""
+        path = self.path(family_id)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self._families.pop(family_id, None)
+            return np.empty((0, 128)), []
+
+        cached = self._families.get(family_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        with open(path, "rb") as file:
+            encodings, user_ids = pickle.load(file)
+        entry = (mtime, np.array(encodings).reshape(-1, 128), list(user_ids))
+        self._families[family_id] = entry
+        return entry[1], entry[2]
+
+    def add(self, family_id, encoding, user_id):
+        """Function to append one user's encoding to a family and save it"""
+        with self._lock:
+            encodings, user_ids = self.get(family_id)
+            self.save(
+                family_id, list(encodings) + [encoding], list(user_ids) + [user_id]
+            )
+
+    def save(self, family_id, encodings, user_ids):
+        """Function to write a family's encodings, replacing the file atomically"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(family_id)
+        # Readers in other workers never see a half-written pickle
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            pickle.dump([list(encodings), list(user_ids)], file)
+        os.replace(temp_path, path)
+        self._families.pop(family_id, None)
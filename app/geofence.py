@@ -0,0 +1,295 @@
+import logging
+import os
+import threading
+import time
+from datetime import timezone
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+logger = logging.getLogger(__name__)
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Function to compute great-circle distances in metres between radian arrays"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def epoch_seconds(value):
+    """Function to convert a datetime, naive meaning UTC, to epoch seconds"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class GeofenceEngine:
+    """Vectorized safe-zone evaluation for every patient with a home location.
+
+    Homes, radii, last known positions and inside/outside state live in
+    NumPy arrays indexed by a per-user row, so a batch of fixes or a sweep
+    over all patients is a handful of array operations. A patient only
+    breaches once it is ``hysteresis`` metres beyond its radius and only
+    returns once it is ``hysteresis`` metres back inside, so GPS jitter at
+    the boundary does not produce alert storms.
+
+    Every worker keeps its own last fixes, so each fix carries its time.
+    ``load`` brings in the state and time of the last transition any worker
+    persisted, and fixes older than that transition are not evaluated, nor
+    are fixes older than ``max_fix_age`` seconds.
+    """
+
+    def __init__(
+        self,
+        default_radius=200.0,
+        hysteresis=25.0,
+        reload_interval=60.0,
+        max_fix_age=900.0,
+    ):
+        self.default_radius = default_radius
+        self.hysteresis = hysteresis
+        self.reload_interval = reload_interval
+        self.max_fix_age = max_fix_age
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._user_ids = []
+        self._loaded_at = None
+        self._allocate(1024)
+
+    def init_app(self, app):
+        """Function to read the safe-zone settings from the app config"""
+        self.default_radius = app.config["GEOFENCE_DEFAULT_RADIUS_M"]
+        self.hysteresis = app.config["GEOFENCE_HYSTERESIS_M"]
+        self.reload_interval = app.config["GEOFENCE_RELOAD_SECONDS"]
+        self.max_fix_age = app.config["GEOFENCE_MAX_FIX_AGE_SECONDS"]
+
+    def _allocate(self, capacity):
+        self._home_lat = np.zeros(capacity)
+        self._home_lon = np.zeros(capacity)
+        self._radius = np.zeros(capacity)
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._has_fix = np.zeros(capacity, dtype=bool)
+        self._outside = np.zeros(capacity, dtype=bool)
+        # Epoch seconds of the last fix and of the last persisted transition
+        self._fix_ts = np.zeros(capacity)
+        self._changed_at = np.zeros(capacity)
+
+    def _grow(self):
+        size = len(self._user_ids)
+        old = (
+            self._home_lat,
+            self._home_lon,
+            self._radius,
+            self._lat,
+            self._lon,
+            self._has_fix,
+            self._outside,
+            self._fix_ts,
+            self._changed_at,
+        )
+        self._allocate(len(old[0]) * 2)
+        new = (
+            self._home_lat,
+            self._home_lon,
+            self._radius,
+            self._lat,
+            self._lon,
+            self._has_fix,
+            self._outside,
+            self._fix_ts,
+            self._changed_at,
+        )
+        for old_array, new_array in zip(old, new):
+            new_array[:size] = old_array[:size]
+
+    def _row(self, user_id):
+        row = self._rows.get(user_id)
+        if row is None:
+            if len(self._user_ids) == len(self._home_lat):
+                self._grow()
+            row = self._rows[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+        return row
+
+    def load(self, collection):
+        """Function to (re)load every home location and persisted breach state"""
+        documents = list(
+            collection.find(
+                {"home_location": {"$exists": True}},
+                {
+                    "_id": 0,
+                    "userId": 1,
+                    "home_location": 1,
+                    "home_radius": 1,
+                    "geofence_outside": 1,
+                    "geofence_changed_at": 1,
+                },
+            )
+        )
+        with self._lock:
+            for document in documents:
+                home = document.get("home_location") or {}
+                if home.get("latitude") is None or home.get("longitude") is None:
+                    continue
+                row = self._set_home(
+                    document["userId"],
+                    home["latitude"],
+                    home["longitude"],
+                    document.get("home_radius"),
+                )
+                self._outside[row] = bool(document.get("geofence_outside"))
+                changed_at = document.get("geofence_changed_at")
+                self._changed_at[row] = (
+                    epoch_seconds(changed_at) if changed_at is not None else 0.0
+                )
+            self._loaded_at = time.monotonic()
+
+    def needs_reload(self):
+        """Function to tell whether homes saved by other workers may be missing"""
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.reload_interval
+        )
+
+    def set_home(self, user_id, latitude, longitude, radius=None):
+        """Function to register or move a patient's safe zone"""
+        with self._lock:
+            row = self._rows.get(user_id)
+            if radius is None and row is not None:
+                # Moving the home without a radius keeps the current one
+                radius = self._radius[row]
+            self._set_home(user_id, latitude, longitude, radius)
+
+    def _set_home(self, user_id, latitude, longitude, radius):
+        row = self._row(user_id)
+        self._home_lat[row] = np.radians(latitude)
+        self._home_lon[row] = np.radians(longitude)
+        self._radius[row] = radius or self.default_radius
+        return row
+
+    def record(self, user_ids, latitudes, longitudes, timestamps):
+        """Function to store the latest fixes for the next ``evaluate_all`` sweep.
+
+        Users without a registered home are ignored, and so are fixes older
+        than the one already held for the user.
+        """
+        with self._lock:
+            for user_id, latitude, longitude, timestamp in zip(
+                user_ids, latitudes, longitudes, timestamps
+            ):
+                row = self._rows.get(user_id)
+                fix_ts = epoch_seconds(timestamp)
+                if row is None or (self._has_fix[row] and fix_ts <= self._fix_ts[row]):
+                    continue
+                self._lat[row] = np.radians(latitude)
+                self._lon[row] = np.radians(longitude)
+                self._fix_ts[row] = fix_ts
+                self._has_fix[row] = True
+
+    def evaluate_all(self, now=None):
+        """Function to check every patient's last fix; returns the transitions"""
+        now = time.time() if now is None else now
+        with self._lock:
+            size = len(self._user_ids)
+            # Fixes past the age limit are dropped rather than re-checked forever
+            expired = self._has_fix[:size] & (
+                self._fix_ts[:size] < now - self.max_fix_age
+            )
+            self._has_fix[:size][expired] = False
+            # A fix older than a persisted transition was already superseded
+            current = self._has_fix[:size] & (
+                self._fix_ts[:size] > self._changed_at[:size]
+            )
+            return self._transitions(np.flatnonzero(current))
+
+    def _transitions(self, rows):
+        distance = haversine_m(
+            self._home_lat[rows],
+            self._home_lon[rows],
+            self._lat[rows],
+            self._lon[rows],
+        )
+        radius = self._radius[rows]
+        outside = self._outside[rows]
+
+        breached = ~outside & (distance > radius + self.hysteresis)
+        returned = outside & (distance < radius - self.hysteresis)
+        changed = breached | returned
+        self._outside[rows[breached]] = True
+        self._outside[rows[returned]] = False
+        self._changed_at[rows[changed]] = self._fix_ts[rows[changed]]
+
+        # Transitions are rare, so only they are turned into Python objects
+        return [
+            {
+                "userId": self._user_ids[row],
+                "event": "breach" if is_breach else "return",
+                "distance": round(float(dist), 1),
+                "radius": float(rad),
+                "latitude": float(np.degrees(self._lat[row])),
+                "longitude": float(np.degrees(self._lon[row])),
+                "timestamp": int(self._fix_ts[row] * 1000),
+            }
+            for row, is_breach, dist, rad in zip(
+                rows[changed], breached[changed], distance[changed], radius[changed]
+            )
+        ]
+
+
+class GeofenceSweeper:
+    """Background thread that sweeps every patient every ``interval`` seconds.
+
+    Requests only ``record`` fixes, which costs a few array writes. Each
+    tick reloads homes with ``load_homes`` once the engine's reload interval
+    has passed, then runs one vectorized ``evaluate_all`` and hands any
+    transitions to ``on_transitions``, so neither the collection scan nor
+    the evaluation runs on the request path.
+    """
+
+    def __init__(self, engine, load_homes, on_transitions, interval=2.0):
+        self.engine = engine
+        self.load_homes = load_homes
+        self.on_transitions = on_transitions
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Function to read the sweep interval from the app config"""
+        self.interval = app.config["GEOFENCE_SWEEP_SECONDS"]
+
+    def start(self):
+        """Function to start the sweep thread in this process"""
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="geofence-sweeper", daemon=True
+            )
+            self._thread.start()
+
+    def sweep(self):
+        """Function to reload homes if due and dispatch new transitions"""
+        if self.engine.needs_reload():
+            self.load_homes()
+        events = self.engine.evaluate_all()
+        if events:
+            self.on_transitions(events)
+        return events
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Geofence sweep error: %s", e)
+            time.sleep(self.interval)
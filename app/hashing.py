@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.metrics import registry
+
+hash_latency = registry.histogram(
+    "lumi_password_hash_duration_seconds",
+    "Time to hash or check a password, including time spent queued.",
+    ("operation",),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+hash_pending = registry.gauge(
+    "lumi_password_hash_pending",
+    "Password hashes running or waiting for a hashing thread.",
+)
+hash_rejected = registry.counter(
+    "lumi_password_hash_rejected_total",
+    "Password hashes refused because too many were already pending.",
+    ("operation",),
+)
+
+
+def green_threads():
+    """Function to tell whether eventlet has replaced OS threads with green ones"""
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return False
+    return patcher.is_monkey_patched("thread")
+
+
+class HashingBusy(Exception):
+    """Raised when a hash is refused so it cannot delay other requests."""
+
+
+class PasswordHasher:
+    """Runs bcrypt off the request path with bounded concurrency.
+
+    bcrypt is deliberately slow and, under eventlet, would stall every
+    connection of the worker. Hashes therefore run on at most ``workers``
+    real OS threads (eventlet's ``tpool`` when the worker is green,
+    otherwise a thread pool). At most ``max_pending`` hashes may be running
+    or queued; beyond that ``HashingBusy`` is raised at once, which routes
+    turn into a 503, so a sign-up burst cannot starve chat and reminders.
+    The cost comes from ``BCRYPT_LOG_ROUNDS``.
+    """
+
+    def __init__(self, bcrypt, workers=2, max_pending=16):
+        self.bcrypt = bcrypt
+        self.workers = workers
+        self.max_pending = max_pending
+        self._admission = threading.BoundedSemaphore(max_pending)
+        self._slots = threading.BoundedSemaphore(workers)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Function to size the hasher from the app config"""
+        self.workers = app.config["PASSWORD_HASH_WORKERS"]
+        self.max_pending = app.config["PASSWORD_HASH_MAX_PENDING"]
+        self._admission = threading.BoundedSemaphore(self.max_pending)
+        self._slots = threading.BoundedSemaphore(self.workers)
+
+    def generate(self, password):
+        """Function to hash a password; returns the hash as a string"""
+        return self._run(
+            "generate", self.bcrypt.generate_password_hash, password
+        ).decode("utf-8")
+
+    def check(self, pw_hash, password):
+        """Function to check a password against a stored hash"""
+        return self._run("check", self.bcrypt.check_password_hash, pw_hash, password)
+
+    def _run(self, operation, function, *args):
+        if not self._admission.acquire(blocking=False):
+            hash_rejected.inc(operation)
+            raise HashingBusy(f"{self.max_pending} password hashes already pending")
+        started = time.perf_counter()
+        hash_pending.inc()
+        try:
+            if green_threads():
+                from eventlet import tpool
+
+                # A green semaphore: waiting here yields to other connections
+                with self._slots:
+                    return tpool.execute(function, *args)
+            return self._pool().submit(function, *args).result()
+        finally:
+            hash_pending.dec()
+            self._admission.release()
+            hash_latency.observe(time.perf_counter() - started, operation)
+
+    def _pool(self):
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="password-hash"
+                )
+        return self._executor
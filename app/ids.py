@@ -0,0 +1,189 @@
+import hashlib
+import os
+import threading
+import time
+from string import ascii_uppercase
+
+from pymongo import ReturnDocument
+
+from app import mongo
+
+# Crockford's base32: no I, L, O or U, so IDs survive being read aloud
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# Milliseconds since 2024-01-01 UTC; 42 bits last until the 2160s
+EPOCH_MS = 1704067200000
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+ID_LENGTH = 13
+
+counters_collection = mongo.db.counters
+
+
+def encode(number, length=ID_LENGTH, alphabet=ALPHABET):
+    """Function to write a number with a fixed number of digits"""
+    base = len(alphabet)
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, base)
+        digits.append(alphabet[digit])
+    if number:
+        raise ValueError("Number does not fit in the requested length")
+    return "".join(reversed(digits))
+
+
+def next_counter(name, amount=1):
+    """Function to atomically advance a named counter; returns its new value"""
+    counter = counters_collection.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"value": amount}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["value"]
+
+
+class IdGenerator:
+    """Time-ordered IDs that are unique without asking the database.
+
+    An ID packs milliseconds since ``EPOCH_MS``, a node number and a
+    per-millisecond sequence into 64 bits, written as 13 base32 characters,
+    so IDs sort by creation time and new ones land at the end of an index.
+    Each process, including every forked worker, takes its node number from
+    a shared counter the first time it makes an ID, so no two running
+    processes hand out the same value.
+
+    Node numbers wrap after 1024 processes. Two live processes only share
+    one if 1024 others have started since the older one did; even then an
+    ID repeats only if both draw the same sequence in the same millisecond,
+    and the unique indexes on user, reminder and family IDs reject it.
+    """
+
+    def __init__(self):
+        self._node = None
+        self._pid = None
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def node(self):
+        """Function to return this process's node number"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._node = next_counter("id_node") % (1 << NODE_BITS)
+                    self._last_ms = 0
+                    self._sequence = 0
+                    self._pid = os.getpid()
+        return self._node
+
+    def next_int(self):
+        """Function to return the next ID as an integer"""
+        node = self.node()
+        with self._lock:
+            now = int(time.time() * 1000) - EPOCH_MS
+            # A clock that steps back keeps counting from the last millisecond
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence >> SEQUENCE_BITS:
+                    # Sequence used up: borrow the next millisecond
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (
+                (self._last_ms << (NODE_BITS + SEQUENCE_BITS))
+                | (node << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+    def next(self, prefix=""):
+        """Function to return the next ID as a string"""
+        return prefix + encode(self.next_int())
+
+
+class RoomCodes:
+    """Short letter codes for chat rooms, unique without probing for a free one.
+
+    Codes are consecutive counter values passed through a keyed permutation
+    of the ``26 ** length`` possible codes, so they are distinct but do not
+    reveal each other. Counter values are reserved in blocks to save round
+    trips.
+    """
+
+    def __init__(self, key, length=8, block=50, rounds=4):
+        self.key = hashlib.blake2b(key.encode("utf-8"), digest_size=32).digest()
+        self.length = length
+        self.block = block
+        self.rounds = rounds
+        self.size = 26**length
+        self.half_bits = ((self.size - 1).bit_length() + 1) // 2
+        self._next = self._end = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Function to read the permutation key from the app config"""
+        self.key = hashlib.blake2b(
+            app.config["ROOM_CODE_KEY"].encode("utf-8"), digest_size=32
+        ).digest()
+
+    def next(self):
+        """Function to return an unused room code"""
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._end = next_counter("room_code", self.block)
+                self._next = self._end - self.block
+                self._pid = os.getpid()
+            value = self._next
+            self._next += 1
+        if value >= self.size:
+            raise ValueError("Room code space exhausted")
+        return encode(self.permute(value), self.length, ascii_uppercase)
+
+    def permute(self, value):
+        """Function to map a counter value to a unique number below ``size``"""
+        mask = (1 << self.half_bits) - 1
+        # Feistel rounds permute the 2 * half_bits space; values outside the
+        # code space are walked through the permutation again until they fit
+        while True:
+            left, right = value >> self.half_bits, value & mask
+            for round_number in range(self.rounds):
+                left, right = right, left ^ (self._round(round_number, right) & mask)
+            value = (left << self.half_bits) | right
+            if value < self.size:
+                return value
+
+    def _round(self, round_number, half):
+        digest = hashlib.blake2b(
+            bytes([round_number]) + half.to_bytes(8, "big"),
+            key=self.key,
+            digest_size=8,
+        ).digest()
+        return int.from_bytes(digest, "big")
+
+
+ids = IdGenerator()
+# Keyed by init_app() in create_app()
+room_codes = RoomCodes("lumi-room-codes")
+
+
+def init_app(app):
+    """Function to read the room code key from the app config"""
+    room_codes.init_app(app)
+
+
+def new_user_id():
+    """Function to generate a user ID with the 'USID' prefix"""
+    return ids.next("USID")
+
+
+def new_reminder_id():
+    """Function to generate a reminder ID"""
+    return ids.next()
+
+
+def new_family_id():
+    """Function to generate a family ID"""
+    return ids.next()
+
@@ -1,5 +1,5 @@
+import logging
 import os
-import pickle
 
 import cv2
 import face_recognition
@@ -13,6 +13,12 @@ from google.genai import types
 from ultralytics import YOLO
 
 from app import mongo
+from app.gallery import FaceGallery
+from app.log import sample
+from app.metrics import timed
+from app.users import users
+
+logger = logging.getLogger(__name__)
 
 # Load the YOLO model
 image_bp = Blueprint("image", __name__)
@@ -21,37 +27,32 @@ user_collection = mongo.db.users
 info_collection = mongo.db.infomation
 
 
-def initialize_family(family_id):
-    """Initialize encodings for a specific family."""
-    encodng_file = f"resources/family_{family_id}_encodefile.p"
+# Known faces of every family, loaded once before the server forks
+gallery = FaceGallery("resources")
+gallery.load_all()
 
-    try:
-        with open(encodng_file, "rb") as file:
-            global encodeListKnown, userIds
-            encodeListKnown, userIds = pickle.load(file)
-    except FileNotFoundError:
-        print(
-            f"Encoding file for family {family_id} not found, starting with an empty list"
-        )
-        encodeListKnown, userIds = [], []
+
+def initialize_family(family_id):
+    """Load the known encodings for a specific family."""
+    return gallery.get(family_id)
 
 
 def save_family_encodings(family_id, encodeListKnown, personIds):
     """Save encodings for a specific family"""
-    encoding_file = f"resources/family_{family_id}_encodefile.p"
-    with open(encoding_file, "wb") as file:
-        pickle.dump([encodeListKnown, personIds], file)
-    print(f"Encodings for family {family_id} saved successfully!")
+    gallery.save(family_id, encodeListKnown, personIds)
+    logger.info("Encodings for family %s saved", family_id)
 
 
 def recognize_face(encoding_to_check, family_id):
     """Recognize a face for a specific family."""
-    initialize_family(family_id)
-    matches = face_recognition.compare_faces(encodeListKnown, encoding_to_check)
+    encodeListKnown, userIds = initialize_family(family_id)
+    if not userIds:
+        return "Unknown"
     face_distances = face_recognition.face_distance(encodeListKnown, encoding_to_check)
     best_match_index = np.argmin(face_distances)
 
-    if matches[best_match_index]:
+    # The tolerance compare_faces uses, without computing the distances twice
+    if face_distances[best_match_index] <= 0.6:
         return userIds[best_match_index]
     else:
         return "Unknown"
@@ -65,23 +66,26 @@ def process_image(image_file):
     if new_image is None:
         raise ValueError("Error: Image could not be loaded.")
 
-    print(f"New Image Shape: {new_image.shape}")  # Debugging line
-    print(f"Image Data Type: {new_image.dtype}")  # Debugging line
-
     # Convert image to RGB for face recognition
     rgb_image = cv2.cvtColor(new_image, cv2.COLOR_BGR2RGB)
 
-    # Check the RGB image shape
-    print(f"RGB Image Shape: {rgb_image.shape}")
-
     face_locations = face_recognition.face_locations(rgb_image)  # Find face locations
     face_encodings = face_recognition.face_encodings(
         rgb_image, face_locations
     )  # Get face encodings
 
-    print(f"Detected {len(face_locations)} faces.")
-    print(f"Face locations: {face_locations}")
-    print(f"Face encodings: {face_encodings}")
+    # A summary of a sample of requests; formatting the encodings themselves
+    # costs more than detecting the faces
+    if sample(logger, App.config["LOG_DEBUG_SAMPLE_RATE"]):
+        logger.debug(
+            "Detected %d faces",
+            len(face_locations),
+            extra={
+                "shape": new_image.shape,
+                "dtype": str(new_image.dtype),
+                "locations": face_locations,
+            },
+        )
 
     return face_locations, face_encodings, new_image
 
@@ -103,7 +107,6 @@ def detect_faces_route(family_id):
         for face_encoding in face_encodings:
             recognized_name = recognize_face(face_encoding, family_id)
             recognized_faces.append(recognized_name)
-            print(recognized_faces)
 
         return (
             jsonify(
@@ -116,6 +119,7 @@ def detect_faces_route(family_id):
             200,
         )
     except Exception as e:
+        logger.exception("Face detection failed for family %s", family_id)
         return (
             jsonify(
                 {
@@ -157,7 +161,8 @@ def save_profile_picture(user_id, family_id):
         user_collection.update_one(
             {"userId": user_id}, {"$set": {"profile_image": file_path}}
         )
-        print(file_path)
+        users.invalidate(user_id)
+        logger.debug("Saved profile picture for user %s to %s", user_id, file_path)
         # Load the image and extract face encodings
         img = cv2.imread(file_path)
         img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
@@ -166,27 +171,12 @@ def save_profile_picture(user_id, family_id):
         encodings = face_recognition.face_encodings(img_rgb)
 
         if encodings:
-            # If encodings aare found, save them in the family specific pickle file
-            family_pickle_file = os.path.join(
-                "resources", f"family_{family_id}_encodefile.p"
-            )
-
-            try:
-                # Load existing encodings if the file exists
-                with open(family_pickle_file, "rb") as f:
-                    known_encodings, known_ids = pickle.load(f)
-            except FileNotFoundError:
-                known_encodings, known_ids = [], []
-
-            # Append the new encodings and user ID to the lists
-            known_encodings.append(encodings[0])
-            known_ids.append(user_id)
+            # If encodings aare found, add them to the family's gallery file
+            gallery.add(family_id, encodings[0], user_id)
 
-            # Save the updated encodings and IDs back to the family pickle file
-            with open(family_pickle_file, "wb") as f:
-                pickle.dump([known_encodings, known_ids], f)
-
-            print(f"Profile picture saved for user {user_id} in family {family_id}.")
+            logger.info(
+                "Profile picture saved for user %s in family %s", user_id, family_id
+            )
 
             return (
                 jsonify(
@@ -199,7 +189,7 @@ def save_profile_picture(user_id, family_id):
             )
 
         else:
-            print(f"No face found in the profile picture for user {user_id}.")
+            logger.info("No face found in the profile picture for user %s", user_id)
 
             return (
                 jsonify(
@@ -212,6 +202,7 @@ def save_profile_picture(user_id, family_id):
             )
 
     except Exception as e:
+        logger.exception("Saving the profile picture for user %s failed", user_id)
         return (
             jsonify(
                 {
@@ -264,10 +255,11 @@ def detect_objects():
 
         client = genai.Client(api_key=api_key)
         prompt = "Just state the object name, do not form any sentence."
-        response = client.models.generate_content(
-            model=os.getenv("GEMINI_MODEL"),
-            contents=[pil_image, prompt],
-        )
+        with timed("gemini", "generate_content"):
+            response = client.models.generate_content(
+                model=os.getenv("GEMINI_MODEL"),
+                contents=[pil_image, prompt],
+            )
 
         gemini_detected = response.text.strip().split(" ")
         return (
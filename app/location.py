@@ -1,14 +1,619 @@
+import atexit
+import logging
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+
+import click
 from flask import Blueprint, jsonify, request
+from flask_socketio import join_room, leave_room
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, UpdateOne
+from pymongo.errors import (BulkWriteError, CollectionInvalid,
+                            DuplicateKeyError, OperationFailure, PyMongoError)
 
-from app import mongo
+from app import mongo, socketio
+from app.geofence import GeofenceEngine, GeofenceSweeper
+from app.location_coalescer import LocationCoalescer
+from app.metrics import track_event
+from app.notifications import notify_caregivers
+from app.periodic import PeriodicTask
+from app.trajectory import bucket_start, simplify, uncovered_ranges
+from app.users import users
 
 location_collection = mongo.db.location
-user_collection = mongo.db.users
+families_collection = mongo.db.families
 
+location_history_collection = mongo.db.location_history
+location_tracks_collection = mongo.db.location_tracks
+leases_collection = mongo.db.leases
 
+logger = logging.getLogger(__name__)
 location_bp = Blueprint("location", __name__)
 
 
+@mongo.on_connect
+def create_location_indexes():
+    """Function to create the location indexes once this process is connected"""
+    # GeoJSON copies of home_location and curr_location for spatial queries
+    location_collection.create_index([("home_point", GEOSPHERE)])
+    location_collection.create_index([("curr_point", GEOSPHERE)])
+    location_collection.create_index(
+        "geofence_outside", partialFilterExpression={"geofence_outside": True}
+    )
+    # One document per user, so the first fix can safely upsert it
+    location_collection.create_index("userId", unique=True)
+
+
+@mongo.on_connect
+def ensure_history_collection():
+    """Function to create the time-series collection that stores raw location fixes"""
+    raw_retention = settings["LOCATION_RAW_RETENTION_HOURS"] * 3600
+    try:
+        mongo.db.create_collection(
+            "location_history",
+            timeseries={
+                "timeField": "ts",
+                "metaField": "userId",
+                "granularity": "seconds",
+            },
+            expireAfterSeconds=raw_retention,
+        )
+    except (CollectionInvalid, OperationFailure):
+        # Already created, possibly by another worker; keep its TTL in sync
+        try:
+            mongo.db.command(
+                "collMod", "location_history", expireAfterSeconds=raw_retention
+            )
+        except OperationFailure as e:
+            logger.warning("Could not update location history TTL: %s", e)
+    location_history_collection.create_index(
+        [("userId", ASCENDING), ("ts", ASCENDING)]
+    )
+
+
+@mongo.on_connect
+def ensure_tracks_collection():
+    """Function to index the collection of simplified trajectory buckets"""
+    location_tracks_collection.create_index(
+        [("userId", ASCENDING), ("bucket", ASCENDING)], unique=True
+    )
+    location_tracks_collection.create_index(
+        "end", expireAfterSeconds=settings["LOCATION_HISTORY_TTL_DAYS"] * 86400
+    )
+
+
+# The app's config, bound by init_app(); index hooks and background tasks
+# run outside an app context, so they read their settings from here
+settings = {}
+track_bucket = timedelta(hours=1)
+# userId -> start of the first bucket that has not been compacted yet; it only
+# moves past a bucket once that bucket's track is written
+compacted_through = {}
+# Users whose closed buckets are being compacted right now
+compacting = set()
+compaction_lock = threading.Lock()
+
+geofence = GeofenceEngine()
+
+
+def notify_geofence_event(event):
+    """Function to alert the patient's caregivers about a safe-zone transition"""
+    patient = users.get(event["userId"]) or {}
+    name = patient.get("name", "The patient")
+    if event["event"] == "breach":
+        title = "Safe zone alert"
+        body = f"{name} has left the safe zone ({int(event['distance'])} m from home)"
+    else:
+        title = "Back in safe zone"
+        body = f"{name} is back inside the safe zone"
+    try:
+        notify_caregivers(event["userId"], title, body, data={"geofence": event})
+    except Exception as e:
+        logger.error("Geofence notification error: %s", e)
+
+
+def dispatch_geofence_events(events):
+    """Function to persist safe-zone transitions and alert the caregivers"""
+    for event in events:
+        outside = event["event"] == "breach"
+        changed_at = datetime.fromtimestamp(event["timestamp"] / 1000, timezone.utc)
+        # The conditional update lets exactly one worker own each transition,
+        # and a fix older than the last persisted transition cannot undo it
+        result = location_collection.update_one(
+            {
+                "userId": event["userId"],
+                "geofence_outside": {"$ne": outside},
+                "$or": [
+                    {"geofence_changed_at": {"$lt": changed_at}},
+                    {"geofence_changed_at": {"$exists": False}},
+                ],
+            },
+            {"$set": {"geofence_outside": outside, "geofence_changed_at": changed_at}},
+        )
+        if result.modified_count:
+            notify_geofence_event(event)
+
+
+geofence_sweeper = GeofenceSweeper(
+    geofence,
+    lambda: geofence.load(location_collection),
+    dispatch_geofence_events,
+)
+
+
+@location_bp.before_app_request
+def start_geofence_sweeper():
+    """Function to start the safe-zone sweep in each worker process"""
+    geofence_sweeper.start()
+
+
+def check_geofences(user_ids, latitudes, longitudes, timestamps):
+    """Function to record new fixes for the next safe-zone sweep"""
+    geofence.record(user_ids, latitudes, longitudes, timestamps)
+
+
+def parse_radius(value):
+    """Function to validate an optional safe-zone radius in metres"""
+    if value is None:
+        return None
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not math.isfinite(value)
+        or value <= 0
+    ):
+        raise ValueError("Radius must be a positive number of metres")
+    return float(value)
+
+
+def geo_point(latitude, longitude):
+    """Function to build a GeoJSON point; GeoJSON orders coordinates lon, lat"""
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+
+# parse_timestamp raises these for out-of-range epochs as well as bad input
+TIMESTAMP_ERRORS = (ValueError, OverflowError, OSError)
+
+
+def parse_timestamp(value):
+    """Function to parse a fix timestamp in epoch seconds, milliseconds or ISO 8601"""
+    if value is None:
+        return datetime.now(timezone.utc)
+    if isinstance(value, bool):
+        raise ValueError("Invalid timestamp")
+    if isinstance(value, (int, float)):
+        # Expo reports milliseconds; anything this large cannot be seconds
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_time_arg(value):
+    """Function to read a query-string time as epoch milliseconds or ISO 8601"""
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def to_epoch_ms(value):
+    """Function to convert a stored datetime to epoch milliseconds"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+def validate_coordinates(latitude, longitude):
+    """Function to check coordinates before they reach a 2dsphere index"""
+    if any(
+        isinstance(value, bool) or not isinstance(value, (int, float))
+        for value in (latitude, longitude)
+    ):
+        raise ValueError("Latitude and Longitude are required")
+    # NaN fails both comparisons, so it is rejected here too
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError("Latitude or Longitude out of range")
+
+
+def build_fix(user_id, fix):
+    """Function to validate one location fix and build its history document"""
+    latitude = fix.get("latitude")
+    longitude = fix.get("longitude")
+    validate_coordinates(latitude, longitude)
+
+    document = {
+        "userId": user_id,
+        "ts": parse_timestamp(fix.get("timestamp")),
+        "latitude": latitude,
+        "longitude": longitude,
+    }
+    for field in ("accuracy", "speed", "heading", "altitude"):
+        if isinstance(fix.get(field), (int, float)):
+            document[field] = fix[field]
+    return document
+
+
+def serialize_fix(document):
+    """Function to convert a stored fix into its API representation"""
+    return {
+        "latitude": document["latitude"],
+        "longitude": document["longitude"],
+        "timestamp": to_epoch_ms(document["ts"]),
+        **{
+            field: document[field]
+            for field in ("accuracy", "speed", "heading", "altitude")
+            if field in document
+        },
+    }
+
+
+def latest_location_update(fix):
+    """Function to build the filter and update that move curr_location to a fix.
+
+    Fixes older than the stored one are ignored, so late replays and
+    delayed flushes never move the current location backwards. The update
+    is meant to upsert, so a user's first fix creates its location document;
+    when a newer fix is already stored the upsert collides with the unique
+    userId index instead, which callers treat as "not newer".
+    """
+    return (
+        {
+            "userId": fix["userId"],
+            "$or": [
+                {"curr_updated_at": {"$lt": fix["ts"]}},
+                {"curr_updated_at": {"$exists": False}},
+            ],
+        },
+        {
+            "$set": {
+                "curr_location": {
+                    "latitude": fix["latitude"],
+                    "longitude": fix["longitude"],
+                },
+                "curr_point": geo_point(fix["latitude"], fix["longitude"]),
+                "curr_updated_at": fix["ts"],
+            }
+        },
+    )
+
+
+def update_latest_location(fix):
+    """Function to move curr_location forward unless a newer fix is already stored.
+
+    Returns whether curr_location changed, so callers only broadcast fixes
+    that actually became the current location.
+    """
+    location_filter, update = latest_location_update(fix)
+    try:
+        result = location_collection.update_one(location_filter, update, upsert=True)
+    except DuplicateKeyError:
+        # Either a newer fix is stored, or another request created the
+        # document first; without the upsert the filter decides which
+        result = location_collection.update_one(location_filter, update)
+    return result.modified_count > 0 or result.upserted_id is not None
+
+
+def persist_fixes(fixes):
+    """Function to write absorbed fixes to history and curr_location in bulk"""
+    location_history_collection.insert_many(fixes, ordered=False)
+    updates = [latest_location_update(fix) for fix in fixes]
+    try:
+        location_collection.bulk_write(
+            [UpdateOne(*update, upsert=True) for update in updates], ordered=False
+        )
+    except BulkWriteError as e:
+        details = e.details
+        errors = details.get("writeErrors", [])
+        if details.get("writeConcernErrors") or any(
+            error["code"] != 11000 for error in errors
+        ):
+            raise
+        # Same as update_latest_location: retry the collisions without upsert
+        location_collection.bulk_write(
+            [UpdateOne(*updates[error["index"]]) for error in errors], ordered=False
+        )
+    for fix in fixes:
+        schedule_compaction(fix["userId"], [fix["ts"]])
+
+
+def compact_bucket(user_id, bucket):
+    """Function to simplify one bucket of a user's trajectory into a stored polyline.
+
+    Points of an existing track are merged back in, so fixes that arrive
+    late, after the bucket's raw fixes have expired, do not erase it.
+    """
+    raw_fixes = location_history_collection.find(
+        {"userId": user_id, "ts": {"$gte": bucket, "$lt": bucket + track_bucket}},
+        {"_id": 0, "ts": 1, "latitude": 1, "longitude": 1},
+    )
+    points = {
+        to_epoch_ms(fix["ts"]): (fix["longitude"], fix["latitude"]) for fix in raw_fixes
+    }
+    existing = location_tracks_collection.find_one(
+        {"userId": user_id, "bucket": bucket}, {"_id": 0, "points": 1}
+    )
+    for longitude, latitude, timestamp in (existing or {}).get("points", []):
+        points.setdefault(timestamp, (longitude, latitude))
+    if not points:
+        return
+
+    timestamps = sorted(points)
+    keep = simplify(
+        [points[ts][1] for ts in timestamps],
+        [points[ts][0] for ts in timestamps],
+        settings["LOCATION_SIMPLIFY_EPSILON_M"],
+    )
+    track = {
+        "userId": user_id,
+        "bucket": bucket,
+        "start": datetime.fromtimestamp(timestamps[0] / 1000, tz=timezone.utc),
+        "end": datetime.fromtimestamp(timestamps[-1] / 1000, tz=timezone.utc),
+        # [longitude, latitude, epoch ms], the GeoJSON coordinate order
+        "points": [
+            [points[timestamps[i]][0], points[timestamps[i]][1], timestamps[i]]
+            for i in keep
+        ],
+        "sourceCount": len(timestamps),
+        "epsilonM": settings["LOCATION_SIMPLIFY_EPSILON_M"],
+    }
+    try:
+        location_tracks_collection.replace_one(
+            {"userId": user_id, "bucket": bucket}, track, upsert=True
+        )
+    except DuplicateKeyError:
+        # Another worker compacted the same bucket at the same moment
+        pass
+
+
+def compaction_horizon():
+    """Function to return the start of the first bucket that is not due yet"""
+    return bucket_start(
+        datetime.now(timezone.utc)
+        - timedelta(minutes=settings["LOCATION_COMPACT_AFTER_MINUTES"]),
+        track_bucket,
+    )
+
+
+def first_uncompacted_bucket(user_id, horizon):
+    """Function to find where a user's compaction should resume"""
+    with compaction_lock:
+        bucket = compacted_through.get(user_id)
+    if bucket is not None:
+        return bucket
+    latest = location_tracks_collection.find_one(
+        {"userId": user_id}, {"bucket": 1}, sort=[("bucket", DESCENDING)]
+    )
+    if latest:
+        return bucket_start(latest["bucket"], track_bucket) + track_bucket
+    return bucket_start(
+        horizon - timedelta(hours=settings["LOCATION_RAW_RETENTION_HOURS"]),
+        track_bucket,
+    )
+
+
+def compact_history(user_id, late=(), horizon=None):
+    """Function to compact late buckets and every closed bucket before ``horizon``.
+
+    ``compacted_through`` only moves past a bucket once its track is stored.
+    A failed bucket pulls it back, so the next sweep retries from there.
+    """
+    bucket = None
+    try:
+        for bucket in sorted(late):
+            compact_bucket(user_id, bucket)
+        if horizon is not None:
+            bucket = first_uncompacted_bucket(user_id, horizon)
+            while bucket < horizon:
+                compact_bucket(user_id, bucket)
+                bucket += track_bucket
+                with compaction_lock:
+                    compacted_through[user_id] = max(
+                        compacted_through.get(user_id, bucket), bucket
+                    )
+    except PyMongoError as e:
+        logger.error("Location compaction error: %s", e)
+        if bucket is not None:
+            with compaction_lock:
+                compacted_through[user_id] = min(
+                    compacted_through.get(user_id, bucket), bucket
+                )
+    finally:
+        if horizon is not None:
+            with compaction_lock:
+                compacting.discard(user_id)
+
+
+def schedule_compaction(user_id, fix_times):
+    """Function to compact buckets that closed, or that received late fixes.
+
+    Costs nothing on the request path unless a bucket needs compacting; the
+    work itself runs as a background task.
+    """
+    horizon = compaction_horizon()
+    with compaction_lock:
+        sweep_from = compacted_through.get(user_id)
+        late = {
+            bucket
+            for bucket in {bucket_start(ts, track_bucket) for ts in fix_times}
+            if bucket < (sweep_from or horizon)
+        }
+        due = user_id not in compacting and (
+            sweep_from is None or sweep_from < horizon
+        )
+        if not due and not late:
+            return
+        if due:
+            compacting.add(user_id)
+
+    socketio.start_background_task(
+        compact_history, user_id, late, horizon if due else None
+    )
+
+
+def sweep_history():
+    """Function to compact the closed buckets of every user with raw fixes.
+
+    Devices that went silent never call ``schedule_compaction`` again, so
+    this sweep is what keeps their last buckets from expiring uncompacted.
+    One worker sweeps per interval, under a lease.
+    """
+    now = datetime.now(timezone.utc)
+    interval = settings["LOCATION_COMPACT_SWEEP_SECONDS"]
+    try:
+        leases_collection.update_one(
+            {"_id": "location-compaction", "until": {"$lte": now}},
+            {"$set": {"until": now + timedelta(seconds=interval)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The lease is held by another worker
+        return
+
+    horizon = compaction_horizon()
+    user_ids = location_history_collection.distinct(
+        "userId",
+        {
+            "ts": {
+                "$gte": now
+                - timedelta(hours=settings["LOCATION_RAW_RETENTION_HOURS"]),
+                "$lt": horizon,
+            }
+        },
+    )
+    for user_id in user_ids:
+        with compaction_lock:
+            done = compacted_through.get(user_id)
+            if user_id in compacting or (done is not None and done >= horizon):
+                continue
+            compacting.add(user_id)
+        compact_history(user_id, horizon=horizon)
+
+
+history_sweeper = PeriodicTask(sweep_history, name="location-compaction")
+
+
+@location_bp.before_app_request
+def start_history_sweeper():
+    """Function to start the history compaction sweep in each worker process"""
+    history_sweeper.start()
+
+
+def load_trajectory(user_id, start, end):
+    """Function to read a trajectory from compacted tracks plus raw recent fixes"""
+    tracks = list(
+        location_tracks_collection.find(
+            {
+                "userId": user_id,
+                "bucket": {"$gte": bucket_start(start, track_bucket), "$lte": end},
+            },
+            {"_id": 0, "bucket": 1, "points": 1},
+        ).sort("bucket", ASCENDING)
+    )
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    fixes = [
+        {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        for track in tracks
+        for longitude, latitude, timestamp in track["points"]
+        if start_ms <= timestamp <= end_ms
+    ]
+
+    # Raw fixes are only read for the parts of the range without a track
+    covered = [bucket_start(track["bucket"], track_bucket) for track in tracks]
+    gaps = uncovered_ranges(
+        start,
+        end + timedelta(milliseconds=1),
+        [(bucket, bucket + track_bucket) for bucket in covered],
+    )
+    if gaps:
+        raw_fixes = (
+            location_history_collection.find(
+                {
+                    "userId": user_id,
+                    "$or": [{"ts": {"$gte": a, "$lt": b}} for a, b in gaps],
+                },
+                {"_id": 0},
+            )
+            .sort("ts", ASCENDING)
+            .limit(settings["LOCATION_HISTORY_MAX_RESULTS"])
+        )
+        fixes += [serialize_fix(fix) for fix in raw_fixes]
+
+    fixes.sort(key=lambda fix: fix["timestamp"])
+    return fixes[: settings["LOCATION_HISTORY_MAX_RESULTS"]]
+
+
+def find_fix_at(user_id, at):
+    """Function to find the latest known position at or before a time"""
+    candidates = []
+    raw_fix = location_history_collection.find_one(
+        {"userId": user_id, "ts": {"$lte": at}},
+        {"_id": 0},
+        sort=[("ts", DESCENDING)],
+    )
+    if raw_fix:
+        candidates.append(serialize_fix(raw_fix))
+
+    track = location_tracks_collection.find_one(
+        {"userId": user_id, "bucket": {"$lte": at}},
+        {"_id": 0, "points": 1},
+        sort=[("bucket", DESCENDING)],
+    )
+    at_ms = to_epoch_ms(at)
+    earlier = [p for p in (track or {}).get("points", []) if p[2] <= at_ms]
+    if earlier:
+        longitude, latitude, timestamp = earlier[-1]
+        candidates.append(
+            {"latitude": latitude, "longitude": longitude, "timestamp": timestamp}
+        )
+
+    return max(candidates, key=lambda fix: fix["timestamp"]) if candidates else None
+
+
+coalescer = LocationCoalescer(persist_fixes)
+atexit.register(coalescer.flush)
+
+
+def init_app(app):
+    """Function to configure the location settings and singletons from the app"""
+    global settings, track_bucket
+    settings = app.config
+    track_bucket = timedelta(minutes=app.config["LOCATION_TRACK_BUCKET_MINUTES"])
+    geofence.init_app(app)
+    geofence_sweeper.init_app(app)
+    history_sweeper.interval = app.config["LOCATION_COMPACT_SWEEP_SECONDS"]
+    coalescer.init_app(app)
+
+
+def location_channel(patient_id):
+    """Function to name the Socket.IO room that streams a patient's location"""
+    return f"location:{patient_id}"
+
+
+def publish_location(fix):
+    """Function to push a stored fix to every caregiver subscribed to the patient"""
+    socketio.emit(
+        "location",
+        {"userId": fix["userId"], **serialize_fix(fix)},
+        to=location_channel(fix["userId"]),
+    )
+
+
+def caregiver_has_access(caregiver_id, patient_id):
+    """Function to check that a caregiver and patient belong to the same family"""
+    found = users.get_many([caregiver_id, patient_id])
+    caregiver = found.get(caregiver_id)
+    patient = found.get(patient_id)
+    return bool(
+        caregiver
+        and patient
+        and caregiver.get("family_id")
+        and caregiver["family_id"] == patient["family_id"]
+    )
+
+
 @location_bp.route("/patient/safe-location", methods=["POST"])
 def save_home_location():
     """Save or update the user's home location in the database."""
@@ -30,26 +635,36 @@ def save_home_location():
     latitude = coords.get("latitude")  # Extract latitude
     longitude = coords.get("longitude")  # Extract longitude
 
-    if latitude is None or longitude is None:
-        return (
-            jsonify(
-                {"status": "error", "message": "Latitude and Longitude are required"}
-            ),
-            400,
-        )
+    try:
+        validate_coordinates(latitude, longitude)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     user_data = {
         "userId": user_id,
         "home_location": {"latitude": latitude, "longitude": longitude},
     }
 
+    try:
+        radius = parse_radius(data.get("radius"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    home_update = {
+        "home_location": user_data["home_location"],
+        "home_point": geo_point(latitude, longitude),
+    }
+    if radius is not None:
+        home_update["home_radius"] = radius
+
     # Save the home location, updating if it already exists
     location_collection.update_one(
         {"userId": user_id},  # Match by userId only
         # Update or set home_location
-        {"$set": {"home_location": user_data["home_location"]}},
+        {"$set": home_update},
         upsert=True,  # Create a new document if no match is found
     )
+    geofence.set_home(user_id, latitude, longitude, radius)
     return (
         jsonify({"status": "success", "message": "Home location saved successfully"}),
         201,
@@ -75,8 +690,9 @@ def save_patient_home_location():
             400,
         )
 
-    caregiver = user_collection.find_one({"userId": caregiver_id})
-    patient = user_collection.find_one({"userId": patient_id})
+    found = users.get_many([caregiver_id, patient_id])
+    caregiver = found.get(caregiver_id)
+    patient = found.get(patient_id)
     if caregiver["family_id"] != patient["family_id"]:
         return (
             jsonify(
@@ -91,26 +707,36 @@ def save_patient_home_location():
     latitude = coords.get("latitude")  # Extract latitude
     longitude = coords.get("longitude")  # Extract longitude
 
-    if latitude is None or longitude is None:
-        return (
-            jsonify(
-                {"status": "error", "message": "Latitude and Longitude are required"}
-            ),
-            400,
-        )
+    try:
+        validate_coordinates(latitude, longitude)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     user_data = {
         "userId": patient_id,
         "home_location": {"latitude": latitude, "longitude": longitude},
     }
 
+    try:
+        radius = parse_radius(data.get("radius"))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    home_update = {
+        "home_location": user_data["home_location"],
+        "home_point": geo_point(latitude, longitude),
+    }
+    if radius is not None:
+        home_update["home_radius"] = radius
+
     # Save the home location, updating if it already exists
     location_collection.update_one(
         {"userId": patient_id},  # Match by userId only
         # Update or set home_location
-        {"$set": {"home_location": user_data["home_location"]}},
+        {"$set": home_update},
         upsert=True,  # Create a new document if no match is found
     )
+    geofence.set_home(patient_id, latitude, longitude, radius)
     return (
         jsonify({"status": "success", "message": "Home location saved successfully"}),
         201,
@@ -206,16 +832,28 @@ def save_current_location():
             400,
         )
 
-    user_data = {"curr_location": {"latitude": latitude, "longitude": longitude}}
+    try:
+        fix = build_fix(user_id, {**coords, "timestamp": data.get("timestamp")})
+    except TIMESTAMP_ERRORS as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-    location_collection.update_one(
-        {"userId": user_id},
-        {"$set": {"curr_location": user_data["curr_location"]}},
-    )
+    # Pings that barely move are held in memory and flushed on an interval
+    significant, suggested_interval = coalescer.offer(user_id, fix)
+    if significant:
+        location_history_collection.insert_one(fix)
+        if update_latest_location(fix):
+            publish_location(fix)
+        schedule_compaction(user_id, [fix["ts"]])
+    check_geofences([user_id], [fix["latitude"]], [fix["longitude"]], [fix["ts"]])
 
     return (
         jsonify(
-            {"status": "success", "message": "Current location updated successfully"}
+            {
+                "status": "success",
+                "message": "Current location updated successfully",
+                "stored": significant,
+                "suggestedInterval": suggested_interval,
+            }
         ),
         201,
     )
@@ -276,3 +914,378 @@ def get_current_location():
         ),
         200,
     )
+
+
+@location_bp.route("/patient/history", methods=["POST"])
+def ingest_location_history():
+    """Store a batch of timestamped fixes, e.g. replayed after the phone was offline"""
+    try:
+        data = request.json
+        user_id = data.get("userId")
+        fixes = data.get("fixes")
+
+        if not user_id or not isinstance(fixes, list) or not fixes:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "User ID and a list of location fixes are required",
+                    }
+                ),
+                400,
+            )
+
+        max_fixes = settings["LOCATION_BATCH_MAX_FIXES"]
+        if len(fixes) > max_fixes:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": f"At most {max_fixes} fixes per request",
+                    }
+                ),
+                413,
+            )
+
+        documents = []
+        rejected = 0
+        for fix in fixes:
+            try:
+                documents.append(build_fix(user_id, fix))
+            except (*TIMESTAMP_ERRORS, TypeError, AttributeError):
+                rejected += 1
+
+        if documents:
+            location_history_collection.insert_many(documents, ordered=False)
+            latest = max(documents, key=lambda d: d["ts"])
+            coalescer.mark_stored(user_id, latest)
+            schedule_compaction(user_id, [document["ts"] for document in documents])
+            # A replay older than the stored location is history only: it is
+            # neither broadcast nor checked against the safe zone
+            if update_latest_location(latest):
+                publish_location(latest)
+                check_geofences(
+                    [user_id],
+                    [latest["latitude"]],
+                    [latest["longitude"]],
+                    [latest["ts"]],
+                )
+
+        return (
+            jsonify(
+                {
+                    "status": "success",
+                    "message": "Location history stored",
+                    "stored": len(documents),
+                    "rejected": rejected,
+                }
+            ),
+            201,
+        )
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+
+
+@location_bp.route("/caregiver/history", methods=["GET"])
+def get_location_history():
+    """Get a patient's trajectory between two points in time"""
+    try:
+        caregiver_id = request.args.get("CGId")
+        patient_id = request.args.get("PATId")
+        start = request.args.get("start")
+        end = request.args.get("end")
+
+        if not caregiver_id or not patient_id or not start:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Caregiver ID, Patient ID and start time are required",
+                    }
+                ),
+                400,
+            )
+
+        if not caregiver_has_access(caregiver_id, patient_id):
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "You do not have permission to view this patient's location",
+                    }
+                ),
+                403,
+            )
+
+        start = parse_timestamp(parse_time_arg(start))
+        end = parse_timestamp(parse_time_arg(end)) if end else parse_timestamp(None)
+
+        fixes = load_trajectory(patient_id, start, end)
+        return jsonify({"status": "success", "fixes": fixes}), 200
+    except TIMESTAMP_ERRORS as e:
+        return jsonify({"status": "error", "message": f"Invalid time: {str(e)}"}), 400
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+
+
+@location_bp.route("/caregiver/history/at", methods=["GET"])
+def get_location_at():
+    """Get where a patient was at a given time, i.e. the latest fix before it"""
+    try:
+        caregiver_id = request.args.get("CGId")
+        patient_id = request.args.get("PATId")
+        at = request.args.get("time")
+
+        if not caregiver_id or not patient_id or not at:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Caregiver ID, Patient ID and time are required",
+                    }
+                ),
+                400,
+            )
+
+        if not caregiver_has_access(caregiver_id, patient_id):
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "You do not have permission to view this patient's location",
+                    }
+                ),
+                403,
+            )
+
+        fix = find_fix_at(patient_id, parse_timestamp(parse_time_arg(at)))
+        if not fix:
+            return (
+                jsonify(
+                    {"status": "error", "message": "No location recorded before that time"}
+                ),
+                404,
+            )
+
+        return jsonify({"status": "success", "fix": fix}), 200
+    except TIMESTAMP_ERRORS as e:
+        return jsonify({"status": "error", "message": f"Invalid time: {str(e)}"}), 400
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+
+
+@location_bp.route("/caregiver/nearby-members", methods=["GET"])
+def get_nearby_family_members():
+    """Get the family members currently near the patient, nearest first"""
+    try:
+        caregiver_id = request.args.get("CGId")
+        patient_id = request.args.get("PATId")
+        try:
+            radius = parse_radius(float(request.args.get("radius", 500)))
+        except ValueError:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Radius must be a positive number of metres",
+                    }
+                ),
+                400,
+            )
+
+        if not caregiver_id or not patient_id:
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "Caregiver ID and Patient ID are required",
+                    }
+                ),
+                400,
+            )
+
+        if not caregiver_has_access(caregiver_id, patient_id):
+            return (
+                jsonify(
+                    {
+                        "status": "error",
+                        "message": "You do not have permission to view this patient's location",
+                    }
+                ),
+                403,
+            )
+
+        patient_location = location_collection.find_one(
+            {"userId": patient_id}, {"_id": 0, "curr_point": 1}
+        )
+        if not patient_location or not patient_location.get("curr_point"):
+            return (
+                jsonify(
+                    {"status": "error", "message": "Patient location not available"}
+                ),
+                404,
+            )
+
+        patient = users.get(patient_id)
+        family = families_collection.find_one(
+            {"family_id": patient["family_id"]}, {"_id": 0, "members": 1}
+        )
+        members = (family or {}).get("members", [])
+        member_ids = [member for member in members if member != patient_id]
+
+        nearby = location_collection.aggregate(
+            [
+                {
+                    "$geoNear": {
+                        "near": patient_location["curr_point"],
+                        "key": "curr_point",
+                        "distanceField": "distance",
+                        "maxDistance": radius,
+                        "spherical": True,
+                        "query": {"userId": {"$in": member_ids}},
+                    }
+                },
+                {
+                    "$project": {
+                        "_id": 0,
+                        "userId": 1,
+                        "distance": 1,
+                        "curr_location": 1,
+                    }
+                },
+            ]
+        )
+        members = [
+            {
+                "userId": member["userId"],
+                "distance": round(member["distance"], 1),
+                "coords": member["curr_location"],
+            }
+            for member in nearby
+        ]
+        return jsonify({"status": "success", "members": members}), 200
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+
+
+@location_bp.route("/caregiver/outside-safe-zone", methods=["GET"])
+def get_patients_outside_safe_zone():
+    """Get the patients of the caregiver's family that are outside their safe zone"""
+    try:
+        caregiver_id = request.args.get("CGId")
+        if not caregiver_id:
+            return (
+                jsonify({"status": "error", "message": "Caregiver ID is required"}),
+                400,
+            )
+
+        caregiver = users.get(caregiver_id)
+        if not caregiver or not caregiver.get("family_id"):
+            return (
+                jsonify({"status": "error", "message": "Caregiver has no family"}),
+                404,
+            )
+        family = families_collection.find_one({"family_id": caregiver["family_id"]})
+        patient_ids = [family["patient"]] if family and family.get("patient") else []
+
+        # geofence_outside is maintained by the geofence engine on every fix
+        outside = location_collection.find(
+            {"geofence_outside": True, "userId": {"$in": patient_ids}},
+            {"_id": 0, "userId": 1, "curr_location": 1, "home_location": 1},
+        )
+        patients = [
+            {
+                "userId": patient["userId"],
+                "coords": patient.get("curr_location"),
+                "home": patient.get("home_location"),
+            }
+            for patient in outside
+        ]
+        return jsonify({"status": "success", "patients": patients}), 200
+    except PyMongoError as e:
+        logger.error("Database error: %s", e)
+        return jsonify({"status": "error", "message": "Database error occurred"}), 500
+
+
+@location_bp.cli.command("migrate-geojson")
+def migrate_geojson():
+    """Backfill GeoJSON points from the legacy latitude/longitude sub-documents"""
+    fields = (("home_location", "home_point"), ("curr_location", "curr_point"))
+    for field, point in fields:
+        # Pipeline updates build the point server-side in a single command
+        result = location_collection.update_many(
+            {
+                f"{field}.latitude": {"$type": "number"},
+                f"{field}.longitude": {"$type": "number"},
+                point: {"$exists": False},
+            },
+            [
+                {
+                    "$set": {
+                        point: {
+                            "type": "Point",
+                            "coordinates": [
+                                f"${field}.longitude",
+                                f"${field}.latitude",
+                            ],
+                        }
+                    }
+                }
+            ],
+        )
+        click.echo(f"{point}: backfilled {result.modified_count} documents")
+
+
+# Live location streaming, replacing GET /caregiver/curr-location polling
+@socketio.on("subscribe-location")
+@track_event("subscribe-location")
+def subscribe_location(data):
+    """Function to stream a patient's location to an authorized caregiver"""
+    try:
+        caregiver_id = data.get("CGId")
+        patient_id = data.get("PATId")
+
+        if not caregiver_id or not patient_id:
+            return {
+                "status": "error",
+                "message": "Caregiver ID and Patient ID are required",
+            }
+
+        if not caregiver_has_access(caregiver_id, patient_id):
+            return {
+                "status": "error",
+                "message": "You do not have permission to view this patient's location",
+            }
+
+        join_room(location_channel(patient_id))
+
+        # Send the last known position so the map does not wait for movement
+        user_data = location_collection.find_one(
+            {"userId": patient_id}, {"_id": 0, "curr_location": 1, "curr_updated_at": 1}
+        )
+        current = (user_data or {}).get("curr_location")
+        if current:
+            snapshot = {"userId": patient_id, **current}
+            if user_data.get("curr_updated_at"):
+                snapshot["timestamp"] = to_epoch_ms(user_data["curr_updated_at"])
+            socketio.emit("location", snapshot, to=request.sid)
+
+        return {"status": "success", "message": f"Subscribed to {patient_id}"}
+    except (AttributeError, PyMongoError) as e:
+        logger.error("Location subscription error: %s", e)
+        return {"status": "error", "message": "Could not subscribe to location"}
+
+
+@socketio.on("unsubscribe-location")
+@track_event("unsubscribe-location")
+def unsubscribe_location(data):
+    """Function to stop streaming a patient's location"""
+    patient_id = (data or {}).get("PATId")
+    if not patient_id:
+        return {"status": "error", "message": "Patient ID is required"}
+    leave_room(location_channel(patient_id))
+    return {"status": "success", "message": f"Unsubscribed from {patient_id}"}
@@ -0,0 +1,169 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from app.geofence import EARTH_RADIUS_M
+
+logger = logging.getLogger(__name__)
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Function to compute the haversine distance in metres between two points"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(
+        dlambda / 2
+    ) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+class LocationCoalescer:
+    """Absorbs location pings that do not move a user meaningfully.
+
+    A fix further than ``distance_epsilon`` metres from the last stored one
+    is significant and should be written immediately. Anything closer is
+    kept in memory as the user's pending fix, and the background flusher
+    persists pending fixes every ``flush_interval`` seconds through
+    ``flush_callback``. The suggested client interval doubles while a user
+    stays put and drops back to the minimum as soon as they move.
+
+    A pending fix is only cleared once its write succeeded, and users that
+    have sent nothing for twice ``max_interval`` are forgotten, so their
+    next fix is written straight away.
+    """
+
+    def __init__(
+        self,
+        flush_callback,
+        distance_epsilon=15.0,
+        flush_interval=60.0,
+        min_interval=5,
+        max_interval=120,
+    ):
+        self.flush_callback = flush_callback
+        self.distance_epsilon = distance_epsilon
+        self.flush_interval = flush_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        # userId -> {"stored": fix, "pending": fix or None, "interval": seconds,
+        #            "seen": monotonic time of the last fix}
+        self._users = {}
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Function to read the coalescing thresholds from the app config"""
+        self.distance_epsilon = app.config["LOCATION_COALESCE_DISTANCE_M"]
+        self.flush_interval = app.config["LOCATION_FLUSH_INTERVAL"]
+        self.min_interval = app.config["LOCATION_MIN_PING_INTERVAL"]
+        self.max_interval = app.config["LOCATION_MAX_PING_INTERVAL"]
+
+    def offer(self, user_id, fix):
+        """Function to classify a fix; returns ``(significant, suggested_interval)``"""
+        self._ensure_started()
+        with self._lock:
+            state = self._users.get(user_id)
+            if state is None:
+                self._users[user_id] = {
+                    "stored": fix,
+                    "pending": None,
+                    "interval": self.min_interval,
+                    "seen": time.monotonic(),
+                }
+                return True, self.min_interval
+
+            state["seen"] = time.monotonic()
+            stored = state["stored"]
+            if fix["ts"] <= stored["ts"]:
+                # Out-of-order ping, already superseded by what is stored
+                return False, state["interval"]
+
+            moved = distance_m(
+                stored["latitude"],
+                stored["longitude"],
+                fix["latitude"],
+                fix["longitude"],
+            )
+            if moved >= self.distance_epsilon:
+                state.update(stored=fix, pending=None, interval=self.min_interval)
+                return True, self.min_interval
+
+            state["pending"] = fix
+            state["interval"] = min(state["interval"] * 2, self.max_interval)
+            return False, state["interval"]
+
+    def mark_stored(self, user_id, fix):
+        """Function to record a fix written outside ``offer``, e.g. by batch ingest"""
+        with self._lock:
+            state = self._users.setdefault(
+                user_id,
+                {
+                    "stored": fix,
+                    "pending": None,
+                    "interval": self.min_interval,
+                    "seen": time.monotonic(),
+                },
+            )
+            state["seen"] = time.monotonic()
+            if fix["ts"] >= state["stored"]["ts"]:
+                state["stored"] = fix
+                pending = state["pending"]
+                if pending is not None and pending["ts"] <= fix["ts"]:
+                    state["pending"] = None
+
+    def flush(self):
+        """Function to persist every absorbed fix that has not been written yet"""
+        with self._lock:
+            pending = {
+                user_id: state["pending"]
+                for user_id, state in self._users.items()
+                if state["pending"] is not None
+            }
+
+        if pending:
+            try:
+                self.flush_callback(list(pending.values()))
+            except Exception as e:
+                # The fixes stay pending and go out with the next flush
+                logger.error("Location flush error: %s", e)
+                return 0
+
+        with self._lock:
+            for user_id, fix in pending.items():
+                state = self._users.get(user_id)
+                # A newer fix may have been absorbed while this one was written
+                if state is not None and state["pending"] is fix:
+                    state["stored"], state["pending"] = fix, None
+            self._evict_idle()
+        return len(pending)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - 2 * self.max_interval
+        idle = [
+            user_id
+            for user_id, state in self._users.items()
+            if state["pending"] is None and state["seen"] < cutoff
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="location-coalescer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
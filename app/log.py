@@ -0,0 +1,193 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from flask.logging import default_handler
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has; anything else came in through ``extra``
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most ``burst`` records per call site through every ``interval``.
+
+    Only records at or below ``max_level`` are limited, so warnings and
+    errors always get through. The first record let through after others
+    were dropped carries their count in ``suppressed``.
+    """
+
+    def __init__(self, burst=10, interval=1.0, max_level=logging.INFO):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self._lock = threading.Lock()
+        # (pathname, lineno) -> [window start, count, suppressed]
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level or self.burst <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                suppressed = 0
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that never blocks the caller.
+
+    Records are handed to a ``QueueListener`` thread that does the actual
+    I/O. When the queue is full the record is dropped and counted rather
+    than stalling a request. A forked worker gets a new queue and lock, since
+    the parent's listener may hold or wait on the inherited ones, and starts
+    its own listener (see ``start_listeners``).
+    """
+
+    def __init__(self, handlers, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.targets = handlers
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Records still queued in the parent are written by the parent
+        self.queue = queue.Queue(self.maxsize)
+        self._lock = threading.Lock()
+        self.listener = None
+        self._pid = None
+        self.dropped = 0
+
+    def start(self):
+        """Function to start the listener thread in this process if needed"""
+        if self.listener is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self.listener is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self.listener = QueueListener(
+                self.queue, *self.targets, respect_handler_level=True
+            )
+            self.listener.start()
+
+    def stop(self):
+        """Function to flush queued records and stop the listener"""
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        # Resolve the message and traceback now; arguments may change before
+        # the listener gets to the record. ``exc_text`` is kept separate so
+        # the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def sample(logger, rate, level=logging.DEBUG):
+    """Function to decide whether to emit a sampled record.
+
+    Checks the level first, so callers can skip building an expensive
+    message entirely when it would not be logged.
+    """
+    return logger.isEnabledFor(level) and (rate >= 1 or random.random() < rate)
+
+
+def start_listeners(name="app"):
+    """Function to start the queue listeners of the ``name`` logger in this process.
+
+    gunicorn calls it in ``post_fork``: with ``preload_app`` the app, and its
+    listener thread, is created in the master, and threads do not survive
+    the fork into the workers.
+    """
+    for handler in logging.getLogger(name).handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.start()
+
+
+def configure_logging(app):
+    """Function to route the ``app`` logger tree through a non-blocking queue.
+
+    Module loggers (``logging.getLogger(__name__)`` under ``app``) inherit
+    the level from ``LOG_LEVEL``. ``LOG_FORMAT`` is ``json`` or ``text``,
+    and debug/info records are limited to ``LOG_RATE_LIMIT`` per call site
+    per second.
+    """
+    stream = logging.StreamHandler()
+    if app.config["LOG_FORMAT"] == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = DroppingQueueHandler([stream], maxsize=app.config["LOG_QUEUE_SIZE"])
+    handler.addFilter(RateLimitFilter(burst=app.config["LOG_RATE_LIMIT"]))
+    handler.start()
+    atexit.register(handler.stop)
+
+    logger = logging.getLogger(app.import_name)
+    logger.removeHandler(default_handler)
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(handler)
+    logger.setLevel(app.config["LOG_LEVEL"].upper())
+    # Records would otherwise be printed again by a root handler
+    logger.propagate = False
+    return handler
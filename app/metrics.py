@@ -0,0 +1,394 @@
+import glob
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, g, request
+
+from app.periodic import PeriodicTask
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+
+def format_labels(names, values, extra=()):
+    """Function to render a Prometheus label set"""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    """Function to render a sample value, whole numbers without a decimal point"""
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    """Base class for metrics keyed by a tuple of label values.
+
+    Updates take one lock and one dict lookup, so recording on the request
+    path stays cheap; all formatting happens when ``/metrics`` is scraped.
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    # Gauges describe live processes, so values of exited workers are dropped
+    keep_when_dead = True
+
+    def values(self):
+        """Function to copy the current values, keyed by label tuple"""
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def render(self, values=None):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        values = self.values() if values is None else values
+        for labels, value in sorted(values.items()):
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def merge(self, total, value):
+        """Function to add one process's value to the total of all processes"""
+        return value if total is None else total + value
+
+    def _copy(self, value):
+        return value
+
+    def _samples(self, labels, value):
+        label_set = format_labels(self.labelnames, labels)
+        yield f"{self.name}{label_set} {format_value(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+    keep_when_dead = False
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # Per-bucket counts are stored; they are made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _copy(self, value):
+        return list(value[0]), value[1]
+
+    def merge(self, total, value):
+        if total is None:
+            return list(value[0]), value[1]
+        counts = [a + b for a, b in zip(total[0], value[0])]
+        return counts, total[1] + value[1]
+
+    def _samples(self, labels, value):
+        counts, total = value
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = format_labels(self.labelnames, labels, [("le", format_value(bound))])
+            yield f"{self.name}_bucket{le} {cumulative}"
+        label_set = format_labels(self.labelnames, labels)
+        yield f"{self.name}_sum{label_set} {format_value(total)}"
+        yield f"{self.name}_count{label_set} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format.
+
+    With ``directory`` set, every process writes its values to
+    ``<directory>/<pid>.json`` every ``flush_interval`` seconds and whenever
+    it serves a scrape, and a scrape renders the sum over every file, so
+    whichever worker answers reports the same, monotonic series. Files of
+    exited workers are kept for their counters and histograms; their gauges
+    are dropped (see ``mark_process_dead``).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self.directory = None
+        self._flusher = PeriodicTask(self.write, name="metrics-flush")
+
+    def init_app(self, app):
+        """Function to share metrics between processes through a directory"""
+        self.directory = app.config.get("METRICS_MULTIPROC_DIR")
+        self._flusher.interval = app.config.get("METRICS_FLUSH_SECONDS", 5.0)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def start(self):
+        """Function to start writing this process's values in the background"""
+        if self.directory:
+            self._flusher.start()
+
+    def write(self):
+        """Function to write this process's values to its file in the directory"""
+        if not self.directory:
+            return
+        snapshot = {
+            metric.name: [[list(key), value] for key, value in metric.values().items()]
+            for metric in self._metrics
+        }
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(snapshot, file)
+        # Readers never see a half-written file
+        os.replace(temporary, path)
+
+    def mark_process_dead(self, pid):
+        """Function to keep an exited worker's totals but drop its gauges"""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{pid}.json")
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            return
+        kept = {
+            metric.name: snapshot.get(metric.name, [])
+            for metric in self._metrics
+            if metric.keep_when_dead
+        }
+        dead_path = os.path.join(self.directory, f"dead-{pid}-{time.time_ns()}.json")
+        with open(dead_path, "w") as file:
+            json.dump(kept, file)
+        os.remove(path)
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        totals = self._collect() if self.directory else {}
+        for metric in self._metrics:
+            lines.extend(metric.render(totals.get(metric.name)))
+        return "\n".join(lines) + "\n"
+
+    def _collect(self):
+        self.write()
+        totals = {metric.name: {} for metric in self._metrics}
+        by_name = {metric.name: metric for metric in self._metrics}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping metrics file %s: %s", path, e)
+                continue
+            for name, samples in snapshot.items():
+                metric = by_name.get(name)
+                if metric is None:
+                    continue
+                values = totals[name]
+                for labels, value in samples:
+                    key = tuple(labels)
+                    values[key] = metric.merge(values.get(key), value)
+        return totals
+
+
+# Each worker records into its own registry; with METRICS_MULTIPROC_DIR set,
+# scrapes report the sum over every worker
+registry = Registry()
+
+http_requests = registry.counter(
+    "lumi_http_requests_total",
+    "HTTP requests by blueprint, route, method and status.",
+    ("blueprint", "route", "method", "status"),
+)
+http_latency = registry.histogram(
+    "lumi_http_request_duration_seconds",
+    "HTTP request latency by blueprint, route and method.",
+    ("blueprint", "route", "method"),
+)
+http_in_flight = registry.gauge(
+    "lumi_http_requests_in_flight",
+    "HTTP requests currently being handled, by blueprint.",
+    ("blueprint",),
+)
+socketio_events = registry.counter(
+    "lumi_socketio_events_total",
+    "Socket.IO events handled, by event and outcome.",
+    ("event", "outcome"),
+)
+socketio_latency = registry.histogram(
+    "lumi_socketio_event_duration_seconds",
+    "Socket.IO event handler latency.",
+    ("event",),
+)
+socketio_in_flight = registry.gauge(
+    "lumi_socketio_events_in_flight",
+    "Socket.IO event handlers currently running.",
+    ("event",),
+)
+outbound_requests = registry.counter(
+    "lumi_outbound_requests_total",
+    "Calls to external services, by service, operation and outcome.",
+    ("service", "operation", "outcome"),
+)
+outbound_latency = registry.histogram(
+    "lumi_outbound_request_duration_seconds",
+    "Latency of calls to external services such as Gemini, Expo and Firebase.",
+    ("service", "operation"),
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0),
+)
+
+
+def observe_outbound(service, operation, seconds, outcome="ok"):
+    """Function to record one call to an external service"""
+    outbound_requests.inc(service, operation, outcome)
+    outbound_latency.observe(seconds, service, operation)
+
+
+@contextmanager
+def timed(service, operation):
+    """Function to time an outbound call; exceptions are counted as errors"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        observe_outbound(service, operation, time.perf_counter() - started, outcome)
+
+
+def track_event(event):
+    """Function to decorate a Socket.IO handler with latency and outcome metrics.
+
+    Apply it below ``@socketio.on``. Extra arguments Flask-SocketIO passes
+    (``auth`` on connect, ``reason`` on disconnect) are only forwarded when
+    the handler accepts them.
+    """
+
+    def decorator(handler):
+        parameters = inspect.signature(handler).parameters.values()
+        if any(p.kind == p.VAR_POSITIONAL for p in parameters):
+            accepted = None
+        else:
+            accepted = sum(
+                1
+                for p in parameters
+                if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+            )
+
+        @wraps(handler)
+        def wrapper(*args):
+            started = time.perf_counter()
+            socketio_in_flight.inc(event)
+            outcome = "error"
+            try:
+                result = handler(*args[:accepted])
+                outcome = "ok"
+                return result
+            finally:
+                socketio_in_flight.dec(event)
+                socketio_events.inc(event, outcome)
+                socketio_latency.observe(time.perf_counter() - started, event)
+
+        return wrapper
+
+    return decorator
+
+
+def init_app(app):
+    """Function to record request metrics for ``app`` and serve ``/metrics``"""
+    registry.init_app(app)
+
+    @app.before_request
+    def start_request_timer():
+        registry.start()
+        g.metrics_started = time.perf_counter()
+        g.metrics_blueprint = request.blueprint or "app"
+        http_in_flight.inc(g.metrics_blueprint)
+
+    @app.after_request
+    def record_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception=None):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return
+        blueprint = g.pop("metrics_blueprint")
+        status = g.pop("metrics_status", 500)
+        # The URL rule, not the path, keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_in_flight.dec(blueprint)
+        http_requests.inc(blueprint, route, request.method, str(status))
+        http_latency.observe(
+            time.perf_counter() - started, blueprint, route, request.method
+        )
+
+    @app.route(app.config.get("METRICS_PATH", "/metrics"), methods=["GET"])
+    def metrics():
+        """Function to expose every metric in the Prometheus text format"""
+        return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,216 @@
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    """Durable push notification jobs processed by a bounded worker pool.
+
+    Jobs live in ``jobs_collection`` so they survive restarts and any worker
+    process can pick them up. A worker claims a job atomically and holds a
+    lease on it; a job whose worker died is reclaimed once the lease runs
+    out. ``deliver(messages)`` returns ``(retry, error)``, the messages that
+    failed transiently and why; only those are sent again, with exponential
+    backoff. Jobs still failing after ``max_attempts`` are moved to
+    ``dead_letters_collection``.
+
+    Jobs may carry an idempotency key, and enqueueing the same key again
+    returns the existing job instead of sending twice. Delivery is at least
+    once: a worker that dies mid-send leaves its job to be sent again.
+    """
+
+    def __init__(
+        self,
+        jobs_collection,
+        dead_letters_collection,
+        deliver,
+        workers=4,
+        max_attempts=5,
+        lease_seconds=120.0,
+        poll_interval=2.0,
+        backoff=5.0,
+        max_backoff=600.0,
+    ):
+        self.jobs_collection = jobs_collection
+        self.dead_letters_collection = dead_letters_collection
+        self.deliver = deliver
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._pid = None
+
+    def init_app(self, app):
+        """Function to size the worker pool and retry policy from the app config"""
+        self.workers = app.config["NOTIFICATION_WORKERS"]
+        self.max_attempts = app.config["NOTIFICATION_MAX_ATTEMPTS"]
+        self.lease_seconds = app.config["NOTIFICATION_LEASE_SECONDS"]
+
+    def enqueue(self, messages, key=None, kind="push"):
+        """Function to store a job and wake a worker; returns ``(job, created)``"""
+        now = datetime.now(timezone.utc)
+        job = {
+            "kind": kind,
+            "status": "pending",
+            "messages": list(messages),
+            "total": len(messages),
+            "attempts": 0,
+            "runAt": now,
+            "createdAt": now,
+        }
+        if key:
+            job["key"] = key
+        for _ in range(3):
+            try:
+                self.jobs_collection.insert_one(job)
+                break
+            except DuplicateKeyError:
+                existing = self.jobs_collection.find_one({"key": key})
+                if existing is None:
+                    existing = self.dead_letters_collection.find_one({"key": key})
+                if existing is not None:
+                    return existing, False
+                # The job finished and expired, or moved between the two
+                # lookups; the key may be free again, so try the insert again
+                job.pop("_id", None)
+        else:
+            raise DuplicateKeyError(f"Notification key {key} is still taken")
+
+        self.start()
+        self._wakeup.set()
+        return job, True
+
+    def get(self, job_id):
+        """Function to read a job, or its dead letter once it has failed for good"""
+        job = self.jobs_collection.find_one({"_id": job_id})
+        if job is None:
+            job = self.dead_letters_collection.find_one({"_id": job_id})
+        return job
+
+    def dead_letters(self, limit=50):
+        """Function to list the most recent permanently failed jobs"""
+        return list(
+            self.dead_letters_collection.find().sort("failedAt", -1).limit(limit)
+        )
+
+    def retry_dead_letter(self, job_id):
+        """Function to move a dead letter back onto the queue"""
+        job = self.dead_letters_collection.find_one_and_delete({"_id": job_id})
+        if job is None:
+            return None
+        job.pop("failedAt", None)
+        job.update(status="pending", attempts=0, runAt=datetime.now(timezone.utc))
+        self.jobs_collection.insert_one(job)
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def claim(self):
+        """Function to lease the next due job, including ones with an expired lease"""
+        now = datetime.now(timezone.utc)
+        return self.jobs_collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "pending", "runAt": {"$lte": now}},
+                    {"status": "running", "leaseUntil": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "leaseUntil": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("runAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def process(self, job):
+        """Function to deliver a claimed job and record the outcome"""
+        try:
+            retry, error = self.deliver(job["messages"])
+        except Exception as e:
+            retry, error = job["messages"], str(e)
+
+        now = datetime.now(timezone.utc)
+        if not retry:
+            self.jobs_collection.update_one(
+                {"_id": job["_id"]},
+                {
+                    "$set": {"status": "done", "messages": [], "finishedAt": now},
+                    "$unset": {"leaseUntil": "", "lastError": ""},
+                },
+            )
+        elif job["attempts"] >= self.max_attempts:
+            job.update(status="failed", messages=retry, lastError=error, failedAt=now)
+            job.pop("leaseUntil", None)
+            self.dead_letters_collection.replace_one(
+                {"_id": job["_id"]}, job, upsert=True
+            )
+            self.jobs_collection.delete_one({"_id": job["_id"]})
+        else:
+            delay = min(self.backoff * 2 ** (job["attempts"] - 1), self.max_backoff)
+            run_at = now + timedelta(seconds=random.uniform(0.5, 1) * delay)
+            self.jobs_collection.update_one(
+                {"_id": job["_id"]},
+                {
+                    "$set": {
+                        "status": "pending",
+                        "messages": retry,
+                        "lastError": error,
+                        "runAt": run_at,
+                    },
+                    "$unset": {"leaseUntil": ""},
+                },
+            )
+
+    def start(self):
+        """Function to start the worker pool in this process if it is not running"""
+        if self._threads and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(
+                    target=self._run, name=f"notification-worker-{i}", daemon=True
+                )
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                job = self.claim()
+            except PyMongoError as e:
+                logger.error("Notification queue error: %s", e)
+                job = None
+
+            if job is None:
+                # Jobs enqueued by other workers or due for retry are picked
+                # up on the next poll
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self.process(job)
+            except PyMongoError as e:
+                # The lease expires and another attempt picks the job up
+                logger.error("Notification job %s error: %s", job["_id"], e)
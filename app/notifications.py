@@ -1,16 +1,282 @@
-import requests
+from bson import ObjectId
+from bson.errors import InvalidId
 from flask import Blueprint, jsonify, request
 from flask_apscheduler import APScheduler
+from pymongo import ASCENDING
 
 from app import mongo
+from app.cache import TTLCache
+from app.metrics import observe_outbound
+from app.notification_queue import NotificationQueue
+from app.push import ExpoPushClient, PushService
 
 notification_bp = Blueprint("notifications", __name__)
 reminders_collection = mongo.db.reminders
 user_collection = mongo.db.users
+families_collection = mongo.db.families
 tokens_collection = mongo.db.tokens
+push_receipts_collection = mongo.db.push_receipts
+notification_jobs_collection = mongo.db.notification_jobs
+dead_letters_collection = mongo.db.notification_dead_letters
 scheduler = APScheduler()
 
 
+@mongo.on_connect
+def create_notification_indexes():
+    """Function to create the notification indexes once this process is connected"""
+    # Expo keeps receipts for a day, so older tickets can never be checked
+    push_receipts_collection.create_index("sentAt", expireAfterSeconds=86400)
+    notification_jobs_collection.create_index(
+        "key", unique=True, partialFilterExpression={"key": {"$type": "string"}}
+    )
+    notification_jobs_collection.create_index(
+        [("status", ASCENDING), ("runAt", ASCENDING)]
+    )
+    # Finished jobs are kept for a day so a repeated idempotency key is still caught
+    notification_jobs_collection.create_index("finishedAt", expireAfterSeconds=86400)
+    dead_letters_collection.create_index("failedAt")
+    dead_letters_collection.create_index(
+        "key", partialFilterExpression={"key": {"$type": "string"}}
+    )
+    # One document per user: ``tokens`` holds every device, ``token`` the latest one
+    tokens_collection.create_index("userId")
+    tokens_collection.create_index("tokens")
+
+
+# The singletons below are configured from the app by init_app()
+
+# userId -> list of device tokens, the most recently registered last
+token_cache = TTLCache()
+
+
+def forget_tokens(user_ids):
+    """Function to drop cached tokens after a user's devices changed"""
+    token_cache.invalidate(*user_ids)
+
+
+push_service = PushService(
+    ExpoPushClient(
+        on_request=lambda operation, seconds, outcome: observe_outbound(
+            "expo", operation, seconds, outcome
+        ),
+    ),
+    tokens_collection,
+    push_receipts_collection,
+    on_tokens_pruned=forget_tokens,
+)
+
+
+def deliver_push(messages):
+    """Function to send a job's messages and return the ones worth retrying"""
+    result = push_service.send(messages)
+    return result["retry"], result["error"]
+
+
+# HTTP handlers only enqueue; a bounded pool of workers talks to Expo
+notification_queue = NotificationQueue(
+    notification_jobs_collection, dead_letters_collection, deliver_push
+)
+
+
+def init_app(app):
+    """Function to configure the push client, queue and token cache from the app"""
+    token_cache.maxsize = app.config["TOKEN_CACHE_SIZE"]
+    token_cache.ttl = app.config["TOKEN_CACHE_TTL"]
+    push_service.init_app(app)
+    notification_queue.init_app(app)
+
+
+@notification_bp.before_app_request
+def start_notification_workers():
+    """Function to resume queued jobs in each worker process"""
+    notification_queue.start()
+
+
+def serialize_job(job):
+    """Function to convert a notification job to a JSON-safe dict"""
+    return {
+        "jobId": str(job["_id"]),
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "total": job.get("total", 0),
+        "remaining": len(job.get("messages", [])),
+        "lastError": job.get("lastError"),
+        "createdAt": job["createdAt"].isoformat(),
+        "failedAt": job["failedAt"].isoformat() if job.get("failedAt") else None,
+    }
+
+
+def record_tokens(record):
+    """Function to list every device token of a token document, latest last"""
+    tokens = list(record.get("tokens") or [])
+    # Documents written before multi-device support only have ``token``
+    latest = record.get("token")
+    if latest:
+        tokens = [token for token in tokens if token != latest] + [latest]
+    return tokens
+
+
+def resolve_tokens(user_ids):
+    """Function to map user IDs to their device tokens.
+
+    Reads through ``token_cache``; users missing from it are loaded with a
+    single ``$in`` query. Every requested user is in the result, with an
+    empty list when no device is registered.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    tokens, missing = token_cache.get_many(user_ids)
+    if not missing:
+        return tokens
+
+    epoch = token_cache.epoch()
+    loaded = {user_id: [] for user_id in missing}
+    for record in tokens_collection.find(
+        {"userId": {"$in": missing}},
+        {"_id": 0, "userId": 1, "token": 1, "tokens": 1},
+    ):
+        user_tokens = loaded[record["userId"]]
+        user_tokens.extend(t for t in record_tokens(record) if t not in user_tokens)
+    token_cache.set_many(loaded, epoch)
+    tokens.update(loaded)
+    return tokens
+
+
+def notify_users(user_ids, title, body, data=None, key=None, kind="fanout"):
+    """Function to queue one notification for every device of the given users.
+
+    Returns the queued job, or None when nobody has a device registered,
+    and the number of devices targeted.
+    """
+    # A shared device registered to several users gets the notification once
+    tokens = {
+        token
+        for user_tokens in resolve_tokens(user_ids).values()
+        for token in user_tokens
+    }
+    messages = [
+        {
+            "to": token,
+            "title": title,
+            "body": body,
+            "sound": "default",
+            "data": data or {},
+        }
+        for token in sorted(tokens)
+    ]
+    if not messages:
+        return None, 0
+    job, _ = notification_queue.enqueue(messages, key=key, kind=kind)
+    return job, len(messages)
+
+
+def family_members(family, include_patient=True):
+    """Function to list the user IDs of a family; ``members`` are the caregivers"""
+    members = list(family.get("members", []))
+    patient = family.get("patient")
+    if patient:
+        members = [member for member in members if member != patient]
+        if include_patient:
+            members.append(patient)
+    return members
+
+
+def notify_caregivers(patient_id, title, body, data=None, key=None):
+    """Function to notify every caregiver in the patient's family"""
+    family = families_collection.find_one(
+        {"patient": patient_id}, {"_id": 0, "members": 1, "patient": 1}
+    )
+    if not family:
+        return 0
+
+    _, count = notify_users(
+        family_members(family, include_patient=False),
+        title,
+        body,
+        data,
+        key=key,
+        kind="caregivers",
+    )
+    return count
+
+
+def fanout_response(job, count):
+    """Function to build the 202 response of a fan-out request"""
+    if job is None:
+        return (
+            jsonify({"status": "error", "message": "No devices registered"}),
+            404,
+        )
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "message": "Notification queued",
+                "devices": count,
+                "job": serialize_job(job),
+            }
+        ),
+        202,
+    )
+
+
+@notification_bp.route("/notify-family", methods=["POST"])
+def notify_family():
+    """Function to notify every member of a family, optionally except the sender"""
+    data = request.json or {}
+    family_id = data.get("familyId")
+    title = data.get("title")
+    message = data.get("message")
+    if not family_id or not message:
+        return (
+            jsonify({"status": "error", "message": "Missing familyId or message"}),
+            400,
+        )
+
+    family = families_collection.find_one(
+        {"family_id": family_id}, {"_id": 0, "members": 1, "patient": 1}
+    )
+    if not family:
+        return jsonify({"status": "error", "message": "Family not found"}), 404
+
+    sender_id = data.get("senderId")
+    recipients = [user for user in family_members(family) if user != sender_id]
+    key = request.headers.get("Idempotency-Key") or data.get("idempotencyKey")
+    job, count = notify_users(
+        recipients, title or "Family update", message, data.get("data"), key=key
+    )
+    return fanout_response(job, count)
+
+
+@notification_bp.route("/notify-caregivers", methods=["POST"])
+def notify_patient_caregivers():
+    """Function to notify all caregivers of a patient, e.g. for a missed dose"""
+    data = request.json or {}
+    patient_id = data.get("PATId")
+    message = data.get("message")
+    if not patient_id or not message:
+        return (
+            jsonify({"status": "error", "message": "Missing PATId or message"}),
+            400,
+        )
+
+    family = families_collection.find_one(
+        {"patient": patient_id}, {"_id": 0, "members": 1, "patient": 1}
+    )
+    if not family:
+        return jsonify({"status": "error", "message": "Family not found"}), 404
+
+    key = request.headers.get("Idempotency-Key") or data.get("idempotencyKey")
+    job, count = notify_users(
+        family_members(family, include_patient=False),
+        data.get("title") or "Patient alert",
+        message,
+        data.get("data"),
+        key=key,
+        kind="caregivers",
+    )
+    return fanout_response(job, count)
+
+
 @notification_bp.route("/send-push-notification", methods=["POST"])
 def custom_push_notification():
     """Function to send custom expo notifications directly to the patients"""
@@ -18,29 +284,71 @@ def custom_push_notification():
     patient_id = data.get("PATId")
     message = data.get("message")
 
-    # Retrieve patient's push token from the database
-    patient = tokens_collection.find_one({"userId": patient_id})
-    push_token = patient.get("token")
+    # Retrieve every device token of the patient from the database
+    push_tokens = resolve_tokens([patient_id]).get(patient_id)
 
-    if not push_token:
+    if not push_tokens:
         return jsonify({"error": "Push token not found for patient."}), 400
 
-    # Create the notification payload
-    payload = {
-        "to": push_token,
-        "title": "Message from Caregiver",
-        "body": message,
-        "sound": "default",
-    }
+    # Create one notification payload per device
+    payloads = [
+        {
+            "to": push_token,
+            "title": "Message from Caregiver",
+            "body": message,
+            "sound": "default",
+        }
+        for push_token in push_tokens
+    ]
+
+    # Queue the notification; a retried request with the same key is not resent
+    key = request.headers.get("Idempotency-Key") or data.get("idempotencyKey")
+    job, created = notification_queue.enqueue(payloads, key=key)
+
+    return (
+        jsonify(
+            {
+                "success": "Notification queued" if created else "Already queued",
+                "job": serialize_job(job),
+            }
+        ),
+        202,
+    )
+
 
-    # Send the notification using the Expo push service
+@notification_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_notification_job(job_id):
+    """Function to check the delivery status of a queued notification"""
     try:
-        response = requests.post("https://exp.host/--/api/v2/push/send", json=payload)
-        response.raise_for_status()
+        job = notification_queue.get(ObjectId(job_id))
+    except InvalidId:
+        return jsonify({"status": "error", "message": "Invalid job id"}), 400
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "success", "job": serialize_job(job)}), 200
 
-        return jsonify({"success": "Notification sent successfully"}), 200
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": str(e)}), 500
+
+@notification_bp.route("/dead-letters", methods=["GET"])
+def get_dead_letters():
+    """Function to list notifications that failed after every retry"""
+    try:
+        limit = min(int(request.args.get("limit", 50)), 500)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit"}), 400
+    jobs = [serialize_job(job) for job in notification_queue.dead_letters(limit)]
+    return jsonify({"status": "success", "jobs": jobs}), 200
+
+
+@notification_bp.route("/dead-letters/<job_id>/retry", methods=["POST"])
+def retry_dead_letter(job_id):
+    """Function to put a failed notification back on the queue"""
+    try:
+        job = notification_queue.retry_dead_letter(ObjectId(job_id))
+    except InvalidId:
+        return jsonify({"status": "error", "message": "Invalid job id"}), 400
+    if not job:
+        return jsonify({"status": "error", "message": "Dead letter not found"}), 404
+    return jsonify({"status": "success", "job": serialize_job(job)}), 202
 
 
 @notification_bp.route("/store-token", methods=["POST"])
@@ -53,14 +361,64 @@ def store_user_token():
     if not token:
         return jsonify({"status": "error", "message": "Missing token"}), 400
 
-    # Insert or update the token in the database
+    # Add the device to the user's token set; ``token`` keeps the latest one.
+    # A legacy ``token`` is folded into the set before it is overwritten, so
+    # the device registered before multi-device support keeps receiving
+    new_token = {"$literal": token}
     tokens_collection.update_one(
-        {"userId": user_id}, {"$set": {"token": token}}, upsert=True
+        {"userId": user_id},
+        [
+            {
+                "$set": {
+                    "tokens": {
+                        "$setUnion": [
+                            {"$ifNull": ["$tokens", []]},
+                            [{"$ifNull": ["$token", new_token]}, new_token],
+                        ]
+                    },
+                    "token": new_token,
+                }
+            }
+        ],
+        upsert=True,
     )
+    # A device signed in to another account stops receiving its notifications
+    previous_users = tokens_collection.distinct(
+        "userId",
+        {"userId": {"$ne": user_id}, "$or": [{"tokens": token}, {"token": token}]},
+    )
+    if previous_users:
+        tokens_collection.update_many(
+            {"userId": {"$in": previous_users}}, {"$pull": {"tokens": token}}
+        )
+        tokens_collection.update_many(
+            {"userId": {"$in": previous_users}, "token": token},
+            {"$unset": {"token": ""}},
+        )
+    forget_tokens([user_id, *previous_users])
 
     return jsonify({"status": "success", "message": "Token stored successfully"}), 200
 
 
+@notification_bp.route("/remove-token", methods=["POST"])
+def remove_user_token():
+    """Function to unregister a device, e.g. when the user signs out"""
+    data = request.json or {}
+    token = data.get("token")
+    user_id = data.get("userId")
+
+    if not token or not user_id:
+        return jsonify({"status": "error", "message": "Missing token or userId"}), 400
+
+    tokens_collection.update_one({"userId": user_id}, {"$pull": {"tokens": token}})
+    tokens_collection.update_one(
+        {"userId": user_id, "token": token}, {"$unset": {"token": ""}}
+    )
+    forget_tokens([user_id])
+
+    return jsonify({"status": "success", "message": "Token removed successfully"}), 200
+
+
 @notification_bp.route("/get-user-token", methods=["GET"])
 def get_user_token():
     """Function to get stored token"""
@@ -68,16 +426,16 @@ def get_user_token():
     if not user_id:
         return jsonify({"status": "error", "message": "Missing UserId"}), 400
 
-    data = tokens_collection.find_one({"userId": user_id})
-    push_token = data.get("token")
+    push_tokens = resolve_tokens([user_id])[user_id]
 
-    if not push_token:
+    if not push_tokens:
         return jsonify({"error": "Push token not found for user."}), 400
 
     return jsonify(
         {
             "status": "success",
             "message": "Token retrievied successfully",
-            "token": push_token,
+            "token": push_tokens[-1],
+            "tokens": push_tokens,
         }
     )
@@ -0,0 +1,44 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Background thread that calls ``function`` every ``interval`` seconds.
+
+    Like the other background threads, it is started lazily in each process
+    because threads do not survive a fork. Errors are logged and the next
+    tick runs as usual.
+    """
+
+    def __init__(self, function, interval=600.0, name=None):
+        self.function = function
+        self.interval = interval
+        self.name = name or function.__name__
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Function to start the thread in this process"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.function()
+            except Exception as e:
+                logger.error("%s error: %s", self.name, e)
+            time.sleep(self.interval)
@@ -0,0 +1,187 @@
+import json
+import threading
+
+
+class MemoryPresenceStore:
+    """Socket sessions and room presence kept in this process.
+
+    Suitable for a single worker and for tests. Use ``RedisPresenceStore``
+    when several workers or nodes share the same chat rooms.
+    """
+
+    # Nothing here talks to a server, so there are no outages to handle
+    errors = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        # room -> {user: {sid, ...}}
+        self._rooms = {}
+
+    def save_session(self, sid, data):
+        """Function to store the session of a connected socket"""
+        with self._lock:
+            self._sessions[sid] = dict(data)
+
+    def get_session(self, sid):
+        """Function to read the session of a connected socket"""
+        return self._sessions.get(sid)
+
+    def pop_session(self, sid):
+        """Function to remove and return the session of a socket"""
+        with self._lock:
+            return self._sessions.pop(sid, None)
+
+    def join(self, room, user, sid):
+        """Function to add a socket to a room and return the member count"""
+        with self._lock:
+            members = self._rooms.setdefault(room, {})
+            members.setdefault(user, set()).add(sid)
+            return len(members)
+
+    def leave(self, room, user, sid):
+        """Function to remove a socket from a room and return the member count"""
+        with self._lock:
+            members = self._rooms.get(room, {})
+            sids = members.get(user, set())
+            sids.discard(sid)
+            if not sids:
+                members.pop(user, None)
+            if not members:
+                self._rooms.pop(room, None)
+            return len(members)
+
+    def count(self, room):
+        """Function to count distinct users connected to a room"""
+        return len(self._rooms.get(room, {}))
+
+    def clear_room(self, room):
+        """Function to drop all presence data of a room"""
+        with self._lock:
+            self._rooms.pop(room, None)
+
+    def mark_room_deleted(self, room):
+        """Function to record that a room was deleted.
+
+        Only this process uses the store, and its registry has already
+        forgotten the room, so there is nobody else to tell.
+        """
+
+    def is_room_deleted(self, room):
+        """Function to check whether another worker deleted a room"""
+        return False
+
+    def unmark_room_deleted(self, room):
+        """Function to clear a deleted room's tombstone"""
+
+
+# Add a socket to a user's sid set, register the user, and return the room size
+JOIN_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('SADD', KEYS[2], ARGV[2])
+return redis.call('SCARD', KEYS[2])
+"""
+
+# Remove a socket; the user leaves the room once its last socket is gone
+LEAVE_SCRIPT = """
+redis.call('SREM', KEYS[1], ARGV[1])
+if redis.call('SCARD', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+return redis.call('SCARD', KEYS[2])
+"""
+
+
+class RedisPresenceStore:
+    """Socket sessions and room presence shared by every worker through Redis."""
+
+    def __init__(self, url, prefix="lumi", session_ttl=86400, tombstone_ttl=604800):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "The redis package is required for a redis:// presence store"
+            ) from e
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        # Raised while Redis is unreachable; callers log these and carry on
+        self.errors = (redis.ConnectionError, redis.TimeoutError)
+        self.prefix = prefix
+        self.session_ttl = session_ttl
+        self.tombstone_ttl = tombstone_ttl
+        self._join = self.client.register_script(JOIN_SCRIPT)
+        self._leave = self.client.register_script(LEAVE_SCRIPT)
+
+    def _session_key(self, sid):
+        return f"{self.prefix}:session:{sid}"
+
+    def _users_key(self, room):
+        return f"{self.prefix}:room:{room}:users"
+
+    def _sids_key(self, room, user):
+        return f"{self.prefix}:room:{room}:user:{user}"
+
+    def _tombstone_key(self, room):
+        return f"{self.prefix}:room:{room}:deleted"
+
+    def save_session(self, sid, data):
+        """Function to store the session of a connected socket"""
+        self.client.set(self._session_key(sid), json.dumps(data), ex=self.session_ttl)
+
+    def get_session(self, sid):
+        """Function to read the session of a connected socket"""
+        data = self.client.get(self._session_key(sid))
+        return json.loads(data) if data else None
+
+    def pop_session(self, sid):
+        """Function to remove and return the session of a socket"""
+        pipe = self.client.pipeline()
+        pipe.get(self._session_key(sid))
+        pipe.delete(self._session_key(sid))
+        data, _ = pipe.execute()
+        return json.loads(data) if data else None
+
+    def join(self, room, user, sid):
+        """Function to add a socket to a room and return the member count"""
+        keys = [self._sids_key(room, user), self._users_key(room)]
+        return int(self._join(keys=keys, args=[sid, user]))
+
+    def leave(self, room, user, sid):
+        """Function to remove a socket from a room and return the member count"""
+        keys = [self._sids_key(room, user), self._users_key(room)]
+        return int(self._leave(keys=keys, args=[sid, user]))
+
+    def count(self, room):
+        """Function to count distinct users connected to a room"""
+        return self.client.scard(self._users_key(room))
+
+    def clear_room(self, room):
+        """Function to drop all presence data of a room"""
+        users = self.client.smembers(self._users_key(room))
+        keys = [self._sids_key(room, user) for user in users]
+        self.client.delete(self._users_key(room), *keys)
+
+    def mark_room_deleted(self, room):
+        """Function to record that a room was deleted, for the other workers.
+
+        Tombstones outlive the registries' periodic reload from MongoDB, after
+        which no worker still holds the room in memory.
+        """
+        self.client.set(self._tombstone_key(room), 1, ex=self.tombstone_ttl)
+
+    def is_room_deleted(self, room):
+        """Function to check whether any worker deleted a room"""
+        return bool(self.client.exists(self._tombstone_key(room)))
+
+    def unmark_room_deleted(self, room):
+        """Function to clear a deleted room's tombstone"""
+        self.client.delete(self._tombstone_key(room))
+
+
+def create_presence_store(url=None):
+    """Function to build the presence store configured by ``PRESENCE_STORE_URL``"""
+    if url and url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPresenceStore(url)
+    if url and url != "memory://":
+        raise ValueError(f"Unsupported presence store URL: {url}")
+    return MemoryPresenceStore()
@@ -0,0 +1,319 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from pymongo.errors import PyMongoError
+from requests.adapters import HTTPAdapter
+
+EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+EXPO_RECEIPTS_URL = "https://exp.host/--/api/v2/push/getReceipts"
+
+# Expo limits a push request to 100 messages and a receipt request to 1000 ids
+MAX_PUSH_BATCH = 100
+MAX_RECEIPT_BATCH = 1000
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Ticket errors worth sending again later; anything else will fail the same way
+RETRYABLE_TICKET_ERRORS = {None, "MessageRateExceeded"}
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(items, size):
+    """Function to split a list into consecutive chunks of at most ``size``"""
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class ExpoPushError(Exception):
+    """Raised when Expo keeps rejecting a request after every retry."""
+
+
+class ExpoPushClient:
+    """HTTP client for the Expo push service.
+
+    Requests go through one pooled ``requests.Session`` with connect/read
+    timeouts. Messages are sent in chunks of up to 100, a few chunks at a
+    time, and a chunk is retried with exponential backoff on connection
+    errors, 429 and 5xx responses, honouring ``Retry-After``. Every HTTP
+    attempt is reported to ``on_request(operation, seconds, outcome)``.
+    """
+
+    def __init__(
+        self,
+        push_url=EXPO_PUSH_URL,
+        receipts_url=EXPO_RECEIPTS_URL,
+        access_token=None,
+        batch_size=MAX_PUSH_BATCH,
+        concurrency=4,
+        timeout=10.0,
+        max_retries=4,
+        backoff=0.5,
+        max_backoff=30.0,
+        on_request=None,
+    ):
+        self.push_url = push_url
+        self.receipts_url = receipts_url
+        self.batch_size = min(batch_size, MAX_PUSH_BATCH)
+        self.concurrency = concurrency
+        # (connect, read) so a dead host fails fast
+        self.timeout = (min(timeout, 3.05), timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_request = on_request
+        self.session = self._open_session(access_token)
+
+    def init_app(self, app):
+        """Function to read the Expo endpoints, token and limits from the app config"""
+        config = app.config
+        self.push_url = config["EXPO_PUSH_URL"]
+        self.receipts_url = config["EXPO_RECEIPTS_URL"]
+        self.concurrency = config["PUSH_CONCURRENCY"]
+        self.timeout = (min(config["PUSH_TIMEOUT"], 3.05), config["PUSH_TIMEOUT"])
+        self.max_retries = config["PUSH_MAX_RETRIES"]
+        # The pool is sized by the concurrency, so the session is replaced
+        self.session.close()
+        self.session = self._open_session(config["EXPO_ACCESS_TOKEN"])
+
+    def _open_session(self, access_token):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(self.concurrency, 1)
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Content-Type": "application/json",
+            }
+        )
+        if access_token:
+            session.headers["Authorization"] = f"Bearer {access_token}"
+        return session
+
+    def send(self, messages):
+        """Function to send messages and return one ticket per message, in order.
+
+        A chunk that still fails after every retry yields error tickets for
+        its messages instead of aborting the other chunks.
+        """
+        chunks = chunked(list(messages), self.batch_size)
+        if len(chunks) <= 1 or self.concurrency <= 1:
+            results = [self._send_chunk(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=min(self.concurrency, len(chunks))
+            ) as executor:
+                results = list(executor.map(self._send_chunk, chunks))
+        return [ticket for tickets in results for ticket in tickets]
+
+    def get_receipts(self, ticket_ids):
+        """Function to fetch receipts for ticket ids; returns ``{id: receipt}``"""
+        receipts = {}
+        for chunk in chunked(list(ticket_ids), MAX_RECEIPT_BATCH):
+            response = self._post(self.receipts_url, {"ids": chunk}, "receipts")
+            receipts.update(response.get("data") or {})
+        return receipts
+
+    def _send_chunk(self, chunk):
+        try:
+            tickets = self._post(self.push_url, chunk, "send").get("data") or []
+        except (ExpoPushError, requests.RequestException, ValueError) as e:
+            return [{"status": "error", "message": str(e)} for _ in chunk]
+        if len(tickets) != len(chunk):
+            return [
+                {"status": "error", "message": "Expo returned a partial response"}
+                for _ in chunk
+            ]
+        return tickets
+
+    def _post(self, url, payload, operation):
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                self._report(operation, started, str(response.status_code))
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+                error = f"Expo responded with {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._report(operation, started, type(e).__name__)
+                error = str(e)
+
+            if attempt == self.max_retries:
+                raise ExpoPushError(error)
+            time.sleep(self._delay(attempt, retry_after))
+
+    def _report(self, operation, started, outcome):
+        if self.on_request:
+            self.on_request(operation, time.perf_counter() - started, outcome)
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        # Full jitter keeps workers that failed together from retrying together
+        return random.uniform(0, min(self.backoff * 2**attempt, self.max_backoff))
+
+
+class PushService:
+    """Sends push notifications and follows up on their delivery receipts.
+
+    Tickets Expo accepted are stored in ``receipts_collection``; once
+    ``receipt_delay`` has passed the background checker fetches their
+    receipts. Tokens reported as ``DeviceNotRegistered``, by a ticket or a
+    receipt, are removed from ``tokens_collection`` and the affected user
+    IDs are passed to ``on_tokens_pruned``.
+    """
+
+    def __init__(
+        self,
+        client,
+        tokens_collection,
+        receipts_collection,
+        receipt_delay=900.0,
+        check_interval=300.0,
+        on_tokens_pruned=None,
+    ):
+        self.client = client
+        self.tokens_collection = tokens_collection
+        self.receipts_collection = receipts_collection
+        self.receipt_delay = receipt_delay
+        self.check_interval = check_interval
+        self.on_tokens_pruned = on_tokens_pruned
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        """Function to configure the client and receipt checks from the app config"""
+        self.client.init_app(app)
+        self.receipt_delay = app.config["PUSH_RECEIPT_DELAY"]
+        self.check_interval = app.config["PUSH_RECEIPT_CHECK_INTERVAL"]
+
+    def send(self, messages):
+        """Function to send messages.
+
+        Returns counts, the pruned tokens, the messages that failed
+        transiently (network errors, rate limits) and may be sent again, and
+        the first error Expo reported.
+        """
+        messages = [message for message in messages if message.get("to")]
+        if not messages:
+            return {
+                "sent": 0,
+                "failed": 0,
+                "invalidTokens": [],
+                "retry": [],
+                "error": None,
+            }
+        self._ensure_started()
+
+        tickets = self.client.send(messages)
+        now = datetime.now(timezone.utc)
+        receipts, invalid, retry, failed, first_error = [], set(), [], 0, None
+        for message, ticket in zip(messages, tickets):
+            if ticket.get("status") == "ok" and ticket.get("id"):
+                receipts.append(
+                    {"_id": ticket["id"], "token": message["to"], "sentAt": now}
+                )
+                continue
+            failed += 1
+            first_error = first_error or ticket.get("message")
+            error = (ticket.get("details") or {}).get("error")
+            if error == "DeviceNotRegistered":
+                invalid.add(message["to"])
+            elif error in RETRYABLE_TICKET_ERRORS:
+                retry.append(message)
+
+        try:
+            if receipts:
+                self.receipts_collection.insert_many(receipts, ordered=False)
+            self.prune_tokens(invalid)
+        except PyMongoError as e:
+            logger.error("Push bookkeeping error: %s", e)
+
+        return {
+            "sent": len(messages) - failed,
+            "failed": failed,
+            "invalidTokens": sorted(invalid),
+            "retry": retry,
+            "error": first_error,
+        }
+
+    def prune_tokens(self, tokens):
+        """Function to remove push tokens Expo no longer accepts from every user"""
+        if not tokens:
+            return
+        tokens = list(tokens)
+        user_ids = self.tokens_collection.distinct(
+            "userId", {"$or": [{"tokens": {"$in": tokens}}, {"token": {"$in": tokens}}]}
+        )
+        self.tokens_collection.update_many(
+            {"tokens": {"$in": tokens}}, {"$pull": {"tokens": {"$in": tokens}}}
+        )
+        self.tokens_collection.update_many(
+            {"token": {"$in": tokens}}, {"$unset": {"token": ""}}
+        )
+        if self.on_tokens_pruned and user_ids:
+            self.on_tokens_pruned(user_ids)
+
+    def check_receipts(self):
+        """Function to process the receipts of tickets old enough to have one"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.receipt_delay)
+        pending = list(
+            self.receipts_collection.find(
+                {"sentAt": {"$lte": cutoff}}, {"token": 1}
+            ).limit(MAX_RECEIPT_BATCH * 10)
+        )
+        if not pending:
+            return 0
+
+        tokens = {ticket["_id"]: ticket["token"] for ticket in pending}
+        receipts = self.client.get_receipts(list(tokens))
+        invalid = {
+            tokens[ticket_id]
+            for ticket_id, receipt in receipts.items()
+            if (receipt.get("details") or {}).get("error") == "DeviceNotRegistered"
+        }
+        for ticket_id, receipt in receipts.items():
+            if receipt.get("status") == "error":
+                logger.warning(
+                    "Push receipt %s failed: %s", ticket_id, receipt.get("message")
+                )
+
+        self.prune_tokens(invalid)
+        # Tickets without a receipt yet are retried until their TTL expires
+        self.receipts_collection.delete_many({"_id": {"$in": list(receipts)}})
+        return len(receipts)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="push-receipts", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.check_receipts()
+            except (ExpoPushError, requests.RequestException, PyMongoError) as e:
+                logger.error("Push receipt check error: %s", e)
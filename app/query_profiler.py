@@ -0,0 +1,232 @@
+import threading
+from functools import wraps
+
+from flask import current_app, request
+from pymongo import monitoring
+
+from app.metrics import DEFAULT_BUCKETS, registry
+
+# Driver housekeeping that says nothing about how a handler uses the database
+IGNORED_COMMANDS = {
+    "hello",
+    "ismaster",
+    "isMaster",
+    "ping",
+    "buildInfo",
+    "endSessions",
+    "saslStart",
+    "saslContinue",
+    "killCursors",
+}
+
+db_queries = registry.histogram(
+    "lumi_db_queries_per_request",
+    "MongoDB commands issued while handling one HTTP request.",
+    ("blueprint", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55),
+)
+db_latency = registry.histogram(
+    "lumi_db_command_duration_seconds",
+    "MongoDB command latency during HTTP requests, by collection and operation.",
+    ("collection", "operation"),
+    buckets=(0.001, 0.0025) + DEFAULT_BUCKETS,
+)
+
+
+def command_collection(event):
+    """Function to find the collection a command runs against"""
+    if event.command_name == "getMore":
+        return event.command.get("collection", "")
+    target = event.command.get(event.command_name)
+    return target if isinstance(target, str) else ""
+
+
+def command_shape(event):
+    """Function to reduce a command to its operation and filter fields.
+
+    Two commands with the same shape differ only in the values they look
+    up, which is what an N+1 loop looks like from the database's side.
+    """
+    command = event.command
+    name = event.command_name
+    if name in ("update", "delete"):
+        statements = command.get("updates" if name == "update" else "deletes") or [{}]
+        query = statements[0].get("q")
+    elif name == "aggregate":
+        stages = command.get("pipeline") or [{}]
+        query = stages[0].get("$match")
+    elif name in ("findAndModify", "count"):
+        query = command.get("query")
+    else:
+        query = command.get("filter")
+    fields = tuple(sorted(query)) if isinstance(query, dict) else ()
+    return name, command_collection(event), fields
+
+
+class RequestProfile:
+    """Database usage of one request: counts, time per operation, slow commands."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # (collection, operation) -> [count, seconds]
+        self.operations = {}
+        # command shape -> count
+        self.shapes = {}
+        self.slow = []
+        self.pending = {}
+
+    def repeated(self, threshold):
+        """Function to list command shapes issued at least ``threshold`` times"""
+        return [
+            (shape, count)
+            for shape, count in self.shapes.items()
+            if count >= threshold and shape[0] in ("find", "count", "aggregate")
+        ]
+
+    def summary(self):
+        """Function to describe the profile as a JSON-safe dict"""
+        return {
+            "queries": self.count,
+            "dbMs": round(self.seconds * 1000, 2),
+            "operations": {
+                f"{collection}.{operation}": {
+                    "count": count,
+                    "ms": round(seconds * 1000, 2),
+                }
+                for (collection, operation), (count, seconds) in self.operations.items()
+            },
+            "slow": self.slow,
+        }
+
+
+class QueryProfiler(monitoring.CommandListener):
+    """PyMongo command listener that attributes commands to the current request.
+
+    Commands are recorded only while a profile is active on the calling
+    thread (or green thread under eventlet), so background writers and
+    schedulers do not pollute request numbers.
+    """
+
+    def __init__(self, slow_ms=100.0):
+        self.slow_ms = slow_ms
+        self._local = threading.local()
+
+    def start(self):
+        """Function to begin profiling the current request"""
+        self._local.profile = RequestProfile()
+        return self._local.profile
+
+    def stop(self):
+        """Function to end profiling and return the request's profile"""
+        profile = getattr(self._local, "profile", None)
+        self._local.profile = None
+        return profile
+
+    def started(self, event):
+        profile = getattr(self._local, "profile", None)
+        if profile is None or event.command_name in IGNORED_COMMANDS:
+            return
+        shape = command_shape(event)
+        profile.pending[event.request_id] = shape
+        profile.shapes[shape] = profile.shapes.get(shape, 0) + 1
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            return
+        shape = profile.pending.pop(event.request_id, None)
+        if shape is None:
+            return
+        operation, collection = shape[0], shape[1]
+        seconds = event.duration_micros / 1e6
+        profile.count += 1
+        profile.seconds += seconds
+        totals = profile.operations.setdefault((collection, operation), [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+        db_latency.observe(seconds, collection, operation)
+        if seconds * 1000 >= self.slow_ms:
+            profile.slow.append(
+                {
+                    "collection": collection,
+                    "operation": operation,
+                    "fields": list(shape[2]),
+                    "ms": round(seconds * 1000, 2),
+                }
+            )
+
+
+def query_budget(limit):
+    """Function to give a route its own query budget, locking in a reduction"""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            return view(*args, **kwargs)
+
+        wrapper.query_budget = limit
+        return wrapper
+
+    return decorator
+
+
+def init_app(app, profiler):
+    """Function to profile every request's MongoDB usage.
+
+    Requests over their query budget, or repeating the same lookup
+    ``QUERY_N_PLUS_ONE_THRESHOLD`` times, are logged. With
+    ``QUERY_PROFILE_HEADER`` enabled the numbers are also returned in a
+    ``Server-Timing`` header and an ``X-Query-Profile`` debug header.
+    """
+
+    @app.before_request
+    def start_query_profile():
+        profiler.start()
+
+    @app.after_request
+    def finish_query_profile(response):
+        profile = profiler.stop()
+        if profile is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        db_queries.observe(profile.count, request.blueprint or "app", route)
+
+        view = current_app.view_functions.get(request.endpoint)
+        budget = getattr(view, "query_budget", app.config["QUERY_BUDGET"])
+        repeated = profile.repeated(app.config["QUERY_N_PLUS_ONE_THRESHOLD"])
+        problems = []
+        if profile.count > budget:
+            problems.append(f"{profile.count} queries over a budget of {budget}")
+        for (operation, collection, fields), count in repeated:
+            problems.append(
+                f"possible N+1: {count}x {collection}.{operation} by {','.join(fields)}"
+            )
+        if problems or profile.slow:
+            current_app.logger.warning(
+                "Query profile %s %s: %s",
+                request.method,
+                route,
+                {"problems": problems, **profile.summary()},
+            )
+
+        if app.config["QUERY_PROFILE_HEADER"]:
+            response.headers["Server-Timing"] = (
+                f'db;dur={profile.seconds * 1000:.2f};desc="{profile.count} queries"'
+            )
+            response.headers["X-Query-Profile"] = "; ".join(
+                [f"count={profile.count}", f"budget={budget}", *problems]
+            )
+        return response
+
+    @app.teardown_request
+    def clear_query_profile(exception=None):
+        # after_request is skipped when a handler raises
+        profiler.stop()
@@ -1,8 +1,8 @@
-import uuid
-
 from flask import Blueprint, jsonify, request
 
 from app import mongo
+from app.ids import new_family_id
+from app.users import users
 
 family_bp = Blueprint("family", __name__)
 
@@ -11,6 +11,12 @@ families_collection = mongo.db.families
 info_collection = mongo.db.info
 
 
+@mongo.on_connect
+def create_family_indexes():
+    """Function to create the family indexes once this process is connected"""
+    families_collection.create_index("family_id", unique=True)
+
+
 @family_bp.route("/", methods=["POST"])
 def create_family():
     """Function to create family Id"""
@@ -21,8 +27,8 @@ def create_family():
         return jsonify({"status": "error", "message": "Caregiver ID is required"}), 400
 
     # Check if the caregiver exists
-    caregiver = user_collection.find_one({"userId": caregiver_id, "role": "CG"})
-    if not caregiver:
+    caregiver = users.get(caregiver_id)
+    if not caregiver or caregiver.get("role") != "CG":
         return (
             jsonify(
                 {"status": "error", "message": "Caregiver not found or invalid role"}
@@ -32,7 +38,6 @@ def create_family():
 
     # Check if the caregiver already has a family
     existing_family = families_collection.find_one({"members": caregiver_id})
-    print(existing_family["family_id"])
     if existing_family:
         return (
             jsonify(
@@ -44,7 +49,7 @@ def create_family():
             400,
         )
     # Generate a unique family ID
-    family_id = str(uuid.uuid4().hex[:8])
+    family_id = new_family_id()
 
     # Create a enw family record in the families collection
     family_record = {
@@ -60,6 +65,7 @@ def create_family():
     result = user_collection.update_one(
         {"userId": caregiver_id}, {"$set": {"family_id": family_id}}
     )
+    users.invalidate(caregiver_id)
     if result.modified_count > 0:
         return (
             jsonify(
@@ -91,7 +97,7 @@ def add_user_to_family():
         )
 
     # Check if the user exists
-    user = user_collection.find_one({"userId": user_id})
+    user = users.get(user_id)
     if not user:
         return jsonify({"status": "error", "message": "User not found"}), 404
 
@@ -104,6 +110,7 @@ def add_user_to_family():
     user_update = user_collection.update_one(
         {"userId": user_id}, {"$set": {"family_id": family_id}}
     )
+    users.invalidate(user_id)
 
     # Add the user to the family's members list if not already present
     if user_id not in family.get("members", []):
@@ -154,7 +161,7 @@ def add_patient_to_family():
         )
 
     # Check if the user exists
-    user = user_collection.find_one({"userId": user_id})
+    user = users.get(user_id)
     if not user:
         return jsonify({"status": "error", "message": "User not found"}), 404
 
@@ -167,6 +174,7 @@ def add_patient_to_family():
     user_update = user_collection.update_one(
         {"userId": user_id}, {"$set": {"family_id": family_id}}
     )
+    users.invalidate(user_id)
 
     # Add the user to the family's patient list if not already present
     family_update = families_collection.update_one(
@@ -215,7 +223,7 @@ def save_additional_info():
             400,
         )
 
-    user_data = user_collection.find_one({"userId": user_id})
+    user_data = users.get(user_id)
     existing_info = info_collection.find_one({"userId": user_id})
 
     additional_info = {
@@ -260,19 +268,19 @@ def get_additional_info():
             400,
         )
 
-    user_data = info_collection.find({"userId": user_id})
-
-    additional_info = [
-        {
-            "_id": str(i["_id"]),
-            "userId": i["userId"],
-            "name": i["name"],
-            "relation": i["relation"],
-            "tagline": i["tagline"],
-            "triggerMemory": i["triggerMemory"],
-        }
-        for i in user_data
-    ]
+    # The JSON provider encodes the ObjectIds
+    additional_info = list(
+        info_collection.find(
+            {"userId": user_id},
+            {
+                "userId": 1,
+                "name": 1,
+                "relation": 1,
+                "tagline": 1,
+                "triggerMemory": 1,
+            },
+        )
+    )
 
     return (
         jsonify(
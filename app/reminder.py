@@ -1,21 +1,33 @@
 import json
-import uuid
 
 from flask import Blueprint, jsonify, request
 from werkzeug.exceptions import BadRequest
 
 from app import mongo
+from app.ids import new_reminder_id
+from app.query_profiler import query_budget
+from app.users import users
 
 reminder_bp = Blueprint("reminder", __name__)
 # Access the MongoDB reminders collection
 reminders_collection = mongo.db.reminders
-user_collection = mongo.db.users
+# Fields a reminder is returned with
+REMINDER_FIELDS = {
+    "title": 1,
+    "description": 1,
+    "date": 1,
+    "time": 1,
+    "status": 1,
+    "urgent": 1,
+    "important": 1,
+    "remId": 1,
+}
 
 
-def generate_reminder_id():
-    """Generate a unique reminder ID using UUID."""
-    unique_id = uuid.uuid4().hex[:8]  # Create a unique ID
-    return f"{unique_id.upper()}"  # Return the ID in uppercase
+@mongo.on_connect
+def create_reminder_indexes():
+    """Function to create the reminder indexes once this process is connected"""
+    reminders_collection.create_index("remId", unique=True)
 
 
 def get_json_data(request):
@@ -28,8 +40,11 @@ def get_json_data(request):
 
 def get_reminders(user_id):
     """Function to get reminders for a specific user."""
-    # Query the database for reminders belonging to the user
-    user_reminders = list(reminders_collection.find({"userId": user_id}))
+    # Query the database for reminders belonging to the user; the JSON
+    # provider encodes the ObjectIds, so documents are returned as they are
+    user_reminders = list(
+        reminders_collection.find({"userId": user_id}, REMINDER_FIELDS)
+    )
 
     if not user_reminders:
         return (
@@ -43,28 +58,12 @@ def get_reminders(user_id):
             200,
         )
 
-    # Create a list of reminders to return
-    reminder_list = [
-        {
-            "_id": str(r["_id"]),
-            "title": r["title"],
-            "description": r["description"],
-            "date": r["date"],
-            "time": r["time"],
-            "status": r["status"],
-            "urgent": r["urgent"],
-            "important": r["important"],
-            "remId": r["remId"],
-        }
-        for r in user_reminders
-    ]
-
     return (
         jsonify(
             {
                 "status": "success",
                 "message": "Retrieved all reminders",
-                "reminders": reminder_list,
+                "reminders": user_reminders,
             }
         ),
         200,
@@ -90,7 +89,7 @@ def create_reminder(data):
     urgent = data.get("isUrgent")
     important = data.get("isImportant")
 
-    rem_id = generate_reminder_id()
+    rem_id = new_reminder_id()
 
     new_reminder = {
         "title": title,
@@ -196,8 +195,9 @@ def caregiver_get_reminders():
             )
 
         # Ensure the caregiver and patient belong to the same family
-        caregiver = user_collection.find_one({"userId": caregiver_id})
-        patient = user_collection.find_one({"userId": patient_id})
+        found = users.get_many([caregiver_id, patient_id])
+        caregiver = found.get(caregiver_id)
+        patient = found.get(patient_id)
         if (
             not caregiver
             or not patient
@@ -289,8 +289,9 @@ def caregiver_post_reminder():
                 400,
             )
 
-        caregiver = user_collection.find_one({"userId": caregiver_id})
-        patient = user_collection.find_one({"userId": patient_id})
+        found = users.get_many([caregiver_id, patient_id])
+        caregiver = found.get(caregiver_id)
+        patient = found.get(patient_id)
         if caregiver["family_id"] != patient["family_id"]:
             return (
                 jsonify(
@@ -377,6 +378,7 @@ def patient_update_reminder(reminder_id):
 
 
 @reminder_bp.route("/caregiver/<reminder_id>", methods=["PUT"])
+@query_budget(4)
 def caregiver_update_reminder(reminder_id):
     """Allow a caregiver to update a reminder for a patient."""
     try:
@@ -409,8 +411,9 @@ def caregiver_update_reminder(reminder_id):
         }
 
         # Ensure the caregiver and patient belong to the same family
-        caregiver = user_collection.find_one({"userId": caregiver_id})
-        patient = user_collection.find_one({"userId": patient_id})
+        found = users.get_many([caregiver_id, patient_id])
+        caregiver = found.get(caregiver_id)
+        patient = found.get(patient_id)
         if (
             not caregiver
             or not patient
@@ -505,8 +508,9 @@ def caregiver_delete_reminder(caregiver_id, patient_id, rem_id):
             )
 
         # Ensure the caregiver and patient belong to the same family
-        caregiver = user_collection.find_one({"userId": caregiver_id})
-        patient = user_collection.find_one({"userId": patient_id})
+        found = users.get_many([caregiver_id, patient_id])
+        caregiver = found.get(caregiver_id)
+        patient = found.get(patient_id)
         if (
             not caregiver
             or not patient
@@ -0,0 +1,260 @@
+import logging
+import os
+import threading
+import time
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class RoomRegistry:
+    """In-memory source of truth for chat rooms and live room membership.
+
+    Rooms are loaded from Mongo and new rooms are registered as they are
+    created. Live membership is kept in the presence store, which is
+    process-local or shared between workers depending on configuration.
+    Member counts are written back to ``rooms_collection`` by a snapshot
+    thread, so socket events never read the database once a room is known.
+
+    Deleting a room removes it from Mongo at once and leaves a tombstone in
+    the presence store, which every lookup checks, so other workers stop
+    serving it immediately. They also reload the rooms from Mongo every
+    ``reload_interval`` seconds, well within the tombstone's lifetime.
+
+    Members are counted per user rather than per socket, which keeps the
+    count stable when a client reconnects before its old socket times out.
+    """
+
+    def __init__(
+        self, collection, presence, snapshot_interval=5.0, reload_interval=300.0
+    ):
+        self.collection = collection
+        self.presence = presence
+        self.snapshot_interval = snapshot_interval
+        self.reload_interval = reload_interval
+        self._lock = threading.RLock()
+        self._loaded = False
+        # room code -> family_id
+        self._rooms = {}
+        # family_id -> room code
+        self._family_rooms = {}
+        self._dirty = set()
+        self._deleted = set()
+        # (room, member, sid) leaves that failed while the store was down
+        self._pending_leaves = []
+        self._thread = None
+        self._pid = None
+        self._loaded_at = 0.0
+
+    def init_app(self, app):
+        """Function to read the snapshot and reload intervals from the app config"""
+        self.snapshot_interval = app.config["ROOM_SNAPSHOT_INTERVAL"]
+        self.reload_interval = app.config["ROOM_RELOAD_INTERVAL"]
+
+    def load(self):
+        """Function to load every persisted room into memory"""
+        with self._lock:
+            if self._loaded:
+                return
+            self.reload()
+
+    def reload(self):
+        """Function to replace the rooms in memory with the persisted ones"""
+        rooms = list(self.collection.find({}, {"_id": 0, "room": 1, "family": 1}))
+        with self._lock:
+            self._rooms, self._family_rooms = {}, {}
+            for room in rooms:
+                if room["room"] not in self._deleted:
+                    self._add(room["room"], room.get("family"))
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    def has_code(self, code):
+        """Function to check whether a room exists and was not deleted elsewhere"""
+        self.load()
+        return code in self._rooms and not self._deleted_elsewhere(code)
+
+    def get_room(self, code):
+        """Function to look up a room, reading Mongo only for rooms created elsewhere"""
+        self.load()
+        if self._deleted_elsewhere(code):
+            return None
+        if code not in self._rooms:
+            if code in self._deleted:
+                return None
+            room_data = self.collection.find_one({"room": code})
+            if not room_data:
+                return None
+            with self._lock:
+                self._add(code, room_data.get("family"))
+        return {
+            "room": code,
+            "family": self._rooms.get(code),
+            "members": self.presence.count(code),
+        }
+
+    def get_family_room(self, family_id):
+        """Function to find the room that belongs to a family"""
+        self.load()
+        code = self._family_rooms.get(family_id)
+        if code is not None:
+            room = self.get_room(code)
+            if room:
+                return room
+        # Unknown here, or deleted by another worker that may have made a new one
+        room_data = self.collection.find_one({"family": family_id})
+        if not room_data or room_data["room"] in self._deleted:
+            return None
+        code = room_data["room"]
+        if self._deleted_elsewhere(code):
+            return None
+        with self._lock:
+            self._add(code, family_id)
+        return self.get_room(code)
+
+    def create_room(self, code, family_id):
+        """Function to persist a new room and register it in memory"""
+        self.collection.insert_one(
+            {"room": code, "members": 0, "family": family_id}
+        )
+        self.presence.unmark_room_deleted(code)
+        with self._lock:
+            self._deleted.discard(code)
+            self._add(code, family_id)
+
+    def connect(self, sid, code, user):
+        """Function to add a socket to a room and return the live member count"""
+        count = self.presence.join(code, user or sid, sid)
+        with self._lock:
+            self._dirty.add(code)
+        self._ensure_started()
+        return count
+
+    def disconnect(self, sid, code, user):
+        """Function to remove a socket from a room and return the remaining members.
+
+        Returns ``None`` when the presence store is unreachable; the leave is
+        then retried by the snapshot thread, which also drops the room if it
+        turns out to be empty, so members do not linger after an outage.
+        """
+        try:
+            count = self.presence.leave(code, user or sid, sid)
+        except self.presence.errors as e:
+            logger.error("Presence error on disconnect, will retry: %s", e)
+            with self._lock:
+                self._pending_leaves.append((code, user or sid, sid))
+            self._ensure_started()
+            return None
+        with self._lock:
+            self._dirty.add(code)
+        return count
+
+    def retry_leaves(self):
+        """Function to replay leaves that failed while the presence store was down"""
+        with self._lock:
+            pending, self._pending_leaves = self._pending_leaves, []
+        for index, (code, member, sid) in enumerate(pending):
+            # Leaving twice is harmless, so a half-done retry is simply redone
+            try:
+                if self.presence.leave(code, member, sid) <= 0:
+                    self.delete_room(code)
+            except self.presence.errors as e:
+                logger.error("Presence error on leave retry: %s", e)
+                with self._lock:
+                    self._pending_leaves = pending[index:] + self._pending_leaves
+                return
+            with self._lock:
+                self._dirty.add(code)
+
+    def delete_room(self, code):
+        """Function to drop an empty room for every worker"""
+        with self._lock:
+            self._forget(code)
+            self._deleted.add(code)
+        self.presence.clear_room(code)
+        self.presence.mark_room_deleted(code)
+        try:
+            self.collection.delete_one({"room": code})
+        except PyMongoError as e:
+            # Left in _deleted, so the next snapshot retries the delete
+            logger.error("Room delete error: %s", e)
+            self._ensure_started()
+            return
+        with self._lock:
+            self._deleted.discard(code)
+
+    def snapshot(self):
+        """Function to write changed member counts and deleted rooms to Mongo"""
+        with self._lock:
+            dirty = {code for code in self._dirty if code in self._rooms}
+            deleted = self._deleted
+            self._dirty, self._deleted = set(), set()
+
+        try:
+            operations = [
+                UpdateOne(
+                    {"room": code}, {"$set": {"members": self.presence.count(code)}}
+                )
+                for code in dirty
+            ]
+        except self.presence.errors as e:
+            logger.error("Presence error during snapshot: %s", e)
+            with self._lock:
+                self._dirty |= dirty
+                self._deleted |= deleted
+            return
+        operations += [DeleteOne({"room": code}) for code in deleted]
+
+        if not operations:
+            return
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except PyMongoError as e:
+            logger.error("Room snapshot error: %s", e)
+            with self._lock:
+                self._dirty |= dirty
+                self._deleted |= deleted - set(self._rooms)
+
+    def _deleted_elsewhere(self, code):
+        if not self.presence.is_room_deleted(code):
+            return False
+        with self._lock:
+            self._forget(code)
+        return True
+
+    def _forget(self, code):
+        family_id = self._rooms.pop(code, None)
+        if self._family_rooms.get(family_id) == code:
+            del self._family_rooms[family_id]
+        self._dirty.discard(code)
+
+    def _add(self, code, family_id):
+        if code not in self._rooms:
+            self._rooms[code] = family_id
+            self._family_rooms[family_id] = code
+        return self._rooms[code]
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="room-snapshot", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.snapshot_interval)
+            self.retry_leaves()
+            self.snapshot()
+            if time.monotonic() - self._loaded_at >= self.reload_interval:
+                try:
+                    self.reload()
+                except PyMongoError as e:
+                    logger.error("Room reload error: %s", e)
@@ -0,0 +1,137 @@
+import json
+import logging
+from datetime import date, datetime, timezone
+
+from bson import ObjectId, json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def default(obj):
+    """Function to encode the types the JSON encoders do not know.
+
+    ObjectIds become their hex string and datetimes ISO 8601 strings, naive
+    ones (as PyMongo returns them) being UTC. Other BSON types fall back to
+    MongoDB's relaxed extended JSON.
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    # Raises TypeError for anything it cannot encode either
+    return json_util.default(obj, RELAXED_JSON_OPTIONS)
+
+
+class OrjsonCodec:
+    """``dumps``/``loads`` on top of orjson, shaped like the ``json`` module.
+
+    orjson encodes datetimes, dataclasses and numpy arrays itself and only
+    calls ``default`` for ObjectIds and other BSON types. Arguments meant for
+    the stdlib encoder, such as Socket.IO's ``separators``, are ignored:
+    orjson output is always compact.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        # Naive datetimes from PyMongo are UTC; int keys are allowed as in json
+        self.options = (
+            orjson.OPT_NAIVE_UTC
+            | orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_SERIALIZE_NUMPY
+        )
+
+    def dumpb(self, obj, indent=False):
+        """Function to serialize to UTF-8 encoded JSON"""
+        options = self.options | orjson.OPT_INDENT_2 if indent else self.options
+        return orjson.dumps(obj, default=default, option=options)
+
+    def dumps(self, obj, *args, indent=None, **kwargs):
+        """Function to serialize to a JSON string"""
+        return self.dumpb(obj, bool(indent)).decode("utf-8")
+
+    def loads(self, s, *args, **kwargs):
+        """Function to parse JSON from a string or bytes"""
+        return orjson.loads(s)
+
+
+class StdlibCodec:
+    """The same interface on the stdlib ``json`` module, for when orjson is missing."""
+
+    name = "json"
+
+    def dumpb(self, obj, indent=False):
+        """Function to serialize to UTF-8 encoded JSON"""
+        return self.dumps(obj, indent=2 if indent else None).encode("utf-8")
+
+    def dumps(self, obj, *args, indent=None, **kwargs):
+        """Function to serialize to a JSON string"""
+        return json.dumps(
+            obj,
+            default=default,
+            ensure_ascii=False,
+            indent=indent,
+            separators=None if indent else (",", ":"),
+        )
+
+    def loads(self, s, *args, **kwargs):
+        """Function to parse JSON from a string or bytes"""
+        return json.loads(s)
+
+
+def create_codec(backend):
+    """Function to build the JSON codec named by ``JSON_BACKEND``"""
+    if backend == "orjson":
+        if orjson is not None:
+            return OrjsonCodec()
+        logger.warning("orjson is not installed; using the json module instead")
+        return StdlibCodec()
+    if backend == "json":
+        return StdlibCodec()
+    raise ValueError(f"Unknown JSON_BACKEND {backend!r}")
+
+
+class CodecJSONProvider(JSONProvider):
+    """Flask JSON provider that serializes with a codec from ``create_codec``.
+
+    Replaces Flask-PyMongo's ``BSONProvider``, which went through
+    ``bson.json_util`` and wrote ObjectIds as ``{"$oid": ...}``, so routes
+    can hand documents to ``jsonify`` without converting them first.
+    """
+
+    mimetype = "application/json"
+    # None pretty-prints in debug mode only, like Flask's default provider
+    compact = None
+
+    def __init__(self, app, codec):
+        super().__init__(app)
+        self.codec = codec
+
+    def dumps(self, obj, **kwargs):
+        """Function to serialize data as JSON"""
+        return self.codec.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        """Function to deserialize data as JSON"""
+        return self.codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Function to serialize the arguments into an ``application/json`` response"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(
+            self.codec.dumpb(obj, indent) + b"\n", mimetype=self.mimetype
+        )
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.geofence import EARTH_RADIUS_M
+
+
+def simplify(latitudes, longitudes, epsilon_m):
+    """Function to simplify a trajectory with Douglas-Peucker.
+
+    Points are projected to a local equirectangular plane in metres, which
+    is accurate for the short, city-scale segments a patient's trajectory
+    is made of. Returns the indices of the points to keep; every dropped
+    point lies within ``epsilon_m`` metres of the simplified polyline.
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    count = len(lat)
+    if count <= 2:
+        return np.arange(count)
+
+    x = EARTH_RADIUS_M * (lon - lon[0]) * np.cos(lat.mean())
+    y = EARTH_RADIUS_M * (lat - lat[0])
+
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    # An explicit stack avoids recursion limits on day-long traces
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1 : end] - x[start], y[start + 1 : end] - y[start]
+        length = dx * dx + dy * dy
+        if length == 0:
+            distance = np.hypot(px, py)
+        else:
+            t = np.clip((px * dx + py * dy) / length, 0.0, 1.0)
+            distance = np.hypot(px - t * dx, py - t * dy)
+
+        farthest = int(np.argmax(distance))
+        if distance[farthest] > epsilon_m:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def bucket_start(value, bucket):
+    """Function to floor a timestamp to the start of its track bucket"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    seconds = int(bucket.total_seconds())
+    floored = int(value.timestamp()) // seconds * seconds
+    return datetime.fromtimestamp(floored, tz=timezone.utc)
+
+
+def uncovered_ranges(start, end, covered):
+    """Function to list the parts of ``[start, end)`` not covered by sorted ranges"""
+    gaps = []
+    cursor = start
+    for range_start, range_end in covered:
+        if range_start > cursor:
+            gaps.append((cursor, min(range_start, end)))
+        cursor = max(cursor, range_end)
+        if cursor >= end:
+            break
+    if cursor < end:
+        gaps.append((cursor, end))
+    return [(gap_start, gap_end) for gap_start, gap_end in gaps if gap_start < gap_end]
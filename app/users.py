@@ -0,0 +1,53 @@
+from app import mongo
+from app.cache import TTLCache
+
+
+class UserCache:
+    """Read-through cache of user records keyed by ``userId``.
+
+    Lookups are served from a per-process ``TTLCache``; misses are loaded
+    with a single ``$in`` query. Records are cached without the password
+    hash, and unknown IDs are not cached, so a user created a moment ago is
+    found straight away. Routes that change a user call ``invalidate``;
+    other workers pick the change up once the TTL runs out.
+    """
+
+    def __init__(self, collection, maxsize=50000, ttl=30.0):
+        self.collection = collection
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        """Function to size the cache from the app config"""
+        self.cache.maxsize = app.config["USER_CACHE_SIZE"]
+        self.cache.ttl = app.config["USER_CACHE_TTL"]
+
+    def get(self, user_id):
+        """Function to look up one user; returns ``None`` for an unknown ID"""
+        if user_id is None:
+            return None
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        """Function to look up several users; returns ``{userId: user}``"""
+        user_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+        found, missing = self.cache.get_many(user_ids)
+        if missing:
+            epoch = self.cache.epoch()
+            loaded = {
+                user["userId"]: user
+                for user in self.collection.find(
+                    {"userId": {"$in": missing}}, {"password": 0}
+                )
+            }
+            self.cache.set_many(loaded, epoch)
+            found.update(loaded)
+        # Callers get their own copy to modify
+        return {user_id: dict(user) for user_id, user in found.items()}
+
+    def invalidate(self, *user_ids):
+        """Function to drop cached users after their records changed"""
+        self.cache.invalidate(*user_ids)
+
+
+# Sized by users.init_app() in create_app()
+users = UserCache(mongo.db.users)
@@ -0,0 +1,387 @@
+"""Load generator for the real-time chat path in ``app/chat.py``.
+
+Simulates families of clients that go through ``create-room`` ->
+``join-room`` -> Socket.IO connect -> message traffic, and reports connect
+rate, broadcast fan-out latency percentiles, messages per second and memory
+per connection.
+
+In-process, against an in-memory MongoDB stand-in (mongomock)::
+
+    python -m benchmarks.chat_load --families 200 --members 5 --messages 20
+
+In-process, against a local MongoDB::
+
+    python -m benchmarks.chat_load --mongo-uri mongodb://localhost:27017/lumi_bench
+
+Against a running server (seeds users through ``--mongo-uri``)::
+
+    python -m benchmarks.chat_load --url http://localhost:5000 \\
+        --mongo-uri mongodb://localhost:27017/lumi
+
+Runs are reproducible for a given ``--seed``. Pass ``--json`` to write the
+report to a file for regression tracking.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+IN_MEMORY_URI = "mongodb://localhost:27017/lumi_bench"
+
+
+def percentile(values, pct):
+    """Function to compute a percentile with linear interpolation"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def rss_bytes():
+    """Function to read the resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def build_families(families, members, seed):
+    """Function to build deterministic families with one patient and caregivers"""
+    rng = random.Random(seed)
+    result = []
+    for f in range(families):
+        family_id = f"BENCHFAM{f:06d}"
+        users = []
+        for m in range(members):
+            role = "PAT" if m == 0 else "CG"
+            users.append(
+                {
+                    "userId": f"USIDB{f:06d}{m:03d}",
+                    "name": f"bench-{f}-{m}",
+                    "role": role,
+                    "family_id": family_id,
+                }
+            )
+        rng.shuffle(users)
+        result.append({"familyId": family_id, "users": users})
+    return result
+
+
+def seed_users(users_collection, families):
+    """Function to insert the simulated users, replacing any earlier run"""
+    users = [user for family in families for user in family["users"]]
+    users_collection.delete_many({"userId": {"$in": [u["userId"] for u in users]}})
+    users_collection.insert_many([dict(user) for user in users])
+
+
+def join_payload(room, user):
+    """Function to build the join-room body the mobile app sends"""
+    id_field = "CGId" if user["role"] == "CG" else "PATId"
+    return {
+        "room": room,
+        "name": user["name"],
+        "role": user["role"],
+        id_field: user["userId"],
+    }
+
+
+def summarize(
+    mode,
+    clients,
+    connect_seconds,
+    latencies,
+    sent,
+    delivered,
+    message_seconds,
+    memory_per_connection,
+    extra=None,
+):
+    """Function to assemble the benchmark report.
+
+    The connect rate covers the join-room request plus the socket handshake,
+    which is what a client does when it opens the chat screen.
+    """
+    report = {
+        "mode": mode,
+        "clients": clients,
+        "connectRatePerSecond": round(clients / connect_seconds, 1)
+        if connect_seconds
+        else None,
+        "messagesSent": sent,
+        "messagesDelivered": delivered,
+        "messagesPerSecond": round(sent / message_seconds, 1)
+        if message_seconds
+        else None,
+        "deliveriesPerSecond": round(delivered / message_seconds, 1)
+        if message_seconds
+        else None,
+        "fanoutLatencyMs": {
+            name: round(value * 1000, 3) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies, 50)),
+                ("p90", percentile(latencies, 90)),
+                ("p99", percentile(latencies, 99)),
+                ("max", max(latencies) if latencies else None),
+                ("mean", statistics.fmean(latencies) if latencies else None),
+            )
+        },
+        "memoryPerConnectionBytes": memory_per_connection,
+    }
+    if extra:
+        report.update(extra)
+    return report
+
+
+def start_in_memory_mongo():
+    """Function to route the app's MongoDB client to mongomock.
+
+    mongomock has no time-series collections, so collection options are
+    dropped and ``location_history`` becomes a regular collection.
+    """
+    import mongomock
+    import pymongo
+
+    create_collection = mongomock.database.Database.create_collection
+
+    def create_plain_collection(self, name, **kwargs):
+        return create_collection(self, name)
+
+    mongomock.database.Database.create_collection = create_plain_collection
+    patcher = mongomock.patch(servers=(("localhost", 27017),))
+    patcher.start()
+    # One client for the whole run, whatever options the app passes
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    return patcher
+
+
+def run_in_process(args, families):
+    """Function to drive the app in-process with Flask and Socket.IO test clients"""
+    os.environ.setdefault("SECRET_KEY", "chat-load-benchmark")
+    os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp(prefix="lumi-bench-"))
+
+    patcher = None
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        patcher = start_in_memory_mongo()
+        os.environ["MONGO_URI"] = IN_MEMORY_URI
+
+    try:
+        from app import create_app, mongo, socketio
+
+        app = create_app()
+        from app.chat import message_writer
+
+        seed_users(mongo.db.users, families)
+        baseline_rss = rss_bytes()
+
+        # create-room -> join-room -> connect for every simulated client
+        rooms = []
+        connect_seconds = 0.0
+        for family in families:
+            http = app.test_client()
+            response = http.post(
+                "/v1/chatroom/create-room", json={"familyId": family["familyId"]}
+            )
+            room = response.get_json()["room"]
+
+            clients = []
+            for user in family["users"]:
+                http = app.test_client()
+                started = time.perf_counter()
+                http.post("/v1/chatroom/join-room", json=join_payload(room, user))
+                sio = socketio.test_client(app, flask_test_client=http)
+                connect_seconds += time.perf_counter() - started
+                clients.append(sio)
+            rooms.append(clients)
+
+        total_clients = sum(len(clients) for clients in rooms)
+        memory_per_connection = int((rss_bytes() - baseline_rss) / total_clients)
+
+        # Emits are synchronous in-process, so the time an emit takes is the
+        # time the server needs to fan the message out to the whole room
+        rng = random.Random(args.seed)
+        latencies = []
+        sent = delivered = 0
+        started = time.perf_counter()
+        for _ in range(args.messages):
+            for clients in rooms:
+                sender = rng.choice(clients)
+                emit_started = time.perf_counter()
+                sender.emit("message", {"message": f"bench {sent}"})
+                latencies.append(time.perf_counter() - emit_started)
+                sent += 1
+                for client in clients:
+                    delivered += sum(
+                        1
+                        for packet in client.get_received()
+                        if packet["name"] == "message"
+                        and "status" not in packet["args"]
+                    )
+        message_seconds = time.perf_counter() - started
+
+        flush_started = time.perf_counter()
+        message_writer.flush()
+        flush_seconds = time.perf_counter() - flush_started
+
+        for clients in rooms:
+            for client in clients:
+                client.disconnect()
+
+        return summarize(
+            "in-process (mongomock)" if patcher else "in-process (mongodb)",
+            total_clients,
+            connect_seconds,
+            latencies,
+            sent,
+            delivered,
+            message_seconds,
+            memory_per_connection,
+            {
+                "writerFlushSeconds": round(flush_seconds, 3),
+                "writer": message_writer.stats(),
+            },
+        )
+    finally:
+        if patcher:
+            patcher.stop()
+
+
+async def run_network(args, families):
+    """Function to drive a running server over HTTP and Socket.IO"""
+    import aiohttp
+    import socketio
+    from pymongo import MongoClient
+
+    if not args.mongo_uri:
+        raise SystemExit("--mongo-uri is required to seed users for --url runs")
+    mongo_client = MongoClient(args.mongo_uri)
+    seed_users(mongo_client.get_default_database().users, families)
+
+    limit = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    counters = {"delivered": 0}
+    expected = {"deliveries": 0}
+    done = asyncio.Event()
+
+    def on_message(data):
+        text = data.get("message", "") if isinstance(data, dict) else ""
+        if text.startswith("bench|"):
+            latencies.append(time.perf_counter() - float(text.split("|")[1]))
+            counters["delivered"] += 1
+            if counters["delivered"] >= expected["deliveries"]:
+                done.set()
+
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar()) as http:
+
+        async def connect_client(room, user):
+            async with limit:
+                async with http.post(
+                    f"{args.url}/v1/chatroom/join-room", json=join_payload(room, user)
+                ) as response:
+                    cookie = response.cookies["session"].value
+                client = socketio.AsyncClient(reconnection=False)
+                client.on("message", on_message)
+                await client.connect(
+                    args.url,
+                    headers={"Cookie": f"session={cookie}"},
+                    transports=["websocket"],
+                )
+                return client
+
+        rooms = []
+        for family in families:
+            async with http.post(
+                f"{args.url}/v1/chatroom/create-room",
+                json={"familyId": family["familyId"]},
+            ) as response:
+                rooms.append(((await response.json())["room"], family["users"]))
+
+        started = time.perf_counter()
+        room_clients = [
+            await asyncio.gather(*(connect_client(room, user) for user in users))
+            for room, users in rooms
+        ]
+        connect_seconds = time.perf_counter() - started
+        total_clients = sum(len(clients) for clients in room_clients)
+
+        rng = random.Random(args.seed)
+        sent = 0
+        expected["deliveries"] = args.messages * total_clients
+        started = time.perf_counter()
+        for _ in range(args.messages):
+            for clients in room_clients:
+                sender = rng.choice(clients)
+                await sender.emit(
+                    "message", {"message": f"bench|{time.perf_counter()}"}
+                )
+                sent += 1
+            await asyncio.sleep(args.interval)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        message_seconds = time.perf_counter() - started
+
+        await asyncio.gather(
+            *(client.disconnect() for clients in room_clients for client in clients)
+        )
+
+    return summarize(
+        "network",
+        total_clients,
+        connect_seconds,
+        latencies,
+        sent,
+        counters["delivered"],
+        message_seconds,
+        None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--families", type=int, default=200)
+    parser.add_argument("--members", type=int, default=5, help="clients per family")
+    parser.add_argument(
+        "--messages", type=int, default=20, help="messages sent per room"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mongo-uri", help="local MongoDB instead of mongomock")
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument(
+        "--interval", type=float, default=0.0, help="pause between message rounds"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="wait for deliveries (network)"
+    )
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    families = build_families(args.families, args.members, args.seed)
+    if args.url:
+        report = asyncio.run(run_network(args, families))
+    else:
+        report = run_in_process(args, families)
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
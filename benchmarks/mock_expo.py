@@ -0,0 +1,151 @@
+"""Local stand-in for the Expo push service.
+
+Implements ``/--/api/v2/push/send`` and ``/--/api/v2/push/getReceipts``
+with configurable latency, throttling and failure injection, so push
+delivery can be exercised without real devices::
+
+    python -m benchmarks.mock_expo --port 8765 --latency 0.05 --throttle 0.05
+
+Point the server at it with
+``EXPO_PUSH_URL=http://localhost:8765/--/api/v2/push/send`` and
+``EXPO_RECEIPTS_URL=http://localhost:8765/--/api/v2/push/getReceipts``.
+Tokens containing ``unregistered`` get a ``DeviceNotRegistered`` ticket.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PUSH_PATH = "/--/api/v2/push/send"
+RECEIPTS_PATH = "/--/api/v2/push/getReceipts"
+
+
+class MockExpoServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, address, latency=0.0, throttle=0.0, error_rate=0.0, retry_after=1, seed=0
+    ):
+        super().__init__(address, MockExpoHandler)
+        self.latency = latency
+        self.throttle = throttle
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "messages": 0, "throttled": 0, "errors": 0}
+        self.receipts = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+
+class MockExpoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.roll() < server.throttle:
+            server.count("throttled")
+            return self.reply(
+                429,
+                {"errors": [{"code": "TOO_MANY_REQUESTS"}]},
+                {"Retry-After": str(server.retry_after)},
+            )
+        if server.roll() < server.error_rate:
+            server.count("errors")
+            return self.reply(503, {"errors": [{"code": "INTERNAL_SERVER_ERROR"}]})
+
+        if self.path == PUSH_PATH:
+            messages = payload if isinstance(payload, list) else [payload]
+            if len(messages) > 100:
+                return self.reply(
+                    400, {"errors": [{"code": "PUSH_TOO_MANY_NOTIFICATIONS"}]}
+                )
+            server.count("messages", len(messages))
+            return self.reply(200, {"data": [self.ticket(m) for m in messages]})
+        if self.path == RECEIPTS_PATH:
+            with server.lock:
+                receipts = {
+                    ticket_id: server.receipts.pop(ticket_id)
+                    for ticket_id in payload.get("ids", [])
+                    if ticket_id in server.receipts
+                }
+            return self.reply(200, {"data": receipts})
+        return self.reply(404)
+
+    def ticket(self, message):
+        if "unregistered" in str(message.get("to")):
+            return {
+                "status": "error",
+                "message": f"{message.get('to')} is not a registered push token",
+                "details": {"error": "DeviceNotRegistered"},
+            }
+        ticket_id = str(uuid.uuid4())
+        with self.server.lock:
+            self.server.receipts[ticket_id] = {"status": "ok"}
+        return {"status": "ok", "id": ticket_id}
+
+
+def start_mock_expo(port=0, **options):
+    """Function to run a mock Expo server in a background thread"""
+    server = MockExpoServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--throttle", type=float, default=0.0, help="429 rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 rate")
+    args = parser.parse_args()
+
+    server = MockExpoServer(
+        ("127.0.0.1", args.port),
+        latency=args.latency,
+        throttle=args.throttle,
+        error_rate=args.error_rate,
+    )
+    print(f"Mock Expo listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Throughput benchmark for Expo push delivery in ``app/push.py``.
+
+Sends a burst of notifications, like the reminders that fire on the hour,
+to a local mock Expo server and compares one ``requests.post`` per message
+with the batched, pooled and retrying ``ExpoPushClient``::
+
+    python -m benchmarks.push_throughput --messages 2000 --latency 0.05
+
+Use ``--throttle`` and ``--error-rate`` to inject 429 and 503 responses.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import time
+
+import requests
+
+from benchmarks.mock_expo import PUSH_PATH, RECEIPTS_PATH, start_mock_expo
+
+
+def load_push_module():
+    """Function to import ``app/push.py`` without building the Flask app.
+
+    Importing it through the ``app`` package would connect to MongoDB and
+    load every model, none of which push delivery needs.
+    """
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "app", "push.py")
+    spec = importlib.util.spec_from_file_location("lumi_push", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_messages(count):
+    """Function to build a burst of reminder notifications"""
+    return [
+        {
+            "to": f"ExponentPushToken[bench-{i:06d}]",
+            "title": "Reminder",
+            "body": f"Reminder {i}",
+            "sound": "default",
+        }
+        for i in range(count)
+    ]
+
+
+def run_sequential(url, messages):
+    """Function to send one message per request, as the old code path did"""
+    delivered = 0
+    for message in messages:
+        response = requests.post(url, json=message)
+        if response.ok:
+            delivered += 1
+    return delivered
+
+
+def run_batched(client, messages):
+    """Function to send the burst through the batched client"""
+    tickets = client.send(messages)
+    return sum(1 for ticket in tickets if ticket.get("status") == "ok")
+
+
+def measure(name, func, messages, server):
+    requests_before = server.stats["requests"]
+    started = time.perf_counter()
+    delivered = func(messages)
+    seconds = time.perf_counter() - started
+    return {
+        "mode": name,
+        "messages": len(messages),
+        "delivered": delivered,
+        "seconds": round(seconds, 3),
+        "messagesPerSecond": round(len(messages) / seconds, 1),
+        "httpRequests": server.stats["requests"] - requests_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--throttle", type=float, default=0.0, help="429 rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 rate")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--skip-sequential", action="store_true", help="only run the batched client"
+    )
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    server = start_mock_expo(
+        latency=args.latency,
+        throttle=args.throttle,
+        error_rate=args.error_rate,
+        retry_after=0,
+    )
+    messages = build_messages(args.messages)
+    client = load_push_module().ExpoPushClient(
+        push_url=server.url + PUSH_PATH,
+        receipts_url=server.url + RECEIPTS_PATH,
+        concurrency=args.concurrency,
+        backoff=0.05,
+    )
+
+    report = []
+    if not args.skip_sequential:
+        report.append(
+            measure(
+                "sequential",
+                lambda m: run_sequential(server.url + PUSH_PATH, m),
+                messages,
+                server,
+            )
+        )
+    report.append(
+        measure("batched", lambda m: run_batched(client, m), messages, server)
+    )
+    server.shutdown()
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Serialization benchmark for the JSON codecs in ``app/serialization.py``.
+
+Encodes a large reminder list, as returned by ``/v1/reminders``, and a chat
+history page, as sent to Socket.IO clients, with Flask-PyMongo's
+``bson.json_util`` provider, the stdlib ``json`` module and orjson::
+
+    python -m benchmarks.serialization --reminders 5000 --messages 200
+
+The ``bson``/``json`` rows include the ``str(_id)`` conversion routes used
+to do before calling ``jsonify``.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId, json_util
+from bson.json_util import RELAXED_JSON_OPTIONS
+
+
+def load_serialization_module():
+    """Function to import ``app/serialization.py`` without building the Flask app"""
+    path = os.path.join(os.path.dirname(__file__), os.pardir, "app", "serialization.py")
+    spec = importlib.util.spec_from_file_location("lumi_serialization", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_reminders(count):
+    """Function to build reminder documents as they come out of MongoDB"""
+    return [
+        {
+            "_id": ObjectId(),
+            "title": f"Take medicine {i}",
+            "description": "Two tablets after breakfast with a glass of water",
+            "date": "2025-04-01",
+            "time": "09:30",
+            "status": "pending",
+            "urgent": i % 3 == 0,
+            "important": i % 2 == 0,
+            "remId": f"0A8ZE8NV8{i:04d}",
+        }
+        for i in range(count)
+    ]
+
+
+def build_history(count):
+    """Function to build one page of chat messages as they come out of MongoDB"""
+    started = datetime(2025, 4, 1, 9, 0)
+    return [
+        {
+            "_id": ObjectId(),
+            "roomId": "QWERTYUI",
+            "name": f"Member {i % 5}",
+            "message": "On my way, I will be there in ten minutes 🙂",
+            "createdAt": started + timedelta(seconds=i),
+            "user": f"USID0A8ZE8NV8{i % 5:04d}",
+        }
+        for i in range(count)
+    ]
+
+
+def convert_reminders(reminders):
+    """Function to convert reminders the way get_reminders used to"""
+    return [{**reminder, "_id": str(reminder["_id"])} for reminder in reminders]
+
+
+def convert_history(messages):
+    """Function to convert messages the way the chat history used to"""
+    return [
+        {
+            **message,
+            "_id": str(message["_id"]),
+            "createdAt": message["createdAt"]
+            .replace(tzinfo=timezone.utc)
+            .isoformat(),
+        }
+        for message in messages
+    ]
+
+
+def measure(payload, encoder, func, rounds):
+    size = len(func())
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    seconds = (time.perf_counter() - started) / rounds
+    return {
+        "payload": payload,
+        "encoder": encoder,
+        "milliseconds": round(seconds * 1000, 3),
+        "bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reminders", type=int, default=5000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    serialization = load_serialization_module()
+    stdlib = serialization.StdlibCodec()
+    codecs = [stdlib]
+    if serialization.orjson is not None:
+        codecs.append(serialization.OrjsonCodec())
+
+    reminders = build_reminders(args.reminders)
+    history = build_history(args.messages)
+    response = {"status": "success", "reminders": reminders}
+    packet = {"messages": history, "nextCursor": None, "hasMore": False}
+
+    report = [
+        measure(
+            "reminders",
+            "bson",
+            lambda: json_util.dumps(
+                {**response, "reminders": convert_reminders(reminders)},
+                json_options=RELAXED_JSON_OPTIONS,
+            ),
+            args.rounds,
+        ),
+        measure(
+            "reminders",
+            "json",
+            lambda: json.dumps(
+                {**response, "reminders": convert_reminders(reminders)},
+                separators=(",", ":"),
+            ),
+            args.rounds,
+        ),
+    ]
+    report += [
+        measure(
+            "reminders",
+            f"{codec.name} codec",
+            lambda c=codec: c.dumpb(response),
+            args.rounds,
+        )
+        for codec in codecs
+    ]
+    # Socket.IO passes separators, as python-socketio does for every packet
+    report.append(
+        measure(
+            "chat history",
+            "json",
+            lambda: json.dumps(
+                {**packet, "messages": convert_history(history)},
+                separators=(",", ":"),
+            ),
+            args.rounds,
+        )
+    )
+    report += [
+        measure(
+            "chat history",
+            f"{codec.name} codec",
+            lambda c=codec: c.dumps(packet, separators=(",", ":")),
+            args.rounds,
+        )
+        for codec in codecs
+    ]
+
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,5 @@
 import os
 
-import pyrebase
-
 
 class Config:
     # General app settings
@@ -11,8 +9,137 @@ class Config:
     JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
     DEBUG = os.getenv("DEBUG", "False") == "True"
     GEMINI_API_KEY = os.getenv("GEMINIAPI_KEY")
+    METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+    # Set to a directory shared by the gunicorn workers so /metrics reports
+    # the sum over every worker instead of whichever one answers
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR")
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+    # Encoder for API responses and Socket.IO packets: "orjson" or "json"
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson")
+
+    # Logging: LOG_FORMAT is "text" or "json". Debug and info records are
+    # limited per call site per second; hot-path debug output is sampled
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if DEBUG else "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+    LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+
+    # Per-request MongoDB profiling; routes can override the budget with
+    # @query_budget. The debug headers are on by default in DEBUG mode
+    QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "10"))
+    QUERY_N_PLUS_ONE_THRESHOLD = int(os.getenv("QUERY_N_PLUS_ONE_THRESHOLD", "5"))
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+    QUERY_PROFILE_HEADER = os.getenv("QUERY_PROFILE_HEADER", str(DEBUG)) == "True"
+
+    # Keys the permutation that turns the room counter into room codes
+    ROOM_CODE_KEY = os.getenv("ROOM_CODE_KEY", SECRET_KEY or "lumi-room-codes")
+
+    # Chat settings
+    CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+    CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", "200"))
+    CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+    CHAT_WRITE_FLUSH_INTERVAL = float(os.getenv("CHAT_WRITE_FLUSH_INTERVAL", "0.5"))
+    CHAT_WRITE_QUEUE_SIZE = int(os.getenv("CHAT_WRITE_QUEUE_SIZE", "10000"))
+    # Failed batches are retried while the queue has room, then appended here
+    # and written back with "flask --app run chat replay-dead-letters"
+    CHAT_WRITE_MAX_BACKOFF = float(os.getenv("CHAT_WRITE_MAX_BACKOFF", "5"))
+    CHAT_DEAD_LETTER_PATH = os.getenv("CHAT_DEAD_LETTER_PATH", "chat_dead_letters.jsonl")
+    ROOM_SNAPSHOT_INTERVAL = float(os.getenv("ROOM_SNAPSHOT_INTERVAL", "5"))
+    # Bounds how long a worker can miss a room deleted by another worker
+    # should its tombstone (kept for a week) be lost
+    ROOM_RELOAD_INTERVAL = float(os.getenv("ROOM_RELOAD_INTERVAL", "300"))
+
+    # Location history settings
+    LOCATION_HISTORY_TTL_DAYS = int(os.getenv("LOCATION_HISTORY_TTL_DAYS", "30"))
+    LOCATION_BATCH_MAX_FIXES = int(os.getenv("LOCATION_BATCH_MAX_FIXES", "1000"))
+    LOCATION_HISTORY_MAX_RESULTS = int(
+        os.getenv("LOCATION_HISTORY_MAX_RESULTS", "5000")
+    )
+    # Raw fixes are kept for this long; older history lives only as simplified
+    # per-bucket polylines that stay within the error bound
+    LOCATION_RAW_RETENTION_HOURS = int(os.getenv("LOCATION_RAW_RETENTION_HOURS", "24"))
+    LOCATION_TRACK_BUCKET_MINUTES = int(
+        os.getenv("LOCATION_TRACK_BUCKET_MINUTES", "60")
+    )
+    # History reads serve the simplified track as soon as a bucket is
+    # compacted, which happens this long after the bucket closes
+    LOCATION_COMPACT_AFTER_MINUTES = int(
+        os.getenv("LOCATION_COMPACT_AFTER_MINUTES", "60")
+    )
+    # Every worker checks this often, and one of them compacts the closed
+    # buckets of every user, including devices that stopped reporting
+    LOCATION_COMPACT_SWEEP_SECONDS = float(
+        os.getenv("LOCATION_COMPACT_SWEEP_SECONDS", "600")
+    )
+    LOCATION_SIMPLIFY_EPSILON_M = float(os.getenv("LOCATION_SIMPLIFY_EPSILON_M", "10"))
+
+    # Location coalescing: pings closer than the epsilon to the last stored
+    # fix are held in memory and flushed on the interval
+    LOCATION_COALESCE_DISTANCE_M = float(
+        os.getenv("LOCATION_COALESCE_DISTANCE_M", "15")
+    )
+    LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "60"))
+    LOCATION_MIN_PING_INTERVAL = int(os.getenv("LOCATION_MIN_PING_INTERVAL", "5"))
+    LOCATION_MAX_PING_INTERVAL = int(os.getenv("LOCATION_MAX_PING_INTERVAL", "120"))
+
+    # Geofence settings, distances in metres
+    GEOFENCE_DEFAULT_RADIUS_M = float(os.getenv("GEOFENCE_DEFAULT_RADIUS_M", "200"))
+    GEOFENCE_HYSTERESIS_M = float(os.getenv("GEOFENCE_HYSTERESIS_M", "25"))
+    GEOFENCE_RELOAD_SECONDS = float(os.getenv("GEOFENCE_RELOAD_SECONDS", "60"))
+    # Fixes are recorded on the request path and checked by a sweep this often
+    GEOFENCE_SWEEP_SECONDS = float(os.getenv("GEOFENCE_SWEEP_SECONDS", "2"))
+    # Fixes older than this are no longer checked against the safe zone
+    GEOFENCE_MAX_FIX_AGE_SECONDS = float(
+        os.getenv("GEOFENCE_MAX_FIX_AGE_SECONDS", "900")
+    )
+
+    # Multi-worker Socket.IO settings; leave unset for a single process.
+    # SOCKETIO_MESSAGE_QUEUE takes a redis:// URL, or memory:// for an
+    # in-process kombu broker in tests
+    SOCKETIO_MESSAGE_QUEUE = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+    SOCKETIO_CHANNEL = os.getenv("SOCKETIO_CHANNEL", "lumi-socketio")
+    # redis:// URL for sessions and presence shared by workers, or memory://
+    PRESENCE_STORE_URL = os.getenv("PRESENCE_STORE_URL")
+
+    # Expo push settings
+    EXPO_PUSH_URL = os.getenv("EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
+    EXPO_RECEIPTS_URL = os.getenv(
+        "EXPO_RECEIPTS_URL", "https://exp.host/--/api/v2/push/getReceipts"
+    )
+    EXPO_ACCESS_TOKEN = os.getenv("EXPO_ACCESS_TOKEN")
+    PUSH_CONCURRENCY = int(os.getenv("PUSH_CONCURRENCY", "4"))
+    PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", "10"))
+    PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "4"))
+    # Expo recommends waiting about 15 minutes before fetching receipts
+    PUSH_RECEIPT_DELAY = float(os.getenv("PUSH_RECEIPT_DELAY", "900"))
+    PUSH_RECEIPT_CHECK_INTERVAL = float(os.getenv("PUSH_RECEIPT_CHECK_INTERVAL", "300"))
+
+    # Device tokens change rarely; other workers see changes within the TTL
+    TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+    TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "100000"))
+    # User records change more often (names, families, pictures), so the TTL
+    # that bounds staleness across workers is shorter
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+
+    # Notification job queue
+    NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "4"))
+    NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", "5"))
+    NOTIFICATION_LEASE_SECONDS = float(os.getenv("NOTIFICATION_LEASE_SECONDS", "120"))
+
+    # Password hashing: bcrypt cost, hashing threads per worker, and how many
+    # hashes may be pending before sign-up and sign-in answer 503
+    BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
 
-    # Firebase settings
+    # Firebase settings. AUTH_BACKEND=stub swaps Firebase for an in-memory
+    # provider in tests; logins are checked against the local bcrypt hash
+    # first either way
+    AUTH_BACKEND = os.getenv("AUTH_BACKEND", "firebase")
+    FIREBASE_TIMEOUT = float(os.getenv("FIREBASE_TIMEOUT", "5"))
+    FIREBASE_POOL_SIZE = int(os.getenv("FIREBASE_POOL_SIZE", "10"))
     FIREBASE_API_KEY = os.getenv("API_KEY")
     FIREBASE_AUTH_DOMAIN = os.getenv("AUTH_DOMAIN")
     FIREBASE_PROJECT_ID = os.getenv("PROJECTID")
@@ -21,17 +148,3 @@ class Config:
     FIREBASE_MESSAGING_SENDER_ID = os.getenv("MESSAGINGSENDERID")
     FIREBASE_APP_ID = os.getenv("APPID")
 
-    # Initialize Firebase app
-    @classmethod
-    def init_firebase(cls):
-        firebase_config = {
-            "apiKey": cls.FIREBASE_API_KEY,
-            "authDomain": cls.FIREBASE_AUTH_DOMAIN,
-            "projectId": cls.FIREBASE_PROJECT_ID,
-            "databaseURL": cls.FIREBASE_DATABASE_URL,
-            "storageBucket": cls.FIREBASE_STORAGE_BUCKET,
-            "messagingSenderId": cls.FIREBASE_MESSAGING_SENDER_ID,
-            "appId": cls.FIREBASE_APP_ID,
-        }
-        firebase = pyrebase.initialize_app(firebase_config)
-        return firebase.auth()
@@ -0,0 +1,54 @@
+import gc
+import os
+
+# Socket.IO needs an async worker. Eventlet has to patch the standard
+# library before the app is imported, and with preload_app the app is
+# imported in the master
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "eventlet")
+if worker_class == "eventlet":
+    import eventlet
+
+    eventlet.monkey_patch()
+
+wsgi_app = "wsgi:app"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+# Build the app, the YOLO model and the face galleries once in the master;
+# workers share those pages copy-on-write instead of loading their own copy
+preload_app = True
+
+
+def on_starting(server):
+    # Metric files left by a previous run would be added to this run's totals
+    directory = os.getenv("METRICS_MULTIPROC_DIR")
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith((".json", ".tmp")):
+                os.remove(os.path.join(directory, name))
+
+
+def when_ready(server):
+    # Objects loaded so far are moved out of the collector's generations, so
+    # a worker's garbage collection does not touch, and copy, shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Each worker opens its own MongoDB client and creates indexes, and starts
+    # its own log listener, before taking requests
+    from app import mongo
+    from app.log import start_listeners
+
+    mongo.connect()
+    start_listeners()
+
+
+def child_exit(server, worker):
+    # Keep the exited worker's counters in the totals but drop its gauges
+    from app.metrics import registry
+
+    registry.mark_process_dead(worker.pid)
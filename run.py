@@ -1,4 +1,6 @@
-from app import app, socketio
+from app import create_app, socketio
+
+app = create_app()
 
 if __name__ == "__main__":
     socketio.run(app, debug=True, host="0.0.0.0")
@@ -0,0 +1,4 @@
+from app import create_app
+
+# gunicorn entry point; see gunicorn.conf.py for the worker settings
+app = create_app()